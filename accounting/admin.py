@@ -7,7 +7,9 @@ from .models import (
     Contract,
     DepotAsset,
     DepotAssetTransaction,
+    DepotAssetValuation,
     Transaction,
+    TransactionArchive,
 )
 
 # Register your models here.
@@ -17,4 +19,6 @@ admin.site.register(Transaction)
 admin.site.register(BankDepot)
 admin.site.register(DepotAsset)
 admin.site.register(DepotAssetTransaction)
+admin.site.register(DepotAssetValuation)
 admin.site.register(Contract)
+admin.site.register(TransactionArchive)
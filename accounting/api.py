@@ -0,0 +1,386 @@
+"""
+Read-only JSON API (version 1) for external tooling. All endpoints use the session of the logged-in user and
+only return data of bank accounts the user is allowed to view.
+"""
+
+import datetime
+import decimal
+import functools
+import hashlib
+
+import orjson
+from django.db.models import Count, F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, TruncMonth
+from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+
+from .models import (
+    UNCATEGORIZED,
+    BankAccount,
+    TransactionArchive,
+    TransactionType,
+    check_user_permissions,
+    get_bank_accounts_for_user,
+)
+from .search import encode_cursor, filter_after_cursor
+
+API_PAGE_LIMIT = 100
+API_MAX_PAGE_LIMIT = 1000
+
+# fields of a transaction that can be selected with the parameter "fields", mapped to the queried values
+TRANSACTION_FIELDS = {
+    "id": "id",
+    "date_issue": "date_issue",
+    "date_booking": "date_booking",
+    "recipient": "recipient",
+    "amount": "amount",
+    "subject": "subject",
+    "category": "category__name",
+    "contract": "contract__name",
+    "full_subject_string": "full_subject_string",
+}
+DEFAULT_TRANSACTION_FIELDS = [
+    "id",
+    "date_issue",
+    "date_booking",
+    "recipient",
+    "amount",
+    "subject",
+    "category",
+    "contract",
+]
+
+TRANSACTION_TYPES = {
+    "all": TransactionType.ALL,
+    "income": TransactionType.INCOME,
+    "expense": TransactionType.EXPENSE,
+}
+
+
+class ApiError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def _json_default(obj):
+    # amounts are returned as strings to keep their exact decimal value
+    if isinstance(obj, decimal.Decimal):
+        return str(obj)
+    raise TypeError
+
+
+def _round_amount(amount):
+    # sums computed by SQLite are floating point numbers
+    return decimal.Decimal(amount).quantize(decimal.Decimal("0.01"))
+
+
+def _json_response(request, data):
+    """
+    Serialise the data and answer with 304 Not Modified if the client already has the same content (If-None-Match).
+    """
+    content = orjson.dumps(data, default=_json_default)
+    etag = quote_etag(hashlib.md5(content).hexdigest())
+
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(content, content_type="application/json")
+    response["ETag"] = etag
+    response["Cache-Control"] = "private, no-cache"
+    return response
+
+
+def _error_response(error):
+    return HttpResponse(
+        orjson.dumps({"error": error.message}),
+        status=error.status,
+        content_type="application/json",
+    )
+
+
+def api_view(func):
+    """
+    Turn ApiErrors raised by the view into JSON error responses.
+    """
+
+    @functools.wraps(func)
+    def wrapper(request, *args, **kwargs):
+        try:
+            return func(request, *args, **kwargs)
+        except ApiError as error:
+            return _error_response(error)
+
+    return wrapper
+
+
+def _parse_date(request, name):
+    value = request.GET.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise ApiError(f"{name} has to be a date in the format YYYY-MM-DD.")
+
+
+def _parse_decimal(request, name):
+    value = request.GET.get(name)
+    if not value:
+        return None
+    try:
+        number = decimal.Decimal(value)
+    except decimal.InvalidOperation:
+        raise ApiError(f"{name} has to be a number.")
+    # NaN and Infinity are parsed as decimals but cannot be compared in a query
+    if not number.is_finite():
+        raise ApiError(f"{name} has to be a finite number.")
+    return number
+
+
+def _parse_categories(request):
+    try:
+        return [int(category) for category in request.GET.getlist("categories")]
+    except ValueError:
+        raise ApiError("categories have to be ids of categories.")
+
+
+def _parse_limit(request):
+    value = request.GET.get("limit", API_PAGE_LIMIT)
+    try:
+        limit = int(value)
+    except ValueError:
+        raise ApiError("limit has to be an integer.")
+    if not 1 <= limit <= API_MAX_PAGE_LIMIT:
+        raise ApiError(f"limit has to be between 1 and {API_MAX_PAGE_LIMIT}.")
+    return limit
+
+
+def _parse_fields(request):
+    value = request.GET.get("fields")
+    if not value:
+        return DEFAULT_TRANSACTION_FIELDS
+    fields = [field.strip() for field in value.split(",") if field.strip()]
+    unknown = [field for field in fields if field not in TRANSACTION_FIELDS]
+    if unknown:
+        raise ApiError(f"Unknown fields: {', '.join(unknown)}.")
+    return fields
+
+
+def _get_account(request, pk):
+    account = get_object_or_404(BankAccount, pk=pk)
+    check_user_permissions(request.user, account)
+    return account
+
+
+def _annotate_balance(accounts):
+    # transactions of archived years are included with the totals of their archives
+    archived_amount = (
+        TransactionArchive.objects.filter(bank_account=OuterRef("pk"))
+        .order_by()
+        .values("bank_account")
+        .annotate(total=Sum("total_amount"))
+        .values("total")
+    )
+    return accounts.annotate(
+        balance=F("current_amount")
+        + Coalesce(Sum("belongs_to__amount"), Value(decimal.Decimal(0)))
+        + Coalesce(Subquery(archived_amount), Value(decimal.Decimal(0)))
+    )
+
+
+def _get_archived_years(accounts):
+    archived_years = {}
+    for account_pk, year in (
+        TransactionArchive.objects.filter(bank_account__in=accounts)
+        .order_by("year")
+        .values_list("bank_account", "year")
+    ):
+        archived_years.setdefault(account_pk, []).append(year)
+    return archived_years
+
+
+def _serialize_account(account, archived_years):
+    return {
+        "id": account.pk,
+        "name": account.name,
+        "bank": account.bank,
+        "owner": account.owner.username,
+        "balance": _round_amount(account.balance),
+        # transactions of these years are only contained in the balance and the monthly aggregates
+        "archived_years": archived_years.get(account.pk, []),
+    }
+
+
+@api_view
+def accounts_api_view(request):
+    """
+    All bank accounts the user is allowed to view with their current balance and archived years.
+    """
+    accounts = _annotate_balance(
+        get_bank_accounts_for_user(request.user)
+        .select_related("owner")
+        .only("name", "bank", "current_amount", "owner__username")
+    ).order_by("pk")
+    archived_years = _get_archived_years(accounts)
+    return _json_response(
+        request,
+        {
+            "results": [
+                _serialize_account(account, archived_years) for account in accounts
+            ]
+        },
+    )
+
+
+@api_view
+def account_api_view(request, pk):
+    """
+    A single bank account with its current balance and archived years.
+    """
+    _get_account(request, pk)
+    account = _annotate_balance(
+        BankAccount.objects.filter(pk=pk)
+        .select_related("owner")
+        .only("name", "bank", "current_amount", "owner__username")
+    ).get()
+    return _json_response(
+        request, _serialize_account(account, _get_archived_years([account]))
+    )
+
+
+@api_view
+def transactions_api_view(request, pk):
+    """
+    The transactions of a bank account, newest first. Supports the filters of the transactions overview
+    (q, date_start, date_end, amount_min, amount_max, categories, type), the selection of the returned fields
+    (fields=id,amount,...) and cursor pagination: the response contains the cursor of the next page, which is
+    passed as parameter "cursor" to get the following transactions. Transactions of archived years are not
+    returned, these years are listed in "archived_years".
+    """
+    account = _get_account(request, pk)
+    fields = _parse_fields(request)
+    limit = _parse_limit(request)
+    transaction_type = request.GET.get("type", "all")
+    if transaction_type not in TRANSACTION_TYPES:
+        raise ApiError(f"type has to be one of {', '.join(TRANSACTION_TYPES)}.")
+
+    transactions = account.get_transactions(
+        search_term=request.GET.get("q"),
+        date_start=_parse_date(request, "date_start"),
+        date_end=_parse_date(request, "date_end"),
+        amount_min=_parse_decimal(request, "amount_min"),
+        amount_max=_parse_decimal(request, "amount_max"),
+        categories=_parse_categories(request),
+        transaction_type=TRANSACTION_TYPES[transaction_type],
+    )
+
+    # keyset pagination on (date_issue, id), the page is found via the index instead of skipping an offset
+    cursor = request.GET.get("cursor")
+    if cursor:
+        try:
+            transactions = filter_after_cursor(transactions, cursor)
+        except ValueError:
+            raise ApiError("Invalid cursor.")
+
+    # get_transactions orders with reverse(), which would also invert the ordering of the cursor. The cursor values
+    # are always queried (as the last two values), but only returned if selected.
+    rows = list(
+        transactions.reverse()
+        .order_by("-date_issue", "-pk")
+        .values_list(
+            *[TRANSACTION_FIELDS[field] for field in fields], "date_issue", "pk"
+        )[: limit + 1]
+    )
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(*rows[-1][-2:])
+
+    results = [dict(zip(fields, row)) for row in rows]
+    return _json_response(
+        request,
+        {
+            "results": results,
+            "next_cursor": next_cursor,
+            "archived_years": sorted(account.get_archived_years()),
+        },
+    )
+
+
+@api_view
+def monthly_category_aggregates_api_view(request, pk):
+    """
+    Sum of income, expenses and number of transactions per month and category of a bank account, optionally
+    limited by date_start and date_end. Archived years are taken from the monthly rollups of their archives,
+    their months are included completely.
+    """
+    account = _get_account(request, pk)
+    transactions = account.belongs_to.all()
+
+    date_start = _parse_date(request, "date_start")
+    if date_start is not None:
+        transactions = transactions.filter(date_issue__gte=date_start)
+    date_end = _parse_date(request, "date_end")
+    if date_end is not None:
+        transactions = transactions.filter(date_issue__lte=date_end)
+
+    aggregates = (
+        transactions.annotate(month=TruncMonth("date_issue"))
+        .values("month", category_name=F("category__name"))
+        .annotate(
+            income=Coalesce(
+                Sum("amount", filter=Q(amount__gte=0)), Value(decimal.Decimal(0))
+            ),
+            expenses=Coalesce(
+                Sum("amount", filter=Q(amount__lt=0)), Value(decimal.Decimal(0))
+            ),
+            count=Count("pk"),
+        )
+        .order_by("month", "category_name")
+    )
+
+    results = {
+        (aggregate["month"].strftime("%Y-%m"), aggregate["category_name"]): {
+            "income": _round_amount(aggregate["income"]),
+            "expenses": _round_amount(aggregate["expenses"]),
+            "count": aggregate["count"],
+        }
+        for aggregate in aggregates
+    }
+
+    for archive in account.archives.all():
+        for month, categories in archive.monthly_rollups.items():
+            month_start = datetime.date.fromisoformat(f"{month}-01")
+            if (date_start and month_start < date_start.replace(day=1)) or (
+                date_end and month_start > date_end
+            ):
+                continue
+            for category, rollup in categories.items():
+                category = None if category == UNCATEGORIZED else category
+                result = results.setdefault(
+                    (month, category),
+                    {
+                        "income": _round_amount(0),
+                        "expenses": _round_amount(0),
+                        "count": 0,
+                    },
+                )
+                result["income"] += decimal.Decimal(rollup["income"])
+                result["expenses"] += decimal.Decimal(rollup["expenses"])
+                result["count"] += rollup["count"]
+
+    return _json_response(
+        request,
+        {
+            "results": [
+                {"month": month, "category": category, **results[month, category]}
+                for month, category in sorted(
+                    results, key=lambda key: (key[0], key[1] or "")
+                )
+            ]
+        },
+    )
@@ -1,6 +1,17 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete
 
 
 class AccountingConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "accounting"
+
+    def ready(self):
+        from .data_version import connect_signals
+        from .models import ContractFile, delete_unreferenced_contract_file
+        from .sqlite import configure_sqlite_connection
+
+        connection_created.connect(configure_sqlite_connection)
+        connect_signals()
+        post_delete.connect(delete_unreferenced_contract_file, sender=ContractFile)
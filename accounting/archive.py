@@ -0,0 +1,315 @@
+import datetime
+import hashlib
+import io
+from decimal import Decimal
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.functions import ExtractYear
+
+from .models import (
+    UNCATEGORIZED,
+    Category,
+    Contract,
+    Transaction,
+    TransactionArchive,
+)
+
+ARCHIVE_COMPRESSION = "zstd"
+
+ARCHIVE_SCHEMA = pa.schema(
+    [
+        ("date_issue", pa.date32()),
+        ("date_booking", pa.date32()),
+        ("recipient", pa.string()),
+        ("amount", pa.decimal128(10, 2)),
+        ("subject", pa.string()),
+        ("full_subject_string", pa.string()),
+        ("category_id", pa.int64()),
+        ("category", pa.string()),
+        ("contract_id", pa.int64()),
+        ("contract", pa.string()),
+    ]
+)
+# values of a transaction stored in the archive, in the order of ARCHIVE_SCHEMA
+_ARCHIVE_VALUES = [
+    "date_issue",
+    "date_booking",
+    "recipient",
+    "amount",
+    "subject",
+    "full_subject_string",
+    "category_id",
+    "category__name",
+    "contract_id",
+    "contract__name",
+]
+
+
+class ArchiveChecksumError(Exception):
+    pass
+
+
+def get_closed_years(account, before):
+    """
+    Years before the given year with transactions of the account in the transaction table.
+    """
+    dates = account.belongs_to.filter(date_issue__year__lt=before).dates(
+        "date_issue", "year"
+    )
+    return [date.year for date in dates]
+
+
+def _monthly_rollups(df):
+    rollups = {}
+    months = df.date_issue.map(lambda date: f"{date:%Y-%m}")
+    categories = df.category.fillna(UNCATEGORIZED)
+    for (month, category), amounts in df.amount.groupby([months, categories]):
+        rollups.setdefault(month, {})[category] = {
+            "income": str(sum(amounts[amounts >= 0], Decimal(0))),
+            "expenses": str(sum(amounts[amounts < 0], Decimal(0))),
+            "count": len(amounts),
+        }
+    return rollups
+
+
+@transaction.atomic
+def archive_year(account, year):
+    """
+    Move the transactions of the account in the given year from the transaction table into a compressed Parquet
+    file. Transactions of a year that was archived before are appended to its archive.
+    Returns the archive or None if the account has no transactions in this year.
+    """
+    if year >= datetime.date.today().year:
+        raise ValueError("Only closed years can be archived.")
+
+    transactions = account.belongs_to.filter(date_issue__year=year)
+    rows = list(transactions.order_by("date_issue", "pk").values_list(*_ARCHIVE_VALUES))
+    if not rows:
+        return None
+
+    table = pa.Table.from_arrays(
+        [
+            pa.array(values, type=field.type)
+            for values, field in zip(zip(*rows), ARCHIVE_SCHEMA)
+        ],
+        schema=ARCHIVE_SCHEMA,
+    )
+    archive = TransactionArchive.objects.filter(bank_account=account, year=year).first()
+    if archive is not None:
+        table = pa.concat_tables([_read_table(archive), table]).sort_by("date_issue")
+
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer, compression=ARCHIVE_COMPRESSION)
+    content = buffer.getvalue()
+
+    df = table.to_pandas()
+    amounts = df.amount.map(Decimal)
+    if archive is None:
+        archive = TransactionArchive(bank_account=account, year=year)
+    else:
+        # the previous file is only deleted once the new one is committed, a rollback keeps the archive intact
+        _delete_file_on_commit(archive.file)
+    # the storage picks a new name if the previous file still exists
+    archive.file.save(f"{account.pk}/{year}.parquet", ContentFile(content), save=False)
+    archive.checksum = hashlib.sha256(content).hexdigest()
+    archive.row_count = len(df)
+    archive.total_amount = amounts.sum()
+    archive.income = amounts[amounts >= 0].sum()
+    archive.expenses = amounts[amounts < 0].sum()
+    archive.monthly_rollups = _monthly_rollups(df.assign(amount=amounts))
+    archive.save()
+
+    transactions.delete()
+    return archive
+
+
+def _delete_file_on_commit(file):
+    storage, name = file.storage, file.name
+    transaction.on_commit(lambda: storage.delete(name))
+
+
+def _read_table(archive):
+    with archive.file.open("rb") as f:
+        content = f.read()
+    if hashlib.sha256(content).hexdigest() != archive.checksum:
+        raise ArchiveChecksumError(
+            f"The checksum of the archive {archive.file.name} does not match."
+        )
+    return pq.read_table(io.BytesIO(content), schema=ARCHIVE_SCHEMA)
+
+
+@transaction.atomic
+def restore_archive(archive):
+    """
+    Move the transactions of the archive back into the transaction table and delete the archive.
+    Categories and contracts that were deleted in the meantime are not restored.
+    Returns the number of restored transactions.
+    """
+    df = _read_table(archive).to_pandas()
+    category_ids = set(Category.objects.values_list("pk", flat=True))
+    contract_ids = set(
+        Contract.objects.filter(owner=archive.bank_account.owner).values_list(
+            "pk", flat=True
+        )
+    )
+
+    def existing(pk, pks):
+        return int(pk) if pd.notna(pk) and int(pk) in pks else None
+
+    Transaction.objects.bulk_create(
+        [
+            Transaction(
+                bank_account=archive.bank_account,
+                date_issue=row.date_issue,
+                date_booking=row.date_booking,
+                recipient=row.recipient,
+                amount=row.amount,
+                subject=row.subject,
+                full_subject_string=row.full_subject_string,
+                category_id=existing(row.category_id, category_ids),
+                contract_id=existing(row.contract_id, contract_ids),
+            )
+            for row in df.itertuples(index=False)
+        ],
+        batch_size=1000,
+    )
+    _delete_file_on_commit(archive.file)
+    archive.delete()
+    return len(df)
+
+
+def read_archived_transactions(
+    account,
+    search_term=None,
+    date_start=None,
+    date_end=None,
+    amount_min=None,
+    amount_max=None,
+    categories=None,
+):
+    """
+    The archived transactions of the account matching the filters of BankAccount.get_transactions as DataFrame
+    with the columns of ARCHIVE_SCHEMA, newest first. Only the archives of the years within the date range are
+    read.
+    """
+    archives = account.archives.all()
+    if date_start:
+        archives = archives.filter(year__gte=pd.Timestamp(date_start).year)
+    if date_end:
+        archives = archives.filter(year__lte=pd.Timestamp(date_end).year)
+
+    tables = [_read_table(archive) for archive in archives.order_by("year")]
+    if not tables:
+        return ARCHIVE_SCHEMA.empty_table().to_pandas()
+
+    df = pa.concat_tables(tables).to_pandas()
+    mask = pd.Series(True, index=df.index)
+    if search_term:
+        mask &= df.recipient.str.contains(
+            search_term, case=False, regex=False
+        ) | df.subject.str.contains(search_term, case=False, regex=False)
+    if date_start:
+        mask &= df.date_issue >= pd.Timestamp(date_start).date()
+    if date_end:
+        mask &= df.date_issue <= pd.Timestamp(date_end).date()
+    absolute_amounts = df.amount.map(abs)
+    if amount_min:
+        mask &= absolute_amounts >= Decimal(str(amount_min))
+    if amount_max:
+        mask &= absolute_amounts <= Decimal(str(amount_max))
+    if categories:
+        mask &= df.category_id.isin([int(category) for category in categories])
+
+    return (
+        df[mask]
+        .sort_values(["date_issue", "date_booking", "recipient"], ascending=False)
+        .reset_index(drop=True)
+    )
+
+
+def _to_transaction(account, row):
+    # unsaved transaction for displaying an archived row, it has no pk
+    return Transaction(
+        bank_account=account,
+        date_issue=row.date_issue,
+        date_booking=row.date_booking,
+        recipient=row.recipient,
+        amount=row.amount,
+        subject=row.subject,
+        full_subject_string=row.full_subject_string,
+        category=None
+        if pd.isna(row.category_id)
+        else Category(pk=int(row.category_id), name=row.category),
+        contract=None
+        if pd.isna(row.contract_id)
+        else Contract(pk=int(row.contract_id), name=row.contract),
+    )
+
+
+class TransactionsWithArchive:
+    """
+    The transactions of a queryset (newest first, e.g. from BankAccount.get_transactions) followed by the archived
+    transactions of the account (as returned by read_archived_transactions) as one sequence ordered by date,
+    newest first, that can be passed to a Paginator. A year is either archived completely or not at all, so a
+    slice only queries the years it covers. Archived transactions are unsaved Transaction objects without pk.
+    """
+
+    def __init__(self, account, transactions, archived):
+        self.account = account
+        self.transactions = transactions
+        self.archived = archived
+        self.archived_years = archived.date_issue.map(lambda date: date.year)
+
+        live_counts = (
+            transactions.order_by()
+            .annotate(year=ExtractYear("date_issue"))
+            .values("year")
+            .annotate(count=Count("pk"))
+            .values_list("year", "count")
+        )
+        # (year, archived, number of transactions) ordered by year, newest first
+        self.blocks = sorted(
+            [(year, False, count) for year, count in live_counts]
+            + [
+                (year, True, count)
+                for year, count in self.archived_years.value_counts().items()
+            ],
+            reverse=True,
+        )
+
+    def __len__(self):
+        return sum(count for _, _, count in self.blocks)
+
+    def __iter__(self):
+        yield from self.transactions
+        for row in self.archived.itertuples(index=False):
+            yield _to_transaction(self.account, row)
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            return self[key : key + 1][0]
+
+        start, stop, _ = key.indices(len(self))
+        result = []
+        offset = 0
+        for year, archived, count in self.blocks:
+            begin, end = max(start - offset, 0), min(stop - offset, count)
+            offset += count
+            if begin >= end:
+                continue
+            if archived:
+                rows = self.archived[self.archived_years == year].iloc[begin:end]
+                result += [
+                    _to_transaction(self.account, row)
+                    for row in rows.itertuples(index=False)
+                ]
+            else:
+                result += list(
+                    self.transactions.filter(date_issue__year=year)[begin:end]
+                )
+        return result
@@ -0,0 +1,193 @@
+import io
+import statistics
+import time
+
+import plotly.io as pio
+from django.contrib.sessions.backends.db import SessionStore
+from django.db import connection
+from django.test import Client, RequestFactory
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from . import charts
+from .csv_to_transactions import csv_to_transactions
+from .demo_data import BANKS, generate_csv_export
+from .models import BankAccount, TransactionType, get_bank_accounts_for_user
+
+# Benchmarks of the views, chart callbacks and the import pipeline on the data of one user.
+# Every benchmark is a function without arguments, it is run once to warm up caches and then `rounds` times.
+
+
+def _view(client, url, data=None):
+    def run():
+        response = client.get(url, data)
+        assert response.status_code in (200, 302), (url, response.status_code)
+
+    return run
+
+
+def _callback(func, *args, **kwargs):
+    def run():
+        # the serialisation of the response is part of every callback request
+        pio.json.to_json_plotly(func(*args, **kwargs))
+
+    return run
+
+
+def _csv_import(bank, content, owner):
+    account = BankAccount(owner=owner, name="Benchmark", bank=bank)
+
+    def run():
+        csv_to_transactions(io.BytesIO(content), account)
+
+    return run
+
+
+def get_benchmarks(user):
+    """
+    All benchmarks for the given user (name -> function). The user needs at least one bank account with
+    transactions, e.g. a user created by the generate_demo_data command.
+    """
+    account = get_bank_accounts_for_user(user).order_by("pk").first()
+    if account is None:
+        raise ValueError(f"{user} has no bank account.")
+
+    client = Client()
+    client.force_login(user)
+
+    request = RequestFactory().get("/")
+    request.user = user
+    request.session = SessionStore()
+    dataset = charts.filter_transactions(
+        account.pk,
+        1,
+        None,
+        None,
+        None,
+        None,
+        None,
+        TransactionType.ALL.value,
+        request=request,
+        user=user,
+    )
+    months = charts.populate_monthly_spendings_month_dropdown(
+        account.pk, None, request=request
+    )
+    month_values = [months[i] for i in (1, 3, 5, 7, 9, 11)]
+
+    benchmarks = {
+        "accounts_view": _view(client, reverse("accounts")),
+        "transactions_overview": _view(
+            client, reverse("transactions", args=[account.pk])
+        ),
+        "transactions_overview_filtered": _view(
+            client,
+            reverse("transactions", args=[account.pk]),
+            {
+                "q": "einkauf",
+                "date_start": account.get_oldest_transaction_date(),
+                "date_end": account.get_newest_transaction_date(),
+                # the amount filter compares absolute amounts
+                "amount_min": 10,
+                "amount_max": 100,
+            },
+        ),
+        "callback_populate_bank_account_dropdown": _callback(
+            charts.populate_bank_account_dropdown, None, user=user
+        ),
+        "callback_populate_transaction_type_dropdown": _callback(
+            charts.populate_transaction_type_dropdown, None
+        ),
+        "callback_populate_monthly_spendings_month_dropdown": _callback(
+            charts.populate_monthly_spendings_month_dropdown,
+            account.pk,
+            None,
+            request=request,
+        ),
+        "callback_populate_categories_dropdown": _callback(
+            charts.populate_categories_dropdown, None
+        ),
+        "callback_filter_transactions": _callback(
+            charts.filter_transactions,
+            account.pk,
+            1,
+            None,
+            None,
+            None,
+            None,
+            None,
+            TransactionType.ALL.value,
+            request=request,
+            user=user,
+        ),
+        "callback_spendings_category_chart": _callback(
+            charts.spendings_category_chart, dataset, request=request
+        ),
+        "callback_spendings_category_chart_monthly": _callback(
+            charts.spendings_category_chart_monthly,
+            dataset,
+            *month_values,
+            request=request,
+        ),
+        "callback_spendings_time_series_bar_chart": _callback(
+            charts.spendings_time_series_bar_chart, dataset, None, request=request
+        ),
+        "callback_balance_chart": _callback(
+            charts.balance_chart, dataset, request=request
+        ),
+        "callback_net_worth_chart": _callback(charts.net_worth_chart, None, user=user),
+        "reassign_categories": _view(
+            client, reverse("reassign-categories", args=[account.pk])
+        ),
+    }
+    for bank in BANKS:
+        benchmarks[f"csv_to_transactions_{bank}"] = _csv_import(
+            bank, generate_csv_export(bank), user
+        )
+
+    return benchmarks
+
+
+class _QueryCounter:
+    # counts the queries of a round without the size limit of connection.queries
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def run_benchmark(func, rounds):
+    func()
+
+    durations = []
+    for _ in range(rounds):
+        queries = _QueryCounter()
+        with connection.execute_wrapper(queries):
+            start = time.perf_counter()
+            func()
+            durations.append((time.perf_counter() - start) * 1000)
+
+    return {
+        "rounds": rounds,
+        "min_ms": round(min(durations), 3),
+        "median_ms": round(statistics.median(durations), 3),
+        "mean_ms": round(statistics.mean(durations), 3),
+        "max_ms": round(max(durations), 3),
+        "queries": queries.count,
+    }
+
+
+def run_benchmarks(user, rounds=5, names=None):
+    """
+    Run the benchmarks (all or the given names) and return the results per benchmark name.
+    """
+    # the test client sends requests for the host "testserver"
+    with override_settings(ALLOWED_HOSTS=["testserver"]):
+        benchmarks = get_benchmarks(user)
+        return {
+            name: run_benchmark(func, rounds)
+            for name, func in benchmarks.items()
+            if not names or name in names
+        }
@@ -0,0 +1,323 @@
+import datetime
+import hashlib
+import json
+
+import pandas as pd
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+from django.db.models import Min, Sum
+from django.shortcuts import get_object_or_404
+
+from .archive import read_archived_transactions
+from .metrics import BALANCE_SECONDS, timed
+from .models import (
+    UNCATEGORIZED,
+    BankAccount,
+    DepotAssetValuation,
+    Transaction,
+    TransactionArchive,
+    TransactionType,
+    check_user_permissions,
+    get_archived_amount,
+    get_bank_accounts_for_user,
+    get_bank_depots_for_user,
+    get_running_balances,
+)
+
+# Filtered datasets are kept server-side so that one click on "Filtern" results in a single database pass that
+# is shared by all chart callbacks. Entries expire after FILTERED_DATASET_TIMEOUT seconds.
+FILTERED_DATASET_TIMEOUT = 30 * 60
+FILTERED_DATASET_CACHE_PREFIX = "charts-dataset"
+
+
+def _get_session_key(request):
+    # the session might not be persisted yet for the very first callback, fall back to the user in this case
+    session_key = request.session.session_key
+    if session_key is None:
+        return f"user-{request.user.pk}"
+    return session_key
+
+
+def get_account_for_user(request, pk):
+    """
+    The bank account with the given pk, if the user is allowed to view it. The pk is sent by the browser and
+    has to be checked in every callback.
+    """
+    account = get_object_or_404(BankAccount, pk=pk)
+    check_user_permissions(request.user, account)
+    return account
+
+
+def _get_dataset_cache_key(session_key, query):
+    query_hash = hashlib.sha1(json.dumps(query, sort_keys=True).encode()).hexdigest()
+    return f"{FILTERED_DATASET_CACHE_PREFIX}:{session_key}:{query_hash}"
+
+
+def _query_filtered_dataset(account, query):
+    # date and transaction type filters are applied per chart on the cached dataset,
+    # only the filters shared by all charts are evaluated in the database
+    transactions = account.get_transactions(
+        amount_min=query["amount_min"],
+        amount_max=query["amount_max"],
+        categories=query["categories"],
+    )
+
+    df = pd.DataFrame.from_records(
+        transactions.values_list("date_issue", "amount", "category__name"),
+        columns=["date_issue", "amount", "category"],
+    )
+    # transactions of archived years are read from their archive files
+    archived = read_archived_transactions(
+        account,
+        amount_min=query["amount_min"],
+        amount_max=query["amount_max"],
+        categories=query["categories"],
+    )
+    if not archived.empty:
+        df = pd.concat([df, archived[["date_issue", "amount", "category"]]])
+    df.date_issue = pd.to_datetime(df.date_issue)
+    df.amount = df.amount.astype(float)
+    df.category = df.category.fillna(UNCATEGORIZED)
+    return df
+
+
+def store_filtered_transactions(
+    request,
+    account,
+    date_start=None,
+    date_end=None,
+    amount_min=None,
+    amount_max=None,
+    categories=None,
+    transaction_type=None,
+    n_clicks=None,
+):
+    """
+    Compute the filtered transactions of the account once and store them in the cache.
+    Returns the reference to the cached dataset that is passed on to the chart callbacks via a dcc.Store.
+    """
+    query = {
+        "account": account,
+        "amount_min": amount_min,
+        "amount_max": amount_max,
+        "categories": sorted(categories) if categories else None,
+    }
+    key = _get_dataset_cache_key(_get_session_key(request), query)
+    cache.set(
+        key,
+        _query_filtered_dataset(get_account_for_user(request, account), query),
+        FILTERED_DATASET_TIMEOUT,
+    )
+
+    return {
+        "key": key,
+        "query": query,
+        "date_start": date_start,
+        "date_end": date_end,
+        "transaction_type": transaction_type or TransactionType.ALL.value,
+        # make sure the store changes with every click, even if the filters are unchanged
+        "n_clicks": n_clicks,
+    }
+
+
+def get_dataset_account(request, dataset):
+    """
+    The bank account of the dataset reference. The reference is stored in the browser, so its key has to belong
+    to the session of the request and its query, and the user has to be allowed to view the account.
+    """
+    session_keys = {_get_session_key(request), f"user-{request.user.pk}"}
+    if dataset["key"] not in {
+        _get_dataset_cache_key(session_key, dataset["query"])
+        for session_key in session_keys
+    }:
+        raise PermissionDenied()
+    return get_account_for_user(request, dataset["query"]["account"])
+
+
+def load_filtered_transactions(request, dataset):
+    """
+    Return the cached transactions referenced by the dataset reference.
+    If the cache entry expired (or was stored by another worker process), the dataset is queried again.
+    """
+    account = get_dataset_account(request, dataset)
+    df = cache.get(dataset["key"])
+    if df is None:
+        df = _query_filtered_dataset(account, dataset["query"])
+        cache.set(dataset["key"], df, FILTERED_DATASET_TIMEOUT)
+    return df
+
+
+def filter_transactions_dataframe(
+    df, date_start=None, date_end=None, transaction_type=TransactionType.ALL
+):
+    if date_start:
+        df = df.loc[df.date_issue >= pd.Timestamp(date_start)]
+    if date_end:
+        df = df.loc[df.date_issue <= pd.Timestamp(date_end)]
+
+    if transaction_type == TransactionType.ALL:
+        return df
+    elif transaction_type == TransactionType.INCOME:
+        return df.loc[df.amount >= 0.0]
+    elif transaction_type == TransactionType.EXPENSE:
+        return df.loc[df.amount < 0.0]
+    else:
+        raise ValueError(f"Unrecognized transaction_type: {transaction_type}.")
+
+
+# Resampling granularities for the time series chart ordered from fine to coarse:
+# (pandas resampling frequency, pandas period frequency, plotly bar period, axis title)
+TIME_SERIES_GRANULARITIES = [
+    ("W-MON", "W", 7 * 24 * 60 * 60 * 1000, "Woche"),
+    ("MS", "M", "M1", "Monat"),
+    ("QS", "Q", "M3", "Quartal"),
+    ("YS", "Y", "M12", "Jahr"),
+]
+# maximum number of bars per trace sent to the browser
+MAX_TIME_SERIES_POINTS = 120
+
+# the balance chart additionally supports daily balances
+BALANCE_GRANULARITIES = [
+    ("D", "D", 24 * 60 * 60 * 1000, "Tag"),
+    *TIME_SERIES_GRANULARITIES,
+]
+MAX_BALANCE_POINTS = 400
+# database truncation kind per resampling frequency
+TRUNC_KINDS = {
+    "D": "day",
+    "W-MON": "week",
+    "MS": "month",
+    "QS": "quarter",
+    "YS": "year",
+}
+
+
+def _choose_granularity(
+    date_start, date_end, max_points, granularities=TIME_SERIES_GRANULARITIES
+):
+    for granularity in granularities:
+        _, period, _, _ = granularity
+        n_buckets = (date_end.to_period(period) - date_start.to_period(period)).n + 1
+        if n_buckets <= max_points:
+            return granularity
+
+    return granularities[-1]
+
+
+def resample_income_expenses(
+    df, date_start=None, date_end=None, max_points=MAX_TIME_SERIES_POINTS
+):
+    """
+    Resample the transactions into income and expense sums per time bucket.
+    The bucket size (week, month, quarter, year) is the finest granularity that results in at most max_points
+    buckets for the selected date range. If no range is given, the range of the transactions is used.
+    Returns the income and expenses series (indexed by the bucket start date) and the chosen granularity.
+    """
+    date_start = pd.Timestamp(date_start) if date_start else df.date_issue.min()
+    date_end = pd.Timestamp(date_end) if date_end else df.date_issue.max()
+    granularity = _choose_granularity(date_start, date_end, max_points)
+    frequency, _, _, _ = granularity
+
+    amounts = df.set_index("date_issue").amount.sort_index()
+    resample_kwargs = {"closed": "left", "label": "left"}
+    income = amounts.clip(lower=0.0).resample(frequency, **resample_kwargs).sum()
+    expenses = (
+        amounts.clip(upper=0.0).abs().resample(frequency, **resample_kwargs).sum()
+    )
+
+    # the selected range is only an estimate for the transactions, cap the number of buckets nonetheless
+    return income.tail(max_points), expenses.tail(max_points), granularity
+
+
+@timed(BALANCE_SECONDS, kind="account")
+def get_balance_history(
+    account, date_start=None, date_end=None, max_points=MAX_BALANCE_POINTS
+):
+    """
+    End-of-period balances of the account, downsampled in the database to at most max_points periods.
+    Returns a series of balances indexed by the period start date and the chosen granularity.
+    """
+    date_start = pd.Timestamp(date_start or account.get_oldest_transaction_date())
+    date_end = pd.Timestamp(date_end or datetime.date.today())
+    granularity = _choose_granularity(
+        date_start, date_end, max_points, granularities=BALANCE_GRANULARITIES
+    )
+    frequency, _, _, _ = granularity
+
+    balances = account.get_balance_history(
+        kind=TRUNC_KINDS[frequency],
+        date_start=date_start.date(),
+        date_end=date_end.date(),
+    )
+    balances = _balances_to_series(balances)
+
+    return balances.tail(max_points), granularity
+
+
+def _balances_to_series(balances):
+    index, values = zip(*balances) if balances else ([], [])
+    return pd.Series(values, index=pd.DatetimeIndex(index), dtype=float)
+
+
+@timed(BALANCE_SECONDS, kind="net_worth")
+def get_net_worth_history(user, max_points=MAX_BALANCE_POINTS):
+    """
+    End-of-period net worth of all bank accounts and depots the user is allowed to view.
+    Account balances are computed with a running sum in the database, depot balances from the latest
+    valuation snapshot of every asset in each period. The number of queries does not depend on the
+    number of transactions or snapshots.
+    Returns a DataFrame with the columns accounts and depots indexed by the period start date and the
+    chosen granularity.
+    """
+    accounts = get_bank_accounts_for_user(user)
+    depots = get_bank_depots_for_user(user)
+    transactions = Transaction.objects.filter(bank_account__in=accounts)
+    valuations = DepotAssetValuation.objects.filter(asset__bank_depot__in=depots)
+
+    first_dates = [
+        transactions.aggregate(first=Min("date_issue"))["first"],
+        valuations.aggregate(first=Min("date"))["first"],
+    ]
+    first_dates = [d for d in first_dates if d is not None]
+    if not first_dates:
+        return pd.DataFrame(columns=["accounts", "depots"], dtype=float), None
+
+    date_start = pd.Timestamp(min(first_dates))
+    date_end = pd.Timestamp(datetime.date.today())
+    granularity = _choose_granularity(
+        date_start, date_end, max_points, granularities=BALANCE_GRANULARITIES
+    )
+    frequency, period, _, _ = granularity
+    index = pd.period_range(date_start, date_end, freq=period).to_timestamp()
+
+    # bank accounts: the balance only changes in periods with transactions, archived years are part of the
+    # start balance
+    start_balance = accounts.aggregate(total=Sum("current_amount"))["total"] or 0
+    start_balance += get_archived_amount(
+        TransactionArchive.objects.filter(bank_account__in=accounts)
+    )
+    account_balances = _balances_to_series(
+        get_running_balances(transactions, start_balance, TRUNC_KINDS[frequency])
+    )
+    account_balances = account_balances.reindex(index, method="ffill").fillna(
+        float(start_balance)
+    )
+
+    # depots: the value of an asset is its latest valuation at the end of each period
+    snapshots = pd.DataFrame.from_records(
+        valuations.values_list("asset", "date", "value"),
+        columns=["asset", "date", "value"],
+    )
+    snapshots.date = pd.to_datetime(snapshots.date)
+    snapshots.value = snapshots.value.astype(float)
+    depot_balances = (
+        snapshots.pivot(index="date", columns="asset", values="value")
+        .resample(frequency, closed="left", label="left")
+        .last()
+        .reindex(index)
+        .ffill()
+        .sum(axis=1)
+    )
+
+    net_worth = pd.DataFrame({"accounts": account_balances, "depots": depot_balances})
+    return net_worth.tail(max_points), granularity
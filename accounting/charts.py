@@ -1,28 +1,120 @@
 import calendar
+import contextvars
 import datetime
-import decimal
-from collections import defaultdict
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import dash_bootstrap_components as dbc
 import pandas as pd
-from dash import dcc, html
+import plotly.io as pio
+from dash import Patch, dcc, html
 from dash.dependencies import Input, Output, State
 from dateutil.relativedelta import relativedelta
-from django.shortcuts import get_object_or_404
+from django.conf import settings
+from django.db import connections
 from django_plotly_dash import DjangoDash
 from plotly import graph_objects as go
 
-from .models import BankAccount, Category, TransactionType, get_bank_accounts_for_user
+from .chart_data import (
+    filter_transactions_dataframe,
+    get_account_for_user,
+    get_balance_history,
+    get_dataset_account,
+    get_net_worth_history,
+    load_filtered_transactions,
+    resample_income_expenses,
+    store_filtered_transactions,
+)
+from .instrumentation import instrument_callback, record_queries
+from .metrics import CHART_CALLBACK_SECONDS, timed
+from .models import Category, TransactionType, get_bank_accounts_for_user
+from .profiling import profile_thread
 
 COLOR_INCOME = "darkseagreen"
 COLOR_EXPENSE = "indianred"
 TEMPLATE = "plotly_white"
 
+logger = logging.getLogger(__name__)
+
+# serialise the callback responses with orjson, which handles NumPy arrays natively
+pio.json.config.default_engine = "orjson"
+
+
+# The figures are sent once with the layout, the callbacks only patch the data of the traces.
+def _category_bar_figure():
+    fig = go.Figure(
+        [
+            go.Bar(x=[], y=[], marker_color=COLOR_EXPENSE, name="Ausgaben"),
+            go.Bar(x=[], y=[], marker_color=COLOR_INCOME, name="Einnahmen"),
+        ]
+    )
+    fig.update_xaxes(title="Kategorie")
+    fig.update_yaxes(title="Betrag", ticksuffix="€")
+    fig.update_layout(template=TEMPLATE)
+    return fig
+
+
+def _time_series_figure():
+    fig = go.Figure(
+        [
+            go.Bar(
+                x=[],
+                y=[],
+                xperiodalignment="middle",
+                marker_color=COLOR_INCOME,
+                name="Einnahmen",
+            ),
+            go.Bar(
+                x=[],
+                y=[],
+                xperiodalignment="middle",
+                marker_color=COLOR_EXPENSE,
+                name="Ausgaben",
+            ),
+        ]
+    )
+    fig.update_yaxes(title="Betrag", ticksuffix="€")
+    fig.update_layout(template=TEMPLATE)
+    return fig
+
+
+def _balance_figure():
+    fig = go.Figure(
+        go.Scatter(
+            x=[],
+            y=[],
+            mode="lines",
+            line_shape="hv",
+            line_color=COLOR_INCOME,
+            name="Kontostand",
+        )
+    )
+    fig.update_yaxes(title="Kontostand", ticksuffix="€")
+    fig.update_layout(template=TEMPLATE)
+    return fig
+
+
+def _net_worth_figure():
+    fig = go.Figure(
+        [
+            go.Scatter(x=[], y=[], mode="lines", stackgroup="net-worth", name="Konten"),
+            go.Scatter(x=[], y=[], mode="lines", stackgroup="net-worth", name="Depots"),
+        ]
+    )
+    fig.update_yaxes(title="Vermögen", ticksuffix="€")
+    fig.update_layout(template=TEMPLATE)
+    return fig
+
+
 dd = DjangoDash("Charts", add_bootstrap_links=True)
 
 dd.layout = html.Div(
     [
         html.Div(children=[], id="_dummy", hidden=True),
+        # reference to the server-side cached dataset of the current filter settings
+        dcc.Store(id="filtered-transactions"),
         # Bank account dropdown
         html.Div(
             [
@@ -150,7 +242,7 @@ dd.layout = html.Div(
                 html.Div(
                     [
                         html.H3("Nach Kategorien (gesamte Zeit)"),
-                        dcc.Graph(id="category-chart"),
+                        dcc.Graph(id="category-chart", figure=_category_bar_figure()),
                     ]
                 ),
                 html.Hr(),
@@ -190,7 +282,10 @@ dd.layout = html.Div(
                                                 ),
                                             ]
                                         ),
-                                        dcc.Graph(id="category-chart-monthly-month1"),
+                                        dcc.Graph(
+                                            id="category-chart-monthly-month1",
+                                            figure=_category_bar_figure(),
+                                        ),
                                     ]
                                 ),
                                 dbc.Col(
@@ -219,7 +314,10 @@ dd.layout = html.Div(
                                                 ),
                                             ]
                                         ),
-                                        dcc.Graph(id="category-chart-monthly-month2"),
+                                        dcc.Graph(
+                                            id="category-chart-monthly-month2",
+                                            figure=_category_bar_figure(),
+                                        ),
                                     ]
                                 ),
                                 dbc.Col(
@@ -248,7 +346,10 @@ dd.layout = html.Div(
                                                 ),
                                             ]
                                         ),
-                                        dcc.Graph(id="category-chart-monthly-month3"),
+                                        dcc.Graph(
+                                            id="category-chart-monthly-month3",
+                                            figure=_category_bar_figure(),
+                                        ),
                                     ]
                                 ),
                             ]
@@ -259,7 +360,7 @@ dd.layout = html.Div(
                 # Bar char expensens and income monthly
                 html.Div(
                     [
-                        html.H3("Ein-/Ausgaben nach Monaten"),
+                        html.H3("Ein-/Ausgaben im Zeitverlauf"),
                         dbc.Row(
                             [
                                 dbc.Col("Zeige die letzten ", width=2),
@@ -275,7 +376,25 @@ dd.layout = html.Div(
                                 dbc.Col("Monate.", width=1),
                             ]
                         ),
-                        dcc.Graph(id="time-series-spendings"),
+                        dcc.Graph(
+                            id="time-series-spendings", figure=_time_series_figure()
+                        ),
+                    ]
+                ),
+                html.Hr(),
+                # Line chart account balance over time
+                html.Div(
+                    [
+                        html.H3("Kontostand im Zeitverlauf"),
+                        dcc.Graph(id="balance-chart", figure=_balance_figure()),
+                    ]
+                ),
+                html.Hr(),
+                # Stacked area chart net worth of all accounts and depots over time
+                html.Div(
+                    [
+                        html.H3("Vermögen im Zeitverlauf (alle Konten und Depots)"),
+                        dcc.Graph(id="net-worth-chart", figure=_net_worth_figure()),
                     ]
                 ),
             ]
@@ -285,16 +404,79 @@ dd.layout = html.Div(
 )
 
 
-def _django_transactions_to_pandas_dataframe(transactions):
-    df = pd.DataFrame(list(transactions.values()))
-    df.date_issue = pd.to_datetime(df.date_issue, infer_datetime_format=True)
-    df.amount = df.amount.astype(float)
-    df["year_issue"] = pd.DatetimeIndex(df.date_issue).year
-    df["month_issue"] = pd.DatetimeIndex(df.date_issue).month
-    return df
+_figure_executor = None
+# concurrent first callbacks (e.g. gunicorn --threads) must not create an executor each
+_figure_executor_lock = threading.Lock()
 
 
-@dd.callback(
+def _get_figure_executor():
+    global _figure_executor
+    with _figure_executor_lock:
+        if _figure_executor is None:
+            _figure_executor = ThreadPoolExecutor(
+                max_workers=settings.CHARTS_FIGURE_WORKERS,
+                thread_name_prefix="chart-figures",
+            )
+        return _figure_executor
+
+
+def _build_figure(figure_id, builder):
+    start = time.perf_counter()
+    fig = builder()
+    logger.info(
+        "Built figure %s in %.1f ms", figure_id, (time.perf_counter() - start) * 1000
+    )
+    return fig
+
+
+def _build_figure_in_worker(figure_id, builder):
+    try:
+        with record_queries(), profile_thread():
+            return _build_figure(figure_id, builder)
+    finally:
+        # Django opens a separate database connection per thread, close it once the figure is built
+        connections.close_all()
+
+
+def _build_figures(builders):
+    """
+    Build independent figures of a multi-output callback.
+    builders maps the figure id to a function without arguments returning the figure.
+    If CHARTS_FIGURE_WORKERS > 1 the figures are built concurrently on a bounded thread pool.
+    """
+    if settings.CHARTS_FIGURE_WORKERS <= 1:
+        return [
+            _build_figure(figure_id, builder) for figure_id, builder in builders.items()
+        ]
+
+    executor = _get_figure_executor()
+    # run in a copy of the request's context, so that the queries and calls of the workers are recorded as well
+    futures = [
+        executor.submit(
+            contextvars.copy_context().run, _build_figure_in_worker, figure_id, builder
+        )
+        for figure_id, builder in builders.items()
+    ]
+    return [future.result() for future in futures]
+
+
+def _callback(*args, **kwargs):
+    """
+    Register a callback of the Dash app. The latency of the callback is recorded per output id in the
+    metrics and in the request instrumentation.
+    """
+    output_id = ",".join(str(arg) for arg in args if isinstance(arg, Output))
+    register = dd.callback(*args, **kwargs)
+
+    def decorator(func):
+        return register(
+            timed(CHART_CALLBACK_SECONDS, output=output_id)(instrument_callback(func))
+        )
+
+    return decorator
+
+
+@_callback(
     Output("account", "options"),
     Output("account", "value"),
     Input("_dummy", "children"),
@@ -307,7 +489,7 @@ def populate_bank_account_dropdown(_, **kwargs):
     return options, accounts[0].pk
 
 
-@dd.callback(
+@_callback(
     Output("transaction-type", "options"),
     Output("transaction-type", "value"),
     Input("_dummy", "children"),
@@ -317,7 +499,7 @@ def populate_transaction_type_dropdown(_):
     return values, TransactionType.ALL.value
 
 
-@dd.callback(
+@_callback(
     # chart 1
     Output("monthly-month1", "options"),
     Output("monthly-month1", "value"),
@@ -336,8 +518,8 @@ def populate_transaction_type_dropdown(_):
     Input("account", "value"),
     Input("_dummy", "children"),
 )
-def populate_monthly_spendings_month_dropdown(account, _):
-    account = get_object_or_404(BankAccount, pk=account)
+def populate_monthly_spendings_month_dropdown(account, _, **kwargs):
+    account = get_account_for_user(kwargs["request"], account)
 
     min_date = account.get_oldest_transaction_date()
     max_date = account.get_newest_transaction_date()
@@ -383,7 +565,7 @@ def populate_monthly_spendings_month_dropdown(account, _):
     return *settings1, *settings2, *settings3
 
 
-@dd.callback(
+@_callback(
     Output("categories", "options"),
     Output("categories", "value"),
     Input("_dummy", "children"),
@@ -409,62 +591,8 @@ def populate_categories_dropdown(_):
 #     return None, None, None, -1
 
 
-def _accumulate_by_categories(transactions):
-    category_transactions = defaultdict(
-        lambda: (decimal.Decimal(), decimal.Decimal())
-    )  # (spending, income)
-
-    for t in transactions:
-        category = t.category.name if t.category else "ohne Kategorie"
-        _spending, _income = category_transactions[category]
-
-        if t.amount >= 0:
-            _income += t.amount
-        else:
-            _spending += abs(t.amount)
-
-        category_transactions[category] = (_spending, _income)
-
-    category_transactions = dict(
-        sorted(category_transactions.items(), key=lambda item: item[1][0], reverse=True)
-    )
-
-    return category_transactions
-
-
-def _plot_category_bar(transaction_type, category_transactions):
-    categories = list(category_transactions.keys())
-    spendings = [value[0] for value in category_transactions.values()]
-    incomes = [value[1] for value in category_transactions.values()]
-
-    transaction_type = TransactionType(transaction_type)
-
-    plot_income = transaction_type in [TransactionType.INCOME, TransactionType.ALL]
-    plot_spending = transaction_type in [TransactionType.EXPENSE, TransactionType.ALL]
-
-    fig = go.Figure()
-
-    if plot_spending:
-        fig.add_trace(
-            go.Bar(
-                x=categories, y=spendings, marker_color=COLOR_EXPENSE, name="Ausgaben"
-            )
-        )
-
-    if plot_income:
-        fig.add_trace(
-            go.Bar(x=categories, y=incomes, marker_color=COLOR_INCOME, name="Einnahmen")
-        )
-
-    fig.update_xaxes(title="Kategorie")
-    fig.update_yaxes(title="Betrag", ticksuffix="€")
-    fig.update_layout(template=TEMPLATE)
-
-    return fig
-
-
-@dd.callback(
-    Output("category-chart", "figure"),
+@_callback(
+    Output("filtered-transactions", "data"),
     Input("account", "value"),
     Input("filter", "n_clicks"),
     State("date-start", "value"),
@@ -474,36 +602,84 @@ def _plot_category_bar(transaction_type, category_transactions):
     State("categories", "value"),
     State("transaction-type", "value"),
 )
-def spendings_category_chart(
+def filter_transactions(
     account,
-    _,
+    n_clicks,
     date_start,
     date_end,
     amount_min,
     amount_max,
     categories,
     transaction_type,
+    **kwargs,
 ):
-    account = get_object_or_404(BankAccount, pk=account)
-
-    transactions = account.get_transactions(
-        search_term=None,
+    # query the transactions once per filter interaction, all charts read the stored dataset
+    return store_filtered_transactions(
+        kwargs["request"],
+        account,
         date_start=date_start,
         date_end=date_end,
         amount_min=amount_min,
         amount_max=amount_max,
         categories=categories,
-        transaction_type=TransactionType(transaction_type),
+        transaction_type=transaction_type,
+        n_clicks=n_clicks,
     )
 
-    category_transactions = _accumulate_by_categories(transactions)
 
-    return _plot_category_bar(transaction_type, category_transactions)
+def _accumulate_by_categories(df):
+    # (spending, income) per category
+    category_transactions = pd.DataFrame(
+        {
+            "category": df.category,
+            "spending": df.amount.where(df.amount < 0, 0.0).abs(),
+            "income": df.amount.where(df.amount >= 0, 0.0),
+        }
+    )
+    category_transactions = category_transactions.groupby("category").sum()
 
+    return category_transactions.sort_values("spending", ascending=False)
 
-def _get_categorized_transactions_for_month(
-    account, month, year, amount_min, amount_max, categories, transaction_type
-):
+
+def _patch_category_bar(transaction_type, category_transactions):
+    categories = category_transactions.index.to_numpy()
+
+    transaction_type = TransactionType(transaction_type)
+
+    plot_income = transaction_type in [TransactionType.INCOME, TransactionType.ALL]
+    plot_spending = transaction_type in [TransactionType.EXPENSE, TransactionType.ALL]
+
+    # trace 0: spendings, trace 1: incomes (see _category_bar_figure)
+    patched_fig = Patch()
+    patched_fig["data"][0]["x"] = categories
+    patched_fig["data"][0]["y"] = category_transactions.spending.to_numpy()
+    patched_fig["data"][0]["visible"] = plot_spending
+    patched_fig["data"][1]["x"] = categories
+    patched_fig["data"][1]["y"] = category_transactions.income.to_numpy()
+    patched_fig["data"][1]["visible"] = plot_income
+
+    return patched_fig
+
+
+@_callback(
+    Output("category-chart", "figure"),
+    Input("filtered-transactions", "data"),
+)
+def spendings_category_chart(dataset, **kwargs):
+    transaction_type = TransactionType(dataset["transaction_type"])
+    df = filter_transactions_dataframe(
+        load_filtered_transactions(kwargs["request"], dataset),
+        date_start=dataset["date_start"],
+        date_end=dataset["date_end"],
+        transaction_type=transaction_type,
+    )
+
+    category_transactions = _accumulate_by_categories(df)
+
+    return _patch_category_bar(transaction_type, category_transactions)
+
+
+def _get_transactions_for_month(df, month, year, transaction_type):
     if month == 0:
         # show the entire year
         date_start = datetime.date(day=1, month=1, year=year)
@@ -513,35 +689,31 @@ def _get_categorized_transactions_for_month(
         _, max_day = calendar.monthrange(year=year, month=month)
         date_end = datetime.date(day=max_day, month=month, year=year)
 
-    transactions = account.get_transactions(
+    return filter_transactions_dataframe(
+        df,
         date_start=date_start,
         date_end=date_end,
-        amount_min=amount_min,
-        amount_max=amount_max,
-        categories=categories,
         transaction_type=TransactionType(transaction_type),
     )
 
-    return _accumulate_by_categories(transactions)
 
+def _patch_categories_for_month(df, month, year, transaction_type):
+    if month is None or year is None:
+        df = df.iloc[:0]
+    else:
+        df = _get_transactions_for_month(df, month, year, transaction_type)
 
-def _plot_categories_for_month(
-    account, month1, year1, amount_min, amount_max, categories, transaction_type
-):
-    category_transactions = _get_categorized_transactions_for_month(
-        account, month1, year1, amount_min, amount_max, categories, transaction_type
-    )
+    category_transactions = _accumulate_by_categories(df)
 
-    return _plot_category_bar(transaction_type, category_transactions)
+    return _patch_category_bar(transaction_type, category_transactions)
 
 
-@dd.callback(
+@_callback(
     Output("category-chart-monthly-month1", "figure"),
     Output("category-chart-monthly-month2", "figure"),
     Output("category-chart-monthly-month3", "figure"),
     # INPUT
-    Input("account", "value"),
-    Input("filter", "n_clicks"),
+    Input("filtered-transactions", "data"),
     # dropdown month and year options
     Input("monthly-month1", "value"),
     Input("monthly-year1", "value"),
@@ -549,56 +721,44 @@ def _plot_categories_for_month(
     Input("monthly-year2", "value"),
     Input("monthly-month3", "value"),
     Input("monthly-year3", "value"),
-    # STATE: filter options
-    State("amount-min", "value"),
-    State("amount-max", "value"),
-    State("categories", "value"),
-    State("transaction-type", "value"),
 )
 def spendings_category_chart_monthly(
-    account,
-    _,
+    dataset,
     month1,
     year1,
     month2,
     year2,
     month3,
     year3,
-    amount_min,
-    amount_max,
-    categories,
-    transaction_type,
+    **kwargs,
 ):
-    account = get_object_or_404(BankAccount, pk=account)
+    df = load_filtered_transactions(kwargs["request"], dataset)
+    transaction_type = dataset["transaction_type"]
 
-    fig1 = _plot_categories_for_month(
-        account, month1, year1, amount_min, amount_max, categories, transaction_type
-    )
-    fig2 = _plot_categories_for_month(
-        account, month2, year2, amount_min, amount_max, categories, transaction_type
-    )
-    fig3 = _plot_categories_for_month(
-        account, month3, year3, amount_min, amount_max, categories, transaction_type
+    fig1, fig2, fig3 = _build_figures(
+        {
+            "category-chart-monthly-month1": lambda: _patch_categories_for_month(
+                df, month1, year1, transaction_type
+            ),
+            "category-chart-monthly-month2": lambda: _patch_categories_for_month(
+                df, month2, year2, transaction_type
+            ),
+            "category-chart-monthly-month3": lambda: _patch_categories_for_month(
+                df, month3, year3, transaction_type
+            ),
+        }
     )
 
     return fig1, fig2, fig3
 
 
-@dd.callback(
+@_callback(
     Output("time-series-spendings", "figure"),
-    Input("account", "value"),
-    Input("filter", "n_clicks"),
+    Input("filtered-transactions", "data"),
     Input("time-series-spendings-months", "value"),
-    State("date-start", "value"),
-    State("date-end", "value"),
-    State("amount-min", "value"),
-    State("amount-max", "value"),
-    State("categories", "value"),
 )
-def spendings_time_series_bar_chart(
-    account, _, last_n_months, date_start, date_end, amount_min, amount_max, categories
-):
-    account = get_object_or_404(BankAccount, pk=account)
+def spendings_time_series_bar_chart(dataset, last_n_months, **kwargs):
+    date_start = dataset["date_start"]
 
     if last_n_months is not None:
         _date_min = datetime.date.today() + relativedelta(months=-last_n_months)
@@ -607,48 +767,72 @@ def spendings_time_series_bar_chart(
         if date_start is None:
             date_start = _date_min
         else:
-            date_start = max(date_start, _date_min)
+            date_start = max(datetime.date.fromisoformat(date_start), _date_min)
 
-    transactions = account.get_transactions(
-        search_term=None,
+    df = filter_transactions_dataframe(
+        load_filtered_transactions(kwargs["request"], dataset),
         date_start=date_start,
-        date_end=date_end,
-        amount_min=amount_min,
-        amount_max=amount_max,
-        categories=categories,
+        date_end=dataset["date_end"],
         transaction_type=TransactionType.ALL,
     )
 
-    if len(transactions) == 0:
-        return go.Figure()
+    patched_fig = Patch()
 
-    df = _django_transactions_to_pandas_dataframe(transactions)
+    if len(df) == 0:
+        for trace in range(2):
+            patched_fig["data"][trace]["x"] = []
+            patched_fig["data"][trace]["y"] = []
+        return patched_fig
 
-    is_income = df.amount >= 0
-    income = df.loc[is_income]
-    expenses = df.loc[~is_income]
+    income, expenses, granularity = resample_income_expenses(
+        df, date_start=date_start, date_end=dataset["date_end"]
+    )
+    _, _, bar_period, axis_title = granularity
 
-    income = income.groupby(["year_issue", "month_issue"]).sum(numeric_only=True)
-    expenses = expenses.groupby(["year_issue", "month_issue"]).sum(numeric_only=True)
+    # trace 0: income, trace 1: expenses (see _time_series_figure)
+    for trace, amounts in enumerate([income, expenses]):
+        patched_fig["data"][trace]["x"] = amounts.index.to_numpy()
+        patched_fig["data"][trace]["y"] = amounts.to_numpy()
+        patched_fig["data"][trace]["xperiod"] = bar_period
 
-    fig = go.Figure(
-        [
-            go.Bar(
-                x=[str(el) for el in income.index.to_list()],
-                y=income.amount.to_list(),
-                marker_color=COLOR_INCOME,
-                name="Einnahmen",
-            ),
-            go.Bar(
-                x=[str(el) for el in expenses.index.to_list()],
-                y=expenses.amount.abs().to_list(),
-                marker_color=COLOR_EXPENSE,
-                name="Ausgaben",
-            ),
-        ]
+    patched_fig["layout"]["xaxis"]["title"]["text"] = axis_title
+    return patched_fig
+
+
+@_callback(
+    Output("balance-chart", "figure"),
+    Input("filtered-transactions", "data"),
+)
+def balance_chart(dataset, **kwargs):
+    account = get_dataset_account(kwargs["request"], dataset)
+
+    balances, granularity = get_balance_history(
+        account, date_start=dataset["date_start"], date_end=dataset["date_end"]
     )
+    _, _, _, axis_title = granularity
 
-    fig.update_xaxes(title="(Monat, Jahr)")
-    fig.update_yaxes(title="Betrag", ticksuffix="€")
-    fig.update_layout(template=TEMPLATE)
-    return fig
+    patched_fig = Patch()
+    patched_fig["data"][0]["x"] = balances.index.to_numpy()
+    patched_fig["data"][0]["y"] = balances.to_numpy()
+    patched_fig["layout"]["xaxis"]["title"]["text"] = axis_title
+    return patched_fig
+
+
+@_callback(
+    Output("net-worth-chart", "figure"),
+    Input("_dummy", "children"),
+)
+def net_worth_chart(_, **kwargs):
+    net_worth, granularity = get_net_worth_history(kwargs["user"])
+
+    # trace 0: bank accounts, trace 1: depots (see _net_worth_figure)
+    patched_fig = Patch()
+    for trace, column in enumerate(["accounts", "depots"]):
+        patched_fig["data"][trace]["x"] = net_worth.index.to_numpy()
+        patched_fig["data"][trace]["y"] = net_worth[column].to_numpy()
+
+    if granularity is not None:
+        _, _, _, axis_title = granularity
+        patched_fig["layout"]["xaxis"]["title"]["text"] = axis_title
+
+    return patched_fig
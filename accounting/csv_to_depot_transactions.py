@@ -0,0 +1,158 @@
+import hashlib
+from decimal import Decimal
+
+import pandas as pd
+from django.db import transaction
+
+from .models import (
+    DepotAsset,
+    DepotAssetTransaction,
+    DepotAssetValuation,
+    bump_data_versions,
+)
+
+# number of csv rows parsed at once
+DEPOT_IMPORT_CHUNK_SIZE = 10_000
+
+DEPOT_CSV_COLUMNS = {
+    "Datum": "date",
+    "Anlage": "asset",
+    "Umsatz": "amount",
+    "Bewertung": "value",
+}
+
+
+def _fingerprint(row):
+    return hashlib.sha1(
+        f"{row.asset}|{row.date.date()}|{row.amount:.2f}|{row.occurrence}".encode()
+    ).hexdigest()
+
+
+def parse_depot_csv_to_dataframes(csv_file, dateformat="%d.%m.%Y"):
+    """
+    Parse a depot export with the columns Datum;Anlage;Umsatz;Bewertung (german number format).
+    Every row can contain a transaction (Umsatz: deposits positive, withdrawals negative), a valuation of the
+    asset at that date (Bewertung) or both.
+    Returns a DataFrame of transactions (with fingerprint) and a DataFrame of valuations.
+    """
+    transactions = [pd.DataFrame(columns=["asset", "date", "amount"])]
+    valuations = [pd.DataFrame(columns=["asset", "date", "value"])]
+
+    chunks = pd.read_csv(
+        csv_file,
+        sep=";",
+        encoding="utf-8",
+        header=0,
+        usecols=list(DEPOT_CSV_COLUMNS.keys()),
+        dtype={"Datum": str, "Anlage": str, "Umsatz": float, "Bewertung": float},
+        thousands=".",
+        decimal=",",
+        chunksize=DEPOT_IMPORT_CHUNK_SIZE,
+    )
+
+    for chunk in chunks:
+        chunk = chunk.rename(columns=DEPOT_CSV_COLUMNS)
+        chunk.date = pd.to_datetime(chunk.date, format=dateformat)
+        chunk.asset = chunk.asset.str.strip()
+        chunk = chunk.dropna(subset=["date", "asset"])
+
+        transactions.append(
+            chunk.loc[chunk.amount.notna(), ["asset", "date", "amount"]]
+        )
+        valuations.append(chunk.loc[chunk.value.notna(), ["asset", "date", "value"]])
+
+    transactions = pd.concat(transactions, ignore_index=True)
+    valuations = pd.concat(valuations, ignore_index=True)
+
+    # identical transactions (e.g. two savings plan executions on the same day) are told apart by their
+    # occurrence, so re-importing an overlapping export yields the same fingerprints
+    transactions["occurrence"] = transactions.groupby(
+        ["asset", "date", "amount"]
+    ).cumcount()
+    transactions["fingerprint"] = [
+        _fingerprint(row) for row in transactions.itertuples(index=False)
+    ]
+
+    # the last valuation per asset and day wins
+    valuations = valuations.drop_duplicates(subset=["asset", "date"], keep="last")
+
+    return transactions, valuations
+
+
+def _get_or_create_assets(depot, names):
+    assets = {a.name: a for a in depot.get_assets().filter(name__in=names)}
+
+    new_assets = DepotAsset.objects.bulk_create(
+        [
+            DepotAsset(bank_depot=depot, name=name, current_balance=0)
+            for name in names
+            if name not in assets
+        ]
+    )
+    assets.update({a.name: a for a in new_assets})
+
+    return assets
+
+
+def import_depot_csv(csv_file, depot):
+    """
+    Import the transactions and valuations of a depot export in a single database transaction.
+    Transactions that were imported before (same fingerprint) are skipped, valuations of an asset for an
+    already known day are overwritten. Assets are matched by name and created if they do not exist yet.
+    Returns the number of imported transactions and valuations.
+    """
+    transactions, valuations = parse_depot_csv_to_dataframes(csv_file)
+    asset_names = sorted(set(transactions.asset) | set(valuations.asset))
+
+    with transaction.atomic():
+        assets = _get_or_create_assets(depot, asset_names)
+
+        known_fingerprints = set(
+            DepotAssetTransaction.objects.filter(asset__in=assets.values())
+            .exclude(fingerprint="")
+            .values_list("fingerprint", flat=True)
+        )
+        transactions = transactions.loc[
+            ~transactions.fingerprint.isin(known_fingerprints)
+        ]
+
+        DepotAssetTransaction.objects.bulk_create(
+            [
+                DepotAssetTransaction(
+                    asset=assets[row.asset],
+                    amount=Decimal(f"{row.amount:.2f}"),
+                    date_issue=row.date.date(),
+                    fingerprint=row.fingerprint,
+                )
+                for row in transactions.itertuples(index=False)
+            ]
+        )
+        DepotAssetValuation.objects.bulk_create(
+            [
+                DepotAssetValuation(
+                    asset=assets[row.asset],
+                    value=Decimal(f"{row.value:.2f}"),
+                    date=row.date.date(),
+                )
+                for row in valuations.itertuples(index=False)
+            ],
+            update_conflicts=True,
+            unique_fields=["asset", "date"],
+            update_fields=["value"],
+        )
+
+        # the latest valuation becomes the current balance if it is newer than the last update
+        latest_valuations = valuations.sort_values("date").groupby("asset").last()
+        updated_assets = []
+        for name, row in latest_valuations.iterrows():
+            asset = assets[name]
+            if asset.current_balance == 0 or row.date.date() >= asset.last_update:
+                asset.current_balance = Decimal(f"{row.value:.2f}")
+                asset.last_update = row.date.date()
+                updated_assets.append(asset)
+        DepotAsset.objects.bulk_update(
+            updated_assets, ["current_balance", "last_update"]
+        )
+        bump_data_versions(owner=depot.owner_id)
+
+    return len(transactions), len(valuations)
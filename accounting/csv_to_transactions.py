@@ -2,21 +2,10 @@ import io
 
 import pandas as pd
 
-from .models import get_category
-
-
-def categorize(df):
-    categories = []
-    for idx, row in df.iterrows():
-        try:
-            cat = get_category(row.recipient, row.subject)
-        except:
-            print("failed to categorize ", row.recipient, row.subject)
-            raise
-        categories.append(cat)
-
-    df["category"] = categories
-    return df
+from .import_report import import_stage
+from .metrics import CSV_PARSE_SECONDS, CSV_ROWS
+from .models import Contract
+from .rules import TransactionMatcher
 
 
 def _extract_subject_info_comdirect(df):
@@ -73,7 +62,7 @@ def _extract_subject_info_comdirect(df):
     return df
 
 
-def parse_comdirect_csv_to_dataframe(csv_file):
+def parse_comdirect_csv_to_dataframe(csv_file, report=None):
     columns = {
         "Buchungstag": "date_issue",
         "Wertstellung (Valuta)": "date_booking",
@@ -82,19 +71,23 @@ def parse_comdirect_csv_to_dataframe(csv_file):
         "Umsatz in EUR": "amount",
     }
 
-    content = csv_file.read().decode(encoding="latin-1")
-    header_line = content.find('"Buchungstag')
-    footer_line = content.find("Umsätze Visa-Karte")
-    content = content[header_line:footer_line]
+    with import_stage(report, "decode"):
+        content = csv_file.read().decode(encoding="latin-1")
+    with import_stage(report, "header slicing"):
+        header_line = content.find('"Buchungstag')
+        footer_line = content.find("Umsätze Visa-Karte")
+        content = content[header_line:footer_line]
 
-    df = parse_csv(content, columns)
+    df = parse_csv(content, columns, report=report)
 
-    df = df[lambda x: (x.date_booking != "offen") & (x.date_issue != "offen")]
-    df = _extract_subject_info_comdirect(df)
+    with import_stage(report, "subject extraction") as stage:
+        df = df[lambda x: (x.date_booking != "offen") & (x.date_issue != "offen")]
+        df = _extract_subject_info_comdirect(df)
+        stage["rows"] = len(df)
     return df
 
 
-def parse_dkb_csv_to_dataframe(csv_file):
+def parse_dkb_csv_to_dataframe(csv_file, report=None):
     columns = {
         "Buchungsdatum": "date_issue",
         "Wertstellung": "date_booking",
@@ -103,25 +96,35 @@ def parse_dkb_csv_to_dataframe(csv_file):
         "Betrag (€)": "amount",
     }
 
-    content = csv_file.read().decode(encoding="utf-8")
-    header_line = content.find("Buchungsdatum")
-    content = content[header_line:]
-    df = parse_csv(content, columns, fillna_recipient="DKB AG", dateformat="%d.%m.%y")
+    with import_stage(report, "decode"):
+        content = csv_file.read().decode(encoding="utf-8")
+    with import_stage(report, "header slicing"):
+        header_line = content.find("Buchungsdatum")
+        content = content[header_line:]
+    df = parse_csv(
+        content,
+        columns,
+        fillna_recipient="DKB AG",
+        dateformat="%d.%m.%y",
+        report=report,
+    )
 
     # now based on the amount we have to select a different column as recipient
     # if the amount is >= 0 (= "Einnahme") use Zahlungspflichtige*r
     # otherwise use "Zahlungsempfänger*in"
-    recipients = []
-    for idx, row in df.iterrows():
-        if row.amount >= 0:
-            recipients.append(row["Zahlungspflichtige*r"])
-        else:
-            recipients.append(row["Zahlungsempfänger*in"])
-    df["recipient"] = recipients
+    with import_stage(report, "subject extraction") as stage:
+        recipients = []
+        for idx, row in df.iterrows():
+            if row.amount >= 0:
+                recipients.append(row["Zahlungspflichtige*r"])
+            else:
+                recipients.append(row["Zahlungsempfänger*in"])
+        df["recipient"] = recipients
+        stage["rows"] = len(df)
     return df
 
 
-def parse_holvi_csv_to_dataframe(csv_file):
+def parse_holvi_csv_to_dataframe(csv_file, report=None):
     columns = {
         "Zahlungsdatum": "date_issue",
         "Buchungsdatum": "date_booking",
@@ -129,13 +132,17 @@ def parse_holvi_csv_to_dataframe(csv_file):
         "Betrag": "amount",
         "Referenz": "subject",
     }
-    content = csv_file.read().decode(encoding="utf-8")
-    header_line = content.find("Zahlungsdatum")
-    content = content[header_line:]
-    return parse_csv(content, columns, fillna_subject=lambda x: x.Nachricht)
+    with import_stage(report, "decode"):
+        content = csv_file.read().decode(encoding="utf-8")
+    with import_stage(report, "header slicing"):
+        header_line = content.find("Zahlungsdatum")
+        content = content[header_line:]
+    return parse_csv(
+        content, columns, fillna_subject=lambda x: x.Nachricht, report=report
+    )
 
 
-def parse_n26_csv_to_dataframe(csv_file):
+def parse_n26_csv_to_dataframe(csv_file, report=None):
     columns = {
         "Booking Date": "date_issue",
         "Value Date": "date_booking",
@@ -144,13 +151,15 @@ def parse_n26_csv_to_dataframe(csv_file):
         "Amount (EUR)": "amount",
     }
 
-    content = csv_file.read().decode(encoding="utf-8")
+    with import_stage(report, "decode"):
+        content = csv_file.read().decode(encoding="utf-8")
     return parse_csv(
         content,
         columns,
         fillna_subject=lambda x: x.recipient,
         dateformat="%Y-%m-%d",
         german_float=False,
+        report=report,
     )
 
 
@@ -161,56 +170,89 @@ def parse_csv(
     fillna_subject="",
     dateformat="%d.%m.%Y",
     german_float=True,
+    report=None,
 ):
     dtypes = {orig: float if new == "amount" else str for orig, new in columns.items()}
 
-    df = pd.read_csv(
-        io.StringIO(content),
-        sep=";",
-        encoding="utf-8",
-        header=0,
-        dtype=dtypes,
-        **{"thousands": ".", "decimal": ","} if german_float else {},
-    )
+    with import_stage(report, "read_csv") as stage:
+        df = pd.read_csv(
+            io.StringIO(content),
+            sep=";",
+            encoding="utf-8",
+            header=0,
+            dtype=dtypes,
+            **{"thousands": ".", "decimal": ","} if german_float else {},
+        )
+        stage["rows"] = len(df)
 
     df.rename(columns=columns, inplace=True)
 
-    df.date_booking = pd.to_datetime(df.date_booking, format=dateformat)
-    df.date_issue = pd.to_datetime(df.date_issue, format=dateformat)
-
-    df.fillna(
-        {
-            "recipient": fillna_recipient,
-            "subject": fillna_subject
-            if isinstance(fillna_subject, str)
-            else fillna_subject(df),
-        },
-        inplace=True,
-    )
-    df["full_subject_string"] = df.subject
-    # df = df[list(columns.values()) + ["full_subject_string"]]
-    df.dropna(
-        subset=["date_issue", "date_booking", "amount", "subject"],
-        how="all",
-        inplace=True,
-    )
+    with import_stage(report, "date parsing") as stage:
+        df.date_booking = pd.to_datetime(df.date_booking, format=dateformat)
+        df.date_issue = pd.to_datetime(df.date_issue, format=dateformat)
+        stage["rows"] = len(df)
+
+    with import_stage(report, "cleanup") as stage:
+        df.fillna(
+            {
+                "recipient": fillna_recipient,
+                "subject": fillna_subject
+                if isinstance(fillna_subject, str)
+                else fillna_subject(df),
+            },
+            inplace=True,
+        )
+        df["full_subject_string"] = df.subject
+        # df = df[list(columns.values()) + ["full_subject_string"]]
+        df.dropna(
+            subset=["date_issue", "date_booking", "amount", "subject"],
+            how="all",
+            inplace=True,
+        )
+        stage["rows"] = len(df)
 
     return df
 
 
-def csv_to_transactions(csv_file, account):
+def csv_to_transactions(csv_file, account, report=None):
+    """
+    Parse the CSV export of the given account into a list of dictionaries, one per transaction. The duration,
+    number of rows and memory of the single stages are recorded in the report (an ImportReport), if given.
+    """
+    bank = account.bank.lower()
+    with CSV_PARSE_SECONDS.labels(bank=bank).time():
+        transaction_df = _parse_and_match(csv_file, account, report)
+
+    CSV_ROWS.labels(bank=bank, stage="parsed").inc(len(transaction_df))
+    CSV_ROWS.labels(bank=bank, stage="categorised").inc(
+        int(transaction_df.category.notna().sum())
+    )
+
+    with import_stage(report, "to_dict") as stage:
+        transaction_df["bank_account"] = account
+        transactions = transaction_df.to_dict("records")
+        stage["rows"] = len(transactions)
+    return transactions
+
+
+def _parse_and_match(csv_file, account, report=None):
     if account.bank.lower() == "comdirect":
-        transaction_df = parse_comdirect_csv_to_dataframe(csv_file)
+        transaction_df = parse_comdirect_csv_to_dataframe(csv_file, report)
     elif account.bank.lower() == "dkb":
-        transaction_df = parse_dkb_csv_to_dataframe(csv_file)
+        transaction_df = parse_dkb_csv_to_dataframe(csv_file, report)
     elif account.bank.lower() == "holvi":
-        transaction_df = parse_holvi_csv_to_dataframe(csv_file)
+        transaction_df = parse_holvi_csv_to_dataframe(csv_file, report)
     elif account.bank.lower() == "n26":
-        transaction_df = parse_n26_csv_to_dataframe(csv_file)
+        transaction_df = parse_n26_csv_to_dataframe(csv_file, report)
     else:
         raise ValueError(
             "At the moment only CSV exports of Comdirect, DKB, N26, or Holvi are supported."
         )
-    transaction_df = categorize(transaction_df)
-    transaction_df["bank_account"] = account
-    return transaction_df.to_dict("records")
+    # categories and contracts are assigned in one vectorised pass over all imported transactions
+    with import_stage(report, "categorisation") as stage:
+        matcher = TransactionMatcher(
+            contracts=Contract.objects.filter(owner=account.owner)
+        )
+        transaction_df = matcher.apply(transaction_df)
+        stage["rows"] = len(transaction_df)
+    return transaction_df
@@ -0,0 +1,197 @@
+import functools
+import hashlib
+import os
+import weakref
+
+from django.contrib import messages
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+
+from .models import (
+    BankAccount,
+    BankDepot,
+    Category,
+    Contract,
+    ContractFile,
+    DataVersion,
+    DepotAsset,
+    DepotAssetTransaction,
+    DepotAssetValuation,
+    Transaction,
+    TransactionArchive,
+    bump_data_versions,
+)
+
+# lookup of the data versions affected by a change of an instance of the model
+_OWNER_LOOKUPS = {
+    BankAccount: lambda instance: {"owner": instance.owner_id},
+    BankDepot: lambda instance: {"owner": instance.owner_id},
+    Contract: lambda instance: {"owner": instance.owner_id},
+    Transaction: lambda instance: {"owner__bankaccount": instance.bank_account_id},
+    DepotAsset: lambda instance: {"owner__bankdepot": instance.bank_depot_id},
+    DepotAssetTransaction: lambda instance: {
+        "owner__bankdepot__belongs_to": instance.asset_id
+    },
+    DepotAssetValuation: lambda instance: {
+        "owner__bankdepot__belongs_to": instance.asset_id
+    },
+    ContractFile: lambda instance: {"owner__contract": instance.contract_id},
+    TransactionArchive: lambda instance: {
+        "owner__bankaccount": instance.bank_account_id
+    },
+    # categories are shared by all users
+    Category: lambda instance: {},
+}
+
+
+def _bump_on_change(sender, instance, **kwargs):
+    lookup = _OWNER_LOOKUPS[sender](instance)
+    if any(value is None for value in lookup.values()):
+        return
+
+    connection = transaction.get_connection()
+    if not connection.in_atomic_block:
+        bump_data_versions(**lookup)
+        return
+
+    # within a database transaction (e.g. deleting many transactions) the versions are increased once on commit
+    key = tuple(sorted(lookup.items()))
+    pending = _get_pending_bumps(connection)
+    if key in pending:
+        return
+
+    def bump():
+        pending.pop(key, None)
+        bump_data_versions(**lookup)
+
+    pending[key] = bump
+    transaction.on_commit(bump)
+
+
+def _get_pending_bumps(connection):
+    # bumps registered with on_commit by their lookup. Only the connection keeps a registered callback alive, so
+    # the bumps of rolled back transactions and savepoints disappear together with their callbacks
+    if not hasattr(connection, "pending_data_version_bumps"):
+        connection.pending_data_version_bumps = weakref.WeakValueDictionary()
+    return connection.pending_data_version_bumps
+
+
+def connect_signals():
+    """
+    Increase the data version of the owner on every saved or deleted instance. Bulk operations do not send
+    signals, they have to call bump_data_versions themselves.
+    """
+    for model in _OWNER_LOOKUPS:
+        post_save.connect(_bump_on_change, sender=model)
+        post_delete.connect(_bump_on_change, sender=model)
+
+
+@functools.cache
+def _get_templates_version():
+    # changed templates change the rendered pages as well (e.g. after a deployment)
+    templates_dir = os.path.join(os.path.dirname(__file__), "templates")
+    return max(
+        (
+            os.path.getmtime(os.path.join(root, name))
+            for root, _, names in os.walk(templates_dir)
+            for name in names
+        ),
+        default=0,
+    )
+
+
+def _get_data_versions(owner_ids):
+    versions = list(DataVersion.objects.filter(owner_id__in=owner_ids))
+    missing = set(owner_ids) - {version.owner_id for version in versions}
+    if missing:
+        DataVersion.objects.bulk_create(
+            [DataVersion(owner_id=owner_id) for owner_id in missing],
+            ignore_conflicts=True,
+        )
+        versions = list(DataVersion.objects.filter(owner_id__in=owner_ids))
+    return versions
+
+
+def _get_page_version(request, get_owner_ids, kwargs):
+    """
+    ETag and last modification of the page, computed once per request. None if the page cannot be served from the
+    client's cache, because the user is not allowed to see it or messages are waiting to be displayed.
+    """
+    if hasattr(request, "_page_version"):
+        return request._page_version
+
+    request._page_version = None
+    owner_ids = get_owner_ids(request, **kwargs)
+    if not owner_ids or len(messages.get_messages(request)) > 0:
+        return None
+    if not request.user.is_superuser and owner_ids != [request.user.pk]:
+        return None
+
+    versions = _get_data_versions(owner_ids)
+    token = ":".join(
+        [str(request.user.pk), str(_get_templates_version())]
+        + [
+            f"{v.owner_id}-{v.version}"
+            for v in sorted(versions, key=lambda v: v.owner_id)
+        ]
+    )
+    request._page_version = (
+        hashlib.md5(token.encode()).hexdigest(),
+        max(version.modified for version in versions),
+    )
+    return request._page_version
+
+
+def condition_on_data_version(get_owner_ids):
+    """
+    Decorator answering conditional GET requests with 304 Not Modified as long as the data of the owners shown on
+    the page did not change, without calling the view. get_owner_ids(request, **kwargs) returns the pks of these
+    owners (or None if they do not exist).
+    """
+
+    def etag_func(request, *args, **kwargs):
+        page_version = _get_page_version(request, get_owner_ids, kwargs)
+        return page_version[0] if page_version else None
+
+    def last_modified_func(request, *args, **kwargs):
+        page_version = _get_page_version(request, get_owner_ids, kwargs)
+        return page_version[1] if page_version else None
+
+    def decorator(view):
+        conditional_view = condition(
+            etag_func=etag_func, last_modified_func=last_modified_func
+        )(view)
+
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            response = conditional_view(request, *args, **kwargs)
+            if response.has_header("ETag"):
+                # the browser has to revalidate the page on every request, which is answered cheaply
+                patch_cache_control(response, private=True, no_cache=True)
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def get_account_owner_ids(request, pk):
+    return list(BankAccount.objects.filter(pk=pk).values_list("owner_id", flat=True))
+
+
+def get_depot_owner_ids(request, pk):
+    return list(BankDepot.objects.filter(pk=pk).values_list("owner_id", flat=True))
+
+
+def get_contract_owner_ids(request, pk):
+    return list(Contract.objects.filter(pk=pk).values_list("owner_id", flat=True))
+
+
+def get_viewable_owner_ids(request):
+    # superusers see the accounts of all users
+    if request.user.is_superuser:
+        return list(User.objects.order_by("pk").values_list("pk", flat=True))
+    return [request.user.pk]
@@ -0,0 +1,328 @@
+import datetime
+import random
+from decimal import Decimal
+
+import pandas as pd
+from dateutil.relativedelta import relativedelta
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from .models import (
+    BankAccount,
+    BankDepot,
+    Category,
+    Contract,
+    DepotAsset,
+    DepotAssetTransaction,
+    DepotAssetValuation,
+    Transaction,
+)
+from .rules import TransactionMatcher
+
+# Synthetic but realistic data to try out the app and to benchmark it with a known amount of data.
+
+BANKS = ["comdirect", "dkb", "holvi", "n26"]
+
+CATEGORY_PATTERNS = {
+    "Lebensmittel": ["rewe", "edeka", "aldi", "lidl"],
+    "Drogerie": ["dm-drogerie", "rossmann"],
+    "Miete": ["miete", "wohnbau"],
+    "Gehalt": ["gehalt", "lohn"],
+    "Versicherung": ["versicherung", "huk", "allianz"],
+    "Streaming": ["netflix", "spotify"],
+    "Mobilität": ["db vertrieb", "shell", "aral"],
+    "Restaurant": ["lieferando", "restaurant"],
+    "Energie": ["stadtwerke", "strom"],
+    "Online-Shopping": ["amazon"],
+}
+
+# recurring payments: (recipient, subject, amount, period in months)
+RECURRING_PAYMENTS = [
+    ("Arbeitgeber GmbH", "Gehalt", Decimal("3200.00"), 1),
+    ("Wohnbau eG", "Miete", Decimal("-950.00"), 1),
+    ("Stadtwerke", "Abschlag Strom", Decimal("-85.00"), 1),
+    ("Netflix International B.V.", "Netflix Abo", Decimal("-12.99"), 1),
+    ("Spotify AB", "Spotify Premium", Decimal("-9.99"), 1),
+    ("Allianz Versicherungs-AG", "Hausratversicherung", Decimal("-35.40"), 3),
+    ("HUK-Coburg", "Kfz-Versicherung", Decimal("-420.50"), 12),
+]
+
+# irregular payments: (recipient, subject, minimum amount, maximum amount)
+RANDOM_PAYMENTS = [
+    ("REWE Markt GmbH", "Einkauf", 5, 120),
+    ("EDEKA", "Einkauf", 5, 80),
+    ("ALDI SUED", "Einkauf", 5, 90),
+    ("dm-drogerie markt", "Einkauf", 3, 40),
+    ("Lieferando", "Bestellung", 15, 45),
+    ("Shell Tankstelle", "Tanken", 30, 90),
+    ("Amazon EU S.a.r.l.", "Bestellung", 8, 250),
+    ("DB Vertrieb GmbH", "Fahrkarte", 10, 150),
+    ("Restaurant Da Mario", "Kartenzahlung", 20, 120),
+]
+
+DEPOT_ASSETS = ["MSCI World ETF", "Emerging Markets ETF", "Tagesgeld", "Anleihen ETF"]
+
+
+def generate_transactions(rng, date_start, date_end, random_per_month):
+    """
+    Recurring and random transactions between date_start and date_end as a list of dicts with the keys
+    recipient, subject, amount, date_issue and date_booking, ordered by date.
+    """
+    transactions = []
+
+    for recipient, subject, amount, period in RECURRING_PAYMENTS:
+        day = rng.randint(1, 28)
+        date = date_start.replace(day=day)
+        while date <= date_end:
+            if date >= date_start:
+                transactions.append(
+                    {
+                        "recipient": recipient,
+                        "subject": f"{subject} {date:%m/%Y}",
+                        "amount": amount,
+                        "date_issue": date,
+                    }
+                )
+            date += relativedelta(months=period)
+
+    n_days = (date_end - date_start).days + 1
+    n_random = round(random_per_month * n_days / 30.44)
+    for _ in range(n_random):
+        recipient, subject, amount_min, amount_max = rng.choice(RANDOM_PAYMENTS)
+        amount = Decimal(rng.randint(amount_min * 100, amount_max * 100)) / 100
+        transactions.append(
+            {
+                "recipient": recipient,
+                "subject": f"{subject} {rng.randint(100000, 999999)}",
+                "amount": -amount,
+                "date_issue": date_start + datetime.timedelta(rng.randrange(n_days)),
+            }
+        )
+
+    for t in transactions:
+        t["date_booking"] = t["date_issue"] + datetime.timedelta(rng.choice([0, 0, 1]))
+
+    return sorted(transactions, key=lambda t: t["date_issue"])
+
+
+def _create_categories():
+    existing = set(Category.objects.values_list("name", flat=True))
+    Category.objects.bulk_create(
+        [
+            Category(name=name, patterns="\n".join(patterns))
+            for name, patterns in CATEGORY_PATTERNS.items()
+            if name not in existing
+        ]
+    )
+
+
+def _create_depot(rng, user, name, n_assets, date_start, date_end):
+    depot = BankDepot.objects.create(owner=user, name=name)
+    assets = DepotAsset.objects.bulk_create(
+        [
+            DepotAsset(
+                bank_depot=depot,
+                name=asset_name,
+                current_balance=0,
+                last_update=date_end,
+            )
+            for asset_name in DEPOT_ASSETS[:n_assets]
+        ]
+    )
+
+    transactions = []
+    valuations = []
+    for asset in assets:
+        savings_rate = Decimal(rng.choice([50, 100, 250, 500]))
+        monthly_return = rng.uniform(-0.002, 0.008)
+        value = 0.0
+        date = date_start.replace(day=1)
+        while date <= date_end:
+            # monthly savings plan and a valuation at the end of the month
+            transactions.append(
+                DepotAssetTransaction(asset=asset, amount=savings_rate, date_issue=date)
+            )
+            value = (value + float(savings_rate)) * (
+                1 + monthly_return + rng.gauss(0, 0.03)
+            )
+            valuation_date = min(date + relativedelta(months=1, days=-1), date_end)
+            valuations.append(
+                DepotAssetValuation(
+                    asset=asset, value=Decimal(f"{value:.2f}"), date=valuation_date
+                )
+            )
+            date += relativedelta(months=1)
+        asset.current_balance = valuations[-1].value
+
+    DepotAssetTransaction.objects.bulk_create(transactions, batch_size=5000)
+    DepotAssetValuation.objects.bulk_create(valuations, batch_size=5000)
+    DepotAsset.objects.bulk_update(assets, ["current_balance"])
+    return depot
+
+
+def generate_demo_data(
+    n_users=1,
+    n_accounts=2,
+    n_contracts=5,
+    n_depots=1,
+    n_assets=3,
+    years=5,
+    random_per_month=60,
+    password="demo",
+    seed=0,
+):
+    """
+    Create users demo1, demo2, ... with bank accounts, contracts (with match rules), depots and several
+    years of transactions. Everything is inserted with bulk_create in a single database transaction.
+    Returns the number of created transactions.
+    """
+    rng = random.Random(seed)
+    date_end = datetime.date.today()
+    date_start = date_end - relativedelta(years=years)
+
+    with transaction.atomic():
+        _create_categories()
+        matcher = TransactionMatcher()
+        n_transactions = 0
+
+        for i in range(1, n_users + 1):
+            user, _ = User.objects.get_or_create(username=f"demo{i}")
+            user.set_password(password)
+            user.save()
+
+            contracts = Contract.objects.bulk_create(
+                [
+                    Contract(
+                        owner=user,
+                        name=recipient,
+                        description=subject,
+                        start_date=date_start,
+                        recipient_patterns=recipient.split()[0].lower(),
+                    )
+                    for recipient, subject, _, _ in RECURRING_PAYMENTS[:n_contracts]
+                ]
+            )
+            contracts = {c.name: c for c in contracts}
+
+            for j in range(n_accounts):
+                bank = BANKS[j % len(BANKS)]
+                account = BankAccount.objects.create(
+                    owner=user,
+                    name=f"Girokonto {j + 1}",
+                    bank=bank,
+                    current_amount=Decimal(rng.randint(0, 500000)) / 100,
+                )
+                data = generate_transactions(
+                    rng, date_start, date_end, random_per_month
+                )
+                categories = matcher.categorize(
+                    pd.Series([t["recipient"] for t in data]),
+                    pd.Series([t["subject"] for t in data]),
+                )
+                transactions = [
+                    Transaction(
+                        bank_account=account,
+                        category=category,
+                        contract=contracts.get(t["recipient"]),
+                        full_subject_string=f"{t['recipient']} {t['subject']}",
+                        **t,
+                    )
+                    for t, category in zip(data, categories)
+                ]
+                Transaction.objects.bulk_create(transactions, batch_size=5000)
+                n_transactions += len(transactions)
+
+            for j in range(n_depots):
+                _create_depot(
+                    rng, user, f"Depot {j + 1}", n_assets, date_start, date_end
+                )
+
+    return n_transactions
+
+
+def _german_amount(amount):
+    return f"{amount:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+
+
+def _comdirect_csv(transactions):
+    lines = [
+        ";",
+        '"Umsätze Girokonto";"Zeitraum: Demo";',
+        "",
+        '"Buchungstag";"Wertstellung (Valuta)";"Vorgang";"Buchungstext";"Umsatz in EUR";',
+    ]
+    for i, t in enumerate(transactions):
+        if t["amount"] >= 0:
+            event, party = "Gutschrift", "Auftraggeber"
+        else:
+            event, party = "Lastschrift / Belastung", "Empfänger"
+        lines.append(
+            f'"{t["date_issue"]:%d.%m.%Y}";"{t["date_booking"]:%d.%m.%Y}";"{event}";'
+            f'"{party}: {t["recipient"]} Buchungstext: {t["subject"]} Ref. {i:08d}";'
+            f'"{_german_amount(t["amount"])}";'
+        )
+    lines += ["", "Umsätze Visa-Karte (Kreditkarte);", ""]
+    return "\n".join(lines).encode("latin-1", errors="replace")
+
+
+def _dkb_csv(transactions):
+    lines = [
+        '"Konto";"Girokonto DE00 0000 0000 0000 0000 00"',
+        '""',
+        '"Kontostand vom heute:";"1.000,00 €"',
+        '""',
+        "Buchungsdatum;Wertstellung;Status;Zahlungspflichtige*r;Zahlungsempfänger*in;"
+        "Verwendungszweck;Umsatztyp;IBAN;Betrag (€);Gläubiger-ID;Mandatsreferenz;Kundenreferenz",
+    ]
+    for t in transactions:
+        incoming = t["amount"] >= 0
+        payer = t["recipient"] if incoming else "Demo Nutzer"
+        payee = "Demo Nutzer" if incoming else t["recipient"]
+        lines.append(
+            f'"{t["date_issue"]:%d.%m.%y}";"{t["date_booking"]:%d.%m.%y}";"Gebucht";"{payer}";"{payee}";'
+            f'"{t["subject"]}";"{"Eingang" if incoming else "Ausgang"}";"DE00000000000000000000";'
+            f'"{_german_amount(t["amount"])}";"";"";""'
+        )
+    return "\n".join(lines).encode("utf-8")
+
+
+def _holvi_csv(transactions):
+    lines = ["Zahlungsdatum;Buchungsdatum;Gegenpartei;Betrag;Referenz;Nachricht"]
+    for t in transactions:
+        lines.append(
+            f'"{t["date_issue"]:%d.%m.%Y}";"{t["date_booking"]:%d.%m.%Y}";"{t["recipient"]}";'
+            f'"{_german_amount(t["amount"])}";"{t["subject"]}";""'
+        )
+    return "\n".join(lines).encode("utf-8")
+
+
+def _n26_csv(transactions):
+    lines = [
+        '"Booking Date";"Value Date";"Partner Name";"Payment Reference";"Amount (EUR)"'
+    ]
+    for t in transactions:
+        lines.append(
+            f'"{t["date_issue"]:%Y-%m-%d}";"{t["date_booking"]:%Y-%m-%d}";"{t["recipient"]}";'
+            f'"{t["subject"]}";"{t["amount"]:.2f}"'
+        )
+    return "\n".join(lines).encode("utf-8")
+
+
+CSV_WRITERS = {
+    "comdirect": _comdirect_csv,
+    "dkb": _dkb_csv,
+    "holvi": _holvi_csv,
+    "n26": _n26_csv,
+}
+
+
+def generate_csv_export(bank, months=12, random_per_month=60, seed=0):
+    """
+    A synthetic CSV export of the last months in the format of the given bank, as it is accepted by
+    csv_to_transactions.
+    """
+    rng = random.Random(seed)
+    date_end = datetime.date.today()
+    date_start = date_end - relativedelta(months=months)
+    transactions = generate_transactions(rng, date_start, date_end, random_per_month)
+    return CSV_WRITERS[bank](transactions)
@@ -0,0 +1,183 @@
+import csv
+import datetime
+import tempfile
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import xlsxwriter
+
+# transactions are fetched from the database in chunks of this size, so an export never holds all rows in memory
+EXPORT_CHUNK_SIZE = 2000
+
+# exported values and their column titles
+EXPORT_COLUMNS = {
+    "date_issue": "Buchungstag",
+    "date_booking": "Wertstellungstag",
+    "recipient": "Empfänger/Versender",
+    "amount": "Betrag",
+    "subject": "Buchungsinformation",
+    "category__name": "Kategorie",
+    "contract__name": "Vertrag",
+    "full_subject_string": "gesamte Buchungsreferenz",
+}
+
+_AMOUNT_COLUMN = list(EXPORT_COLUMNS).index("amount")
+# columns of the archived transactions in the order of EXPORT_COLUMNS
+_ARCHIVED_COLUMNS = [
+    "date_issue",
+    "date_booking",
+    "recipient",
+    "amount",
+    "subject",
+    "category",
+    "contract",
+    "full_subject_string",
+]
+
+# content type of the supported export formats
+EXPORT_CONTENT_TYPES = {
+    "csv": "text/csv",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+PARQUET_SCHEMA = pa.schema(
+    [
+        ("date_issue", pa.date32()),
+        ("date_booking", pa.date32()),
+        ("recipient", pa.string()),
+        ("amount", pa.decimal128(10, 2)),
+        ("subject", pa.string()),
+        ("category", pa.string()),
+        ("contract", pa.string()),
+        ("full_subject_string", pa.string()),
+    ]
+)
+
+
+def iter_export_rows(transactions, archived=None):
+    """
+    The exported values of the given transactions as tuples (in the order of EXPORT_COLUMNS), followed by the
+    archived transactions (a DataFrame as returned by read_archived_transactions) if given.
+    """
+    yield from transactions.values_list(*EXPORT_COLUMNS).iterator(
+        chunk_size=EXPORT_CHUNK_SIZE
+    )
+    if archived is not None:
+        archived = archived[_ARCHIVED_COLUMNS].astype(object)
+        # empty categories and contracts are read from the archive as NaN, they are exported as empty values
+        archived = archived.where(archived.notna(), None)
+        yield from archived.itertuples(index=False, name=None)
+
+
+def _iter_chunks(rows):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == EXPORT_CHUNK_SIZE:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class _Echo:
+    """
+    File-like object that returns what is written to it instead of buffering it, for csv.writer.
+    """
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(rows):
+    writer = csv.writer(_Echo(), delimiter=";")
+    # the byte order mark lets Excel detect the encoding
+    yield "\ufeff" + writer.writerow(EXPORT_COLUMNS.values())
+    for row in rows:
+        yield writer.writerow(row)
+
+
+class _ChunkSink:
+    """
+    Write-only file-like object collecting the written bytes until they are taken by the response generator.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_parquet(rows):
+    """
+    Write the rows as Parquet file, one row group per chunk of rows. The bytes of every row group
+    are sent as soon as it is written, only the file footer is kept until the end.
+    """
+    sink = _ChunkSink()
+    with pq.ParquetWriter(sink, PARQUET_SCHEMA) as writer:
+        for chunk in _iter_chunks(rows):
+            columns = zip(*chunk)
+            batch = pa.RecordBatch.from_arrays(
+                [
+                    pa.array(values, type=field.type)
+                    for values, field in zip(columns, PARQUET_SCHEMA)
+                ],
+                schema=PARQUET_SCHEMA,
+            )
+            writer.write_batch(batch)
+            data = sink.take()
+            if data:
+                yield data
+    yield sink.take()
+
+
+def write_xlsx(rows):
+    """
+    Write the rows to an anonymous temporary file as XLSX, returned at position 0. In constant memory mode
+    every row is flushed to disk once the next row is written. An XLSX file is a zip archive that can only be
+    assembled once all rows are written, so it is streamed from the temporary file afterwards.
+    """
+    file = tempfile.TemporaryFile()
+    workbook = xlsxwriter.Workbook(
+        file, {"constant_memory": True, "default_date_format": "dd.mm.yyyy"}
+    )
+    worksheet = workbook.add_worksheet("Transaktionen")
+    bold = workbook.add_format({"bold": True})
+    money = workbook.add_format({"num_format": "#,##0.00 €"})
+
+    worksheet.write_row(0, 0, list(EXPORT_COLUMNS.values()), bold)
+    for row_index, row in enumerate(rows, start=1):
+        for col_index, value in enumerate(row):
+            if value is None:
+                continue
+            if isinstance(value, datetime.date):
+                worksheet.write_datetime(row_index, col_index, value)
+            elif col_index == _AMOUNT_COLUMN:
+                worksheet.write_number(row_index, col_index, float(value), money)
+            else:
+                worksheet.write_string(row_index, col_index, value)
+    workbook.close()
+
+    file.seek(0)
+    return file
@@ -1,9 +1,12 @@
 from django import forms
 from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.db import transaction
 from django.forms import inlineformset_factory
 from django.urls import reverse_lazy
 from django_addanother.widgets import AddAnotherWidgetWrapper
 
+from .metrics import CSV_ROWS
 from .models import (
     Category,
     Contract,
@@ -18,6 +21,14 @@ class DateInput(forms.DateInput):
     input_type = "date"
 
 
+def validate_not_archived(date_issue, archived_years):
+    # transactions of archived years are stored in the archive, adding them again would count them twice
+    if date_issue.year in archived_years:
+        raise ValidationError(
+            f"Das Jahr {date_issue.year} ist archiviert, es können keine Transaktionen hinzugefügt werden."
+        )
+
+
 class TransactionForm(forms.ModelForm):
     def __init__(self, *args, **kwargs):
         user = kwargs.pop("user")
@@ -28,6 +39,14 @@ class TransactionForm(forms.ModelForm):
             required=False,
         )
 
+    def clean(self):
+        cleaned_data = super().clean()
+        bank_account = cleaned_data.get("bank_account")
+        date_issue = cleaned_data.get("date_issue")
+        if bank_account and date_issue:
+            validate_not_archived(date_issue, bank_account.get_archived_years())
+        return cleaned_data
+
     class Meta:
         model = Transaction
         fields = "__all__"
@@ -102,10 +121,16 @@ class TransactionFormTableRow(forms.ModelForm):
 
     def __init__(self, *args, **kwargs):
         user = kwargs.pop("user")
+        self.archived_years = kwargs.pop("archived_years", set())
         super().__init__(*args, **kwargs)
 
         if not user.is_superuser:
-            self.fields["contract"]["queryset"] = Contract.objects.filter(pk=user.pk)
+            self.fields["contract"].queryset = get_contracts(user)
+
+    def clean_date_issue(self):
+        date_issue = self.cleaned_data["date_issue"]
+        validate_not_archived(date_issue, self.archived_years)
+        return date_issue
 
     class Meta:
         model = Transaction
@@ -195,6 +220,8 @@ class FilterTransactionsForm(forms.Form):
     )
 
 
+# the data version of the owner is increased once on commit instead of once per transaction
+@transaction.atomic
 def process_transactions_formset(transactions_formset, bank_account):
     n_added_transactions = 0
 
@@ -212,6 +239,7 @@ def process_transactions_formset(transactions_formset, bank_account):
         t = Transaction(
             bank_account=bank_account,
             category=data["category"],
+            contract=data["contract"],
             recipient=recipient,
             amount=data["amount"],
             subject=data["subject"],
@@ -222,4 +250,7 @@ def process_transactions_formset(transactions_formset, bank_account):
         t.save()
         n_added_transactions += 1
 
+    CSV_ROWS.labels(bank=bank_account.bank.lower(), stage="inserted").inc(
+        n_added_transactions
+    )
     return n_added_transactions
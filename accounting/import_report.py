@@ -0,0 +1,81 @@
+import json
+import logging
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class ImportReport:
+    """
+    Wall time, number of rows and (optionally) peak memory of every stage of a CSV import. The peak memory is
+    traced with tracemalloc, which slows the import down considerably, so it is only measured if requested.
+    """
+
+    def __init__(self, bank, trace_memory=False):
+        self.bank = bank
+        self.trace_memory = trace_memory
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Measure one stage of the import. The number of rows the stage produced can be set on the yielded dict.
+        """
+        entry = {"stage": name, "rows": None, "duration_ms": None, "peak_kib": None}
+        # tracemalloc may already be running, e.g. if the whole process is traced
+        started_tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            baseline, _ = tracemalloc.get_traced_memory()
+
+        start = time.perf_counter()
+        try:
+            yield entry
+        finally:
+            entry["duration_ms"] = round((time.perf_counter() - start) * 1000, 2)
+            if self.trace_memory:
+                _, peak = tracemalloc.get_traced_memory()
+                entry["peak_kib"] = round((peak - baseline) / 1024, 1)
+            if started_tracing:
+                tracemalloc.stop()
+            self.stages.append(entry)
+
+    @property
+    def duration_ms(self):
+        return round(sum(entry["duration_ms"] for entry in self.stages), 2)
+
+    @property
+    def slowest_stage(self):
+        if not self.stages:
+            return None
+        return max(self.stages, key=lambda entry: entry["duration_ms"])["stage"]
+
+    def log(self):
+        logger.info(
+            json.dumps(
+                {
+                    "event": "csv_import",
+                    "bank": self.bank,
+                    "duration_ms": self.duration_ms,
+                    "slowest_stage": self.slowest_stage,
+                    "stages": self.stages,
+                }
+            )
+        )
+
+
+@contextmanager
+def import_stage(report, name):
+    """
+    Measure a stage of the import in the given report, does nothing if no report is given.
+    """
+    if report is None:
+        yield {}
+        return
+
+    with report.stage(name) as entry:
+        yield entry
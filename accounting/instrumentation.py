@@ -0,0 +1,218 @@
+import contextvars
+import functools
+import json
+import logging
+import os
+import time
+import traceback
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+# metrics of the request that is currently handled by this thread (or task)
+_current_metrics = contextvars.ContextVar("request_metrics", default=None)
+
+_PROJECT_DIR = str(settings.BASE_DIR)
+_THIS_FILE = os.path.abspath(__file__)
+
+
+def is_enabled():
+    return getattr(settings, "REQUEST_INSTRUMENTATION", False)
+
+
+class RequestMetrics:
+    """
+    Timings collected while handling one request: executed queries (with the line of project code that
+    triggered them), template rendering and Dash callbacks.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = []
+        self.template_time = 0.0
+        self.template_depth = 0
+        self.callbacks = []
+
+    @property
+    def db_time(self):
+        return sum(duration for _, duration, _ in self.queries)
+
+    def slowest_queries(self, n):
+        return sorted(self.queries, key=lambda q: q[1], reverse=True)[:n]
+
+    def server_timing(self, total_time):
+        # durations in milliseconds, see https://www.w3.org/TR/server-timing/
+        entries = [
+            f'db;dur={self.db_time * 1000:.1f};desc="{len(self.queries)} queries"',
+            f"tpl;dur={self.template_time * 1000:.1f}",
+        ]
+        entries += [
+            f'cb{i};dur={duration * 1000:.1f};desc="{name}"'
+            for i, (name, duration) in enumerate(self.callbacks)
+        ]
+        entries.append(f"total;dur={total_time * 1000:.1f}")
+        return ", ".join(entries)
+
+
+def _get_call_site():
+    # the innermost frame of project code (outside of this module and installed packages)
+    for frame in reversed(traceback.extract_stack()):
+        filename = os.path.abspath(frame.filename)
+        if (
+            filename.startswith(_PROJECT_DIR)
+            and filename != _THIS_FILE
+            and "site-packages" not in filename
+        ):
+            return f"{os.path.relpath(filename, _PROJECT_DIR)}:{frame.lineno} in {frame.name}"
+    return None
+
+
+def _record_query(execute, sql, params, many, context):
+    metrics = _current_metrics.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.queries.append((sql, time.perf_counter() - start, _get_call_site()))
+
+
+@contextmanager
+def record_queries():
+    """
+    Record the queries of the current thread's database connection into the metrics of the current request.
+    Threads started by a request have their own connection and have to enter this context manager themselves
+    (within a copy of the request's context).
+    """
+    if _current_metrics.get() is None:
+        yield
+        return
+
+    with connection.execute_wrapper(_record_query):
+        yield
+
+
+def instrument_template_rendering():
+    """
+    Measure the time spent in rendering templates. Included templates are part of the outermost template.
+    """
+    from django.template.base import Template
+
+    render = Template.render
+    if getattr(render, "instrumented", False):
+        return
+
+    @functools.wraps(render)
+    def instrumented_render(self, context):
+        metrics = _current_metrics.get()
+        if metrics is None:
+            return render(self, context)
+
+        metrics.template_depth += 1
+        start = time.perf_counter()
+        try:
+            return render(self, context)
+        finally:
+            metrics.template_depth -= 1
+            if metrics.template_depth == 0:
+                metrics.template_time += time.perf_counter() - start
+
+    instrumented_render.instrumented = True
+    Template.render = instrumented_render
+
+
+def instrument_callback(func):
+    """
+    Measure the execution time of a Dash callback. The original function is returned unchanged if the
+    instrumentation is disabled.
+    """
+    if not is_enabled():
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            duration = time.perf_counter() - start
+            metrics = _current_metrics.get()
+            if metrics is not None:
+                metrics.callbacks.append((func.__name__, duration))
+            logger.info(
+                json.dumps(
+                    {
+                        "event": "dash_callback",
+                        "callback": func.__name__,
+                        "duration_ms": round(duration * 1000, 1),
+                    }
+                )
+            )
+
+    return wrapper
+
+
+class RequestInstrumentationMiddleware:
+    """
+    Record the number and duration of SQL queries, template rendering time and total time of every request.
+    The timings are sent as Server-Timing header (shown in the network tab of the browser developer tools)
+    and logged as one JSON line per request together with the slowest queries and their call sites.
+    Enabled with the setting REQUEST_INSTRUMENTATION.
+    """
+
+    def __init__(self, get_response):
+        if not is_enabled():
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.n_slowest_queries = getattr(
+            settings, "REQUEST_INSTRUMENTATION_SLOWEST_QUERIES", 5
+        )
+        instrument_template_rendering()
+
+    def __call__(self, request):
+        metrics = RequestMetrics()
+        token = _current_metrics.set(metrics)
+        try:
+            with record_queries():
+                response = self.get_response(request)
+        finally:
+            _current_metrics.reset(token)
+
+        total_time = time.perf_counter() - metrics.start
+        response["Server-Timing"] = metrics.server_timing(total_time)
+
+        logger.info(
+            json.dumps(
+                {
+                    "event": "request",
+                    "method": request.method,
+                    "path": request.path,
+                    "status": response.status_code,
+                    "duration_ms": round(total_time * 1000, 1),
+                    "db_queries": len(metrics.queries),
+                    "db_ms": round(metrics.db_time * 1000, 1),
+                    "template_ms": round(metrics.template_time * 1000, 1),
+                    "callbacks": [
+                        {"callback": name, "duration_ms": round(duration * 1000, 1)}
+                        for name, duration in metrics.callbacks
+                    ],
+                    "slowest_queries": [
+                        {
+                            "sql": sql,
+                            "duration_ms": round(duration * 1000, 2),
+                            "call_site": call_site,
+                        }
+                        for sql, duration, call_site in metrics.slowest_queries(
+                            self.n_slowest_queries
+                        )
+                    ],
+                }
+            )
+        )
+        return response
@@ -0,0 +1,80 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from accounting.archive import archive_year, get_closed_years, restore_archive
+from accounting.models import BankAccount, TransactionArchive
+
+
+class Command(BaseCommand):
+    help = (
+        "Move the transactions of closed years into compressed Parquet files per bank account and year, "
+        "keeping their totals and monthly rollups in the database. With --restore the archived transactions "
+        "are moved back into the transaction table."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--before",
+            type=int,
+            default=datetime.date.today().year - 2,
+            help="archive all years before this year (default: the current year minus 2)",
+        )
+        parser.add_argument(
+            "--account",
+            type=int,
+            nargs="*",
+            help="pks of the bank accounts (default: all)",
+        )
+        parser.add_argument(
+            "--restore",
+            action="store_true",
+            help="restore the archived years before --before instead",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="only list the years that would be archived or restored",
+        )
+
+    def handle(self, *args, **options):
+        before = options["before"]
+        if before > datetime.date.today().year:
+            raise CommandError("Only closed years can be archived.")
+
+        accounts = BankAccount.objects.order_by("pk")
+        if options["account"]:
+            accounts = accounts.filter(pk__in=options["account"])
+
+        for account in accounts:
+            if options["restore"]:
+                self._restore(account, before, options["dry_run"])
+            else:
+                self._archive(account, before, options["dry_run"])
+
+    def _archive(self, account, before, dry_run):
+        for year in get_closed_years(account, before):
+            if dry_run:
+                self.stdout.write(f"{account}: would archive {year}")
+                continue
+            archive = archive_year(account, year)
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"{account}: archived {year} ({archive.row_count} transactions, {archive.file.size} bytes)"
+                )
+            )
+
+    def _restore(self, account, before, dry_run):
+        archives = TransactionArchive.objects.filter(
+            bank_account=account, year__lt=before
+        ).order_by("year")
+        for archive in archives:
+            if dry_run:
+                self.stdout.write(f"{account}: would restore {archive.year}")
+                continue
+            n_transactions = restore_archive(archive)
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"{account}: restored {archive.year} ({n_transactions} transactions)"
+                )
+            )
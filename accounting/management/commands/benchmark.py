@@ -0,0 +1,85 @@
+import datetime
+import json
+import os
+import subprocess
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from accounting.benchmarks import run_benchmarks
+
+
+def _get_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=settings.BASE_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the views, chart callbacks, CSV import and category reassignment with the data of a user "
+        "and store the results as JSON. Run it against a database filled by generate_demo_data, "
+        "reassign_categories rewrites the categories of the user's first bank account."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", default="demo1")
+        parser.add_argument("--rounds", type=int, default=5)
+        parser.add_argument(
+            "--only", nargs="*", help="names of the benchmarks to run (default: all)"
+        )
+        parser.add_argument(
+            "--output",
+            help="JSON file for the results (default: benchmarks/<commit>.json)",
+        )
+        parser.add_argument(
+            "--compare", help="JSON file of a previous run to compare the results with"
+        )
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options["user"])
+        except User.DoesNotExist:
+            raise CommandError(
+                f"User {options['user']} does not exist, run generate_demo_data first."
+            )
+
+        commit = _get_commit()
+        results = run_benchmarks(user, options["rounds"], options["only"])
+
+        output = options["output"] or os.path.join(
+            "benchmarks", f"{commit or 'results'}.json"
+        )
+        os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+        with open(output, "w") as f:
+            json.dump(
+                {
+                    "commit": commit,
+                    "created": datetime.datetime.now().isoformat(timespec="seconds"),
+                    "user": user.username,
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+
+        previous = {}
+        if options["compare"]:
+            with open(options["compare"]) as f:
+                previous = json.load(f)["results"]
+
+        for name, result in results.items():
+            line = f"{name:<55} {result['median_ms']:>10.1f} ms {result['queries']:>5} queries"
+            if name in previous:
+                change = result["median_ms"] / previous[name]["median_ms"] - 1
+                line += f" ({change:+.0%})"
+            self.stdout.write(line)
+        self.stdout.write(self.style.SUCCESS(f"Results written to {output}"))
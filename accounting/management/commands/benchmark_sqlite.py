@@ -0,0 +1,195 @@
+import json
+import os
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from accounting.sqlite import apply_pragmas, get_sqlite_pragmas
+
+# queries of the transactions overview and the balance of an account
+READ_QUERIES = [
+    "SELECT id, date_issue, recipient, subject, amount FROM accounting_transaction "
+    "WHERE bank_account_id = ? ORDER BY date_issue DESC LIMIT 50",
+    "SELECT SUM(amount), COUNT(*) FROM accounting_transaction WHERE bank_account_id = ?",
+]
+
+INSERT_QUERY = (
+    "INSERT INTO accounting_transaction (bank_account_id, date_issue, date_booking, recipient, subject, "
+    "full_subject_string, amount) VALUES (?, ?, ?, ?, ?, ?, ?)"
+)
+
+
+def _percentile(values, percent):
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(percent / 100 * len(values)) - 1))
+    return values[index]
+
+
+def _connect(path, pragmas, timeout):
+    db = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+    apply_pragmas(db.cursor(), pragmas)
+    return db
+
+
+def run_scenario(path, pragmas, account_pk, rows, batch_size, readers, timeout=5):
+    """
+    Insert `rows` transactions in batches (one database transaction per batch like the CSV import) while
+    `readers` threads run the read queries of the transactions overview in a loop. Returns the latencies of the
+    reads during the import, the number of failed reads ("database is locked") and the import duration.
+    """
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    done = threading.Event()
+
+    def read():
+        nonlocal errors
+        db = _connect(path, pragmas, timeout)
+        try:
+            while not done.is_set():
+                start = time.perf_counter()
+                try:
+                    for query in READ_QUERIES:
+                        db.execute(query, [account_pk]).fetchall()
+                except sqlite3.OperationalError:
+                    with lock:
+                        errors += 1
+                    continue
+                with lock:
+                    latencies.append((time.perf_counter() - start) * 1000)
+        finally:
+            db.close()
+
+    threads = [threading.Thread(target=read) for _ in range(readers)]
+    for thread in threads:
+        thread.start()
+
+    db = _connect(path, pragmas, timeout)
+    start = time.perf_counter()
+    try:
+        for offset in range(0, rows, batch_size):
+            db.execute("BEGIN IMMEDIATE")
+            db.executemany(
+                INSERT_QUERY,
+                (
+                    (
+                        account_pk,
+                        "2020-01-01",
+                        "2020-01-01",
+                        "Benchmark",
+                        f"Buchung {i}",
+                        f"Benchmark Buchung {i}",
+                        "-1.00",
+                    )
+                    for i in range(offset, min(offset + batch_size, rows))
+                ),
+            )
+            db.execute("COMMIT")
+        import_duration = time.perf_counter() - start
+    finally:
+        done.set()
+        db.close()
+        for thread in threads:
+            thread.join()
+
+    if not latencies:
+        raise CommandError("No read finished during the import, use more rows.")
+
+    return {
+        "pragmas": pragmas,
+        "import_s": round(import_duration, 2),
+        "imported_rows_per_s": round(rows / import_duration),
+        "reads": len(latencies),
+        "read_errors": errors,
+        "read_p50_ms": round(statistics.median(latencies), 2),
+        "read_p95_ms": round(_percentile(latencies, 95), 2),
+        "read_p99_ms": round(_percentile(latencies, 99), 2),
+        "read_max_ms": round(max(latencies), 2),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the latency of the transactions overview queries while a bulk import writes to the database, "
+        "once with the SQLite defaults (rollback journal) and once with SQLITE_PRAGMAS. Works on copies of the "
+        "configured database, which should contain demo data (see generate_demo_data)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=200000, help="imported rows")
+        parser.add_argument(
+            "--batch-size", type=int, default=2000, help="rows per transaction"
+        )
+        parser.add_argument("--readers", type=int, default=4, help="reading threads")
+        parser.add_argument("--json", help="write the results to this JSON file")
+
+    def handle(self, *args, **options):
+        if connections["default"].vendor != "sqlite":
+            raise CommandError("The default database is not an SQLite database.")
+
+        tmp_dir = tempfile.mkdtemp(prefix="benchmark-sqlite-")
+        try:
+            results = {}
+            for name, pragmas in [
+                ("default", {"journal_mode": "DELETE"}),
+                ("tuned", get_sqlite_pragmas()),
+            ]:
+                path = os.path.join(tmp_dir, f"{name}.sqlite3")
+                account_pk = self._copy_database(path)
+                self.stdout.write(f"Running {name} ...")
+                results[name] = run_scenario(
+                    path,
+                    pragmas,
+                    account_pk,
+                    options["rows"],
+                    options["batch_size"],
+                    options["readers"],
+                )
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        self._print_results(results)
+        if options["json"]:
+            with open(options["json"], "w") as f:
+                json.dump(results, f, indent=2)
+
+    def _copy_database(self, path):
+        # the backup API gives a consistent copy even while the app writes to the database
+        source = sqlite3.connect(settings.DATABASES["default"]["NAME"])
+        target = sqlite3.connect(path)
+        try:
+            source.backup(target)
+            target.execute("PRAGMA journal_mode = DELETE")
+            row = target.execute(
+                "SELECT bank_account_id FROM accounting_transaction "
+                "GROUP BY bank_account_id ORDER BY COUNT(*) DESC LIMIT 1"
+            ).fetchone()
+            if row is None:
+                row = target.execute(
+                    "SELECT MIN(id) FROM accounting_bankaccount"
+                ).fetchone()
+            if row is None or row[0] is None:
+                raise CommandError("The database has no bank account.")
+            return row[0]
+        finally:
+            source.close()
+            target.close()
+
+    def _print_results(self, results):
+        self.stdout.write(
+            f"{'':<10}{'import s':>10}{'rows/s':>10}{'reads':>8}{'errors':>8}"
+            f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+        )
+        for name, r in results.items():
+            self.stdout.write(
+                f"{name:<10}{r['import_s']:>10.2f}{r['imported_rows_per_s']:>10}{r['reads']:>8}"
+                f"{r['read_errors']:>8}{r['read_p50_ms']:>10.2f}{r['read_p95_ms']:>10.2f}"
+                f"{r['read_p99_ms']:>10.2f}{r['read_max_ms']:>10.2f}"
+            )
@@ -0,0 +1,64 @@
+import os
+
+from django.core.management.base import BaseCommand
+
+from accounting.demo_data import BANKS, generate_csv_export, generate_demo_data
+
+
+class Command(BaseCommand):
+    help = (
+        "Create demo users (demo1, demo2, ...) with bank accounts, categories, contracts, depots and years "
+        "of transactions, and optionally synthetic CSV exports for every supported bank."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1)
+        parser.add_argument("--accounts", type=int, default=2, help="per user")
+        parser.add_argument("--contracts", type=int, default=5, help="per user")
+        parser.add_argument("--depots", type=int, default=1, help="per user")
+        parser.add_argument("--assets", type=int, default=3, help="per depot")
+        parser.add_argument("--years", type=int, default=5)
+        parser.add_argument(
+            "--transactions-per-month",
+            type=int,
+            default=60,
+            help="irregular transactions per account and month (recurring payments are added)",
+        )
+        parser.add_argument("--password", default="demo")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--csv-dir",
+            help="write a synthetic CSV export of the last 12 months per bank to this directory",
+        )
+
+    def handle(self, *args, **options):
+        n_transactions = generate_demo_data(
+            n_users=options["users"],
+            n_accounts=options["accounts"],
+            n_contracts=options["contracts"],
+            n_depots=options["depots"],
+            n_assets=options["assets"],
+            years=options["years"],
+            random_per_month=options["transactions_per_month"],
+            password=options["password"],
+            seed=options["seed"],
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Created {options['users']} demo users with {n_transactions} transactions."
+            )
+        )
+
+        if options["csv_dir"]:
+            os.makedirs(options["csv_dir"], exist_ok=True)
+            for bank in BANKS:
+                path = os.path.join(options["csv_dir"], f"{bank}.csv")
+                with open(path, "wb") as f:
+                    f.write(
+                        generate_csv_export(
+                            bank,
+                            random_per_month=options["transactions_per_month"],
+                            seed=options["seed"],
+                        )
+                    )
+                self.stdout.write(f"Wrote {path}")
@@ -0,0 +1,398 @@
+import http.cookiejar
+import json
+import os
+import random
+import re
+import shutil
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from accounting.demo_data import generate_csv_export
+
+# settings of the app under test: the project settings with a separate database
+SETTINGS_TEMPLATE = """
+from {base_settings} import *  # noqa
+
+DEBUG = False
+ALLOWED_HOSTS = ["127.0.0.1", "localhost"]
+DATABASES = {{"default": {{**DATABASES["default"], "NAME": {database!r}}}}}
+MEDIA_ROOT = {media_root!r}
+"""
+
+# weighted mix of requests a simulated user sends: (name, weight)
+SCENARIOS = [
+    ("accounts_overview", 3),
+    ("transactions", 2),
+    ("transactions_filtered", 2),
+    ("chart_filter_callback", 2),
+    ("chart_net_worth_callback", 1),
+    ("csv_upload", 1),
+]
+
+DASH_UPDATE_URL = "/dash-charts/app/Charts/_dash-update-component"
+
+
+def _percentile(values, percent):
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(percent / 100 * len(values)) - 1))
+    return values[index]
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class SimulatedUser:
+    """
+    A logged in user with its own cookies that sends requests of the scenario mix.
+    """
+
+    def __init__(self, base_url, username, password, account_pk, csv_export):
+        self.base_url = base_url
+        self.account_pk = account_pk
+        self.csv_export = csv_export
+        self.cookies = http.cookiejar.CookieJar()
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(self.cookies)
+        )
+        self.login(username, password)
+
+    def _cookie(self, name):
+        for cookie in self.cookies:
+            if cookie.name == name:
+                return cookie.value
+        return ""
+
+    def _csrf_token(self):
+        return self._cookie("csrftoken")
+
+    def _request(self, path, data=None, headers=None):
+        request = urllib.request.Request(
+            self.base_url + path, data=data, headers=headers or {}
+        )
+        with self.opener.open(request, timeout=60) as response:
+            response.read()
+            return response.status
+
+    def _post(self, path, data, content_type):
+        return self._request(
+            path,
+            data=data,
+            headers={
+                "Content-Type": content_type,
+                "X-CSRFToken": self._csrf_token(),
+                "Referer": self.base_url + path,
+            },
+        )
+
+    def login(self, username, password):
+        with self.opener.open(self.base_url + "/login/", timeout=60) as response:
+            page = response.read().decode()
+        token = re.search(r'name="csrfmiddlewaretoken" value="([^"]+)"', page).group(1)
+        self._post(
+            "/login/",
+            urllib.parse.urlencode(
+                {
+                    "username": username,
+                    "password": password,
+                    "csrfmiddlewaretoken": token,
+                }
+            ).encode(),
+            "application/x-www-form-urlencoded",
+        )
+        if not self._cookie(settings.SESSION_COOKIE_NAME):
+            raise CommandError(f"Login of {username} failed.")
+
+    def _dash_callback(self, output, inputs, state=()):
+        payload = {
+            "output": output,
+            "outputs": {
+                "id": output.rsplit(".", 1)[0],
+                "property": output.rsplit(".", 1)[1],
+            },
+            "inputs": [{"id": i, "property": p, "value": v} for i, p, v in inputs],
+            "state": [{"id": i, "property": p, "value": v} for i, p, v in state],
+            "changedPropIds": [],
+        }
+        return self._post(
+            DASH_UPDATE_URL, json.dumps(payload).encode(), "application/json"
+        )
+
+    def accounts_overview(self):
+        return self._request("/")
+
+    def transactions(self):
+        return self._request(f"/konto/{self.account_pk}/?page={random.randint(1, 5)}")
+
+    def transactions_filtered(self):
+        query = urllib.parse.urlencode(
+            {
+                "q": random.choice(["einkauf", "miete", "rewe"]),
+                "amount_min": 10,
+                "amount_max": 100,
+            }
+        )
+        return self._request(f"/konto/{self.account_pk}/?{query}")
+
+    def chart_filter_callback(self):
+        return self._dash_callback(
+            "filtered-transactions.data",
+            inputs=[
+                ("account", "value", self.account_pk),
+                ("filter", "n_clicks", random.randint(1, 1000)),
+            ],
+            state=[
+                ("date-start", "value", None),
+                ("date-end", "value", None),
+                ("amount-min", "value", None),
+                ("amount-max", "value", None),
+                ("categories", "value", None),
+                ("transaction-type", "value", None),
+            ],
+        )
+
+    def chart_net_worth_callback(self):
+        return self._dash_callback(
+            "net-worth-chart.figure", inputs=[("_dummy", "children", None)]
+        )
+
+    def csv_upload(self):
+        # the upload is parsed and shown for review, nothing is saved
+        boundary = uuid.uuid4().hex
+        body = (
+            (
+                f"--{boundary}\r\n"
+                'Content-Disposition: form-data; name="csrfmiddlewaretoken"\r\n\r\n'
+                f"{self._csrf_token()}\r\n"
+                f"--{boundary}\r\n"
+                'Content-Disposition: form-data; name="file"; filename="export.csv"\r\n'
+                "Content-Type: text/csv\r\n\r\n"
+            ).encode()
+            + self.csv_export
+            + f"\r\n--{boundary}--\r\n".encode()
+        )
+        return self._post(
+            f"/konto/{self.account_pk}/upload",
+            body,
+            f"multipart/form-data; boundary={boundary}",
+        )
+
+
+class Command(BaseCommand):
+    help = (
+        "Start the app with gunicorn on a freshly generated demo database, log in simulated users and send a "
+        "weighted mix of page views, chart callbacks and CSV uploads with the given concurrency. Reports "
+        "throughput, latency percentiles and error rates per endpoint. Runs locally without network access."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=2, help="gunicorn workers")
+        parser.add_argument(
+            "--threads", type=int, default=1, help="gunicorn threads per worker"
+        )
+        parser.add_argument(
+            "--concurrency", type=int, default=8, help="simultaneous simulated users"
+        )
+        parser.add_argument("--duration", type=int, default=30, help="seconds")
+        parser.add_argument("--users", type=int, default=4, help="demo users")
+        parser.add_argument(
+            "--years", type=int, default=3, help="years of demo transactions"
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--json", help="write the report to this JSON file")
+
+    def handle(self, *args, **options):
+        tmp_dir = tempfile.mkdtemp(prefix="loadtest-")
+        server = None
+        try:
+            env = self._prepare_environment(tmp_dir)
+            self._generate_data(env, options)
+
+            port = _free_port()
+            server = self._start_server(env, port, options)
+            report = self._run(f"http://127.0.0.1:{port}", tmp_dir, options)
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait(timeout=30)
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        self._print_report(report)
+        if options["json"]:
+            with open(options["json"], "w") as f:
+                json.dump(report, f, indent=2)
+
+    def _prepare_environment(self, tmp_dir):
+        with open(os.path.join(tmp_dir, "loadtest_settings.py"), "w") as f:
+            f.write(
+                SETTINGS_TEMPLATE.format(
+                    base_settings=os.environ["DJANGO_SETTINGS_MODULE"],
+                    database=os.path.join(tmp_dir, "db.sqlite3"),
+                    media_root=os.path.join(tmp_dir, "media"),
+                )
+            )
+
+        env = dict(os.environ)
+        env["DJANGO_SETTINGS_MODULE"] = "loadtest_settings"
+        env["PYTHONPATH"] = os.pathsep.join(
+            [tmp_dir, str(settings.BASE_DIR), env.get("PYTHONPATH", "")]
+        )
+        env.pop("PROMETHEUS_MULTIPROC_DIR", None)
+        return env
+
+    def _manage(self, env, *args):
+        subprocess.run(
+            [sys.executable, "manage.py", *args],
+            cwd=settings.BASE_DIR,
+            env=env,
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+
+    def _generate_data(self, env, options):
+        self.stdout.write("Creating the database and demo data ...")
+        self._manage(env, "migrate")
+        self._manage(
+            env,
+            "generate_demo_data",
+            "--users",
+            str(options["users"]),
+            "--years",
+            str(options["years"]),
+            "--seed",
+            str(options["seed"]),
+        )
+
+    def _start_server(self, env, port, options):
+        server = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "gunicorn",
+                "finances.wsgi:application",
+                "--bind",
+                f"127.0.0.1:{port}",
+                "--workers",
+                str(options["workers"]),
+                "--threads",
+                str(options["threads"]),
+                "--log-level",
+                "warning",
+            ],
+            cwd=settings.BASE_DIR,
+            env=env,
+        )
+
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                return server
+            except OSError:
+                time.sleep(0.2)
+        server.terminate()
+        raise CommandError("gunicorn did not start within 30 seconds.")
+
+    def _get_accounts(self, tmp_dir):
+        with sqlite3.connect(os.path.join(tmp_dir, "db.sqlite3")) as db:
+            return db.execute(
+                "SELECT u.username, MIN(a.id), a.bank FROM auth_user u "
+                "JOIN accounting_bankaccount a ON a.owner_id = u.id "
+                "WHERE u.username LIKE 'demo%' GROUP BY u.id"
+            ).fetchall()
+
+    def _run(self, base_url, tmp_dir, options):
+        accounts = self._get_accounts(tmp_dir)
+        exports = {bank: generate_csv_export(bank, months=1) for _, _, bank in accounts}
+        users = [
+            SimulatedUser(base_url, username, "demo", account_pk, exports[bank])
+            for username, account_pk, bank in accounts
+        ]
+
+        names, weights = zip(*SCENARIOS)
+        latencies = defaultdict(list)
+        errors = defaultdict(int)
+        lock = threading.Lock()
+        stop_at = time.monotonic() + options["duration"]
+
+        def simulate(i):
+            user = users[i % len(users)]
+            rng = random.Random(options["seed"] + i)
+            while time.monotonic() < stop_at:
+                name = rng.choices(names, weights)[0]
+                start = time.perf_counter()
+                try:
+                    ok = getattr(user, name)() < 400
+                except (urllib.error.URLError, OSError):
+                    ok = False
+                latency = (time.perf_counter() - start) * 1000
+                with lock:
+                    latencies[name].append(latency)
+                    if not ok:
+                        errors[name] += 1
+
+        self.stdout.write(
+            f"Running {options['concurrency']} simulated users for {options['duration']} s ..."
+        )
+        threads = [
+            threading.Thread(target=simulate, args=(i,))
+            for i in range(options["concurrency"])
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        report = {
+            "workers": options["workers"],
+            "threads": options["threads"],
+            "concurrency": options["concurrency"],
+            "duration_s": options["duration"],
+            "endpoints": {},
+        }
+        for name in names:
+            values = latencies.get(name)
+            if not values:
+                continue
+            report["endpoints"][name] = {
+                "requests": len(values),
+                "throughput_rps": round(len(values) / options["duration"], 2),
+                "error_rate": round(errors[name] / len(values), 4),
+                "p50_ms": round(statistics.median(values), 1),
+                "p95_ms": round(_percentile(values, 95), 1),
+                "p99_ms": round(_percentile(values, 99), 1),
+            }
+        return report
+
+    def _print_report(self, report):
+        self.stdout.write(
+            f"{'endpoint':<28}{'requests':>10}{'req/s':>9}{'errors':>9}"
+            f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+        )
+        for name, r in report["endpoints"].items():
+            self.stdout.write(
+                f"{name:<28}{r['requests']:>10}{r['throughput_rps']:>9.1f}"
+                f"{r['error_rate']:>9.1%}{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}{r['p99_ms']:>10.1f}"
+            )
+        total = sum(r["requests"] for r in report["endpoints"].values())
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{total} requests, {total / report['duration_s']:.1f} req/s in total"
+            )
+        )
@@ -0,0 +1,60 @@
+import os
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+# The metrics are collected in-process. With several gunicorn workers the environment variable
+# PROMETHEUS_MULTIPROC_DIR has to point to a directory shared by all workers (see gunicorn.conf.py),
+# every worker then writes its samples to this directory and /metrics aggregates them.
+
+CSV_ROWS = Counter(
+    "accounting_csv_rows_total",
+    "Rows of uploaded bank CSV exports by bank parser and processing stage.",
+    ["bank", "stage"],
+)
+CSV_PARSE_SECONDS = Histogram(
+    "accounting_csv_parse_seconds",
+    "Time to parse and categorise an uploaded bank CSV export.",
+    ["bank"],
+)
+RECATEGORISATION_SECONDS = Histogram(
+    "accounting_recategorisation_seconds",
+    "Time to reassign the categories of all transactions of a bank account.",
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120),
+)
+CHART_CALLBACK_SECONDS = Histogram(
+    "accounting_chart_callback_seconds",
+    "Latency of the chart callbacks by output id.",
+    ["output"],
+)
+BALANCE_SECONDS = Histogram(
+    "accounting_balance_seconds",
+    "Time to compute balance histories.",
+    ["kind"],
+)
+
+
+def timed(histogram, **labels):
+    """
+    Decorator recording the duration of every call of the function in the histogram with the given labels.
+    """
+    return histogram.labels(**labels).time()
+
+
+def generate_metrics():
+    """
+    The metrics of this process (or of all worker processes in multiprocess mode) in the Prometheus text format.
+    Returns the content and its content type.
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+
+    return generate_latest(), CONTENT_TYPE_LATEST
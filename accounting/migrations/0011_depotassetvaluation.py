@@ -0,0 +1,75 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:08
+
+import datetime
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def create_initial_valuations(apps, schema_editor):
+    # the current balance of every existing asset becomes its first valuation snapshot
+    DepotAsset = apps.get_model("accounting", "DepotAsset")
+    DepotAssetValuation = apps.get_model("accounting", "DepotAssetValuation")
+    DepotAssetValuation.objects.bulk_create(
+        [
+            DepotAssetValuation(
+                asset=asset, value=asset.current_balance, date=asset.last_update
+            )
+            for asset in DepotAsset.objects.all()
+        ]
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("accounting", "0010_auto_20241121_1449"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="depotasset",
+            name="last_update",
+            field=models.DateField(
+                default=datetime.date.today, verbose_name="Letztes Update"
+            ),
+        ),
+        migrations.CreateModel(
+            name="DepotAssetValuation",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "value",
+                    models.DecimalField(
+                        decimal_places=2, max_digits=10, verbose_name="Wert"
+                    ),
+                ),
+                ("date", models.DateField(verbose_name="Datum")),
+                (
+                    "asset",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="valuations",
+                        to="accounting.depotasset",
+                        verbose_name="Anlage",
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("asset", "date"),
+                        name="unique_valuation_per_asset_and_day",
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(create_initial_valuations, migrations.RunPython.noop),
+    ]
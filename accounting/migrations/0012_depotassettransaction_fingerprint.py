@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("accounting", "0011_depotassetvaluation"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="depotassettransaction",
+            name="fingerprint",
+            field=models.CharField(
+                blank=True,
+                db_index=True,
+                default="",
+                max_length=40,
+                verbose_name="Fingerprint",
+            ),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:15
+
+from django.db import migrations, models
+
+import accounting.storage
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("accounting", "0012_depotassettransaction_fingerprint"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="contractfile",
+            name="file",
+            field=models.FileField(
+                storage=accounting.storage.get_contract_file_storage,
+                upload_to="contract_files",
+                verbose_name="Datei",
+            ),
+        ),
+    ]
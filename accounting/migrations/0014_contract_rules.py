@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("accounting", "0013_contractfile_storage"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="contract",
+            name="amount_max",
+            field=models.DecimalField(
+                blank=True,
+                decimal_places=2,
+                max_digits=10,
+                null=True,
+                verbose_name="Höchstbetrag",
+            ),
+        ),
+        migrations.AddField(
+            model_name="contract",
+            name="amount_min",
+            field=models.DecimalField(
+                blank=True,
+                decimal_places=2,
+                max_digits=10,
+                null=True,
+                verbose_name="Mindestbetrag",
+            ),
+        ),
+        migrations.AddField(
+            model_name="contract",
+            name="recipient_patterns",
+            field=models.TextField(
+                blank=True,
+                default="",
+                verbose_name="Empfänger-Patterns (new line separated)",
+            ),
+        ),
+        migrations.AddField(
+            model_name="contract",
+            name="subject_patterns",
+            field=models.TextField(
+                blank=True,
+                default="",
+                verbose_name="Betreff-Patterns (new line separated)",
+            ),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("accounting", "0014_contract_rules"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="transaction",
+            index=models.Index(
+                fields=["bank_account", "-date_issue", "-id"],
+                name="transaction_account_date_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,78 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("accounting", "0016_dataversion"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TransactionArchive",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("year", models.PositiveSmallIntegerField(verbose_name="Jahr")),
+                (
+                    "file",
+                    models.FileField(
+                        upload_to="transaction_archives", verbose_name="Datei"
+                    ),
+                ),
+                ("checksum", models.CharField(max_length=64, verbose_name="SHA-256")),
+                (
+                    "row_count",
+                    models.PositiveIntegerField(verbose_name="Anzahl Transaktionen"),
+                ),
+                (
+                    "total_amount",
+                    models.DecimalField(
+                        decimal_places=2, max_digits=12, verbose_name="Summe"
+                    ),
+                ),
+                (
+                    "income",
+                    models.DecimalField(
+                        decimal_places=2, max_digits=12, verbose_name="Einnahmen"
+                    ),
+                ),
+                (
+                    "expenses",
+                    models.DecimalField(
+                        decimal_places=2, max_digits=12, verbose_name="Ausgaben"
+                    ),
+                ),
+                (
+                    "monthly_rollups",
+                    models.JSONField(default=dict, verbose_name="Monatssummen"),
+                ),
+                ("created", models.DateTimeField(auto_now_add=True)),
+                (
+                    "bank_account",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="archives",
+                        to="accounting.bankaccount",
+                        verbose_name="Bank",
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("bank_account", "year"), name="unique_archive_per_year"
+                    )
+                ],
+            },
+        ),
+    ]
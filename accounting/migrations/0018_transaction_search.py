@@ -0,0 +1,73 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:41
+
+from django.db import migrations, models
+
+# full-text index of recipient and subject, kept up to date by triggers. The trigram tokenizer matches any
+# substring of at least three characters, like the LIKE search it replaces.
+CREATE_SEARCH_INDEX = [
+    """
+    CREATE VIRTUAL TABLE accounting_transaction_search USING fts5(
+        recipient, subject,
+        content='accounting_transaction', content_rowid='id', tokenize='trigram'
+    )
+    """,
+    """
+    CREATE TRIGGER accounting_transaction_search_insert AFTER INSERT ON accounting_transaction BEGIN
+        INSERT INTO accounting_transaction_search(rowid, recipient, subject)
+        VALUES (new.id, new.recipient, new.subject);
+    END
+    """,
+    """
+    CREATE TRIGGER accounting_transaction_search_delete AFTER DELETE ON accounting_transaction BEGIN
+        INSERT INTO accounting_transaction_search(accounting_transaction_search, rowid, recipient, subject)
+        VALUES ('delete', old.id, old.recipient, old.subject);
+    END
+    """,
+    """
+    CREATE TRIGGER accounting_transaction_search_update AFTER UPDATE OF recipient, subject
+    ON accounting_transaction BEGIN
+        INSERT INTO accounting_transaction_search(accounting_transaction_search, rowid, recipient, subject)
+        VALUES ('delete', old.id, old.recipient, old.subject);
+        INSERT INTO accounting_transaction_search(rowid, recipient, subject)
+        VALUES (new.id, new.recipient, new.subject);
+    END
+    """,
+    "INSERT INTO accounting_transaction_search(accounting_transaction_search) VALUES ('rebuild')",
+]
+
+DROP_SEARCH_INDEX = [
+    "DROP TRIGGER IF EXISTS accounting_transaction_search_insert",
+    "DROP TRIGGER IF EXISTS accounting_transaction_search_delete",
+    "DROP TRIGGER IF EXISTS accounting_transaction_search_update",
+    "DROP TABLE IF EXISTS accounting_transaction_search",
+]
+
+
+def _execute_on_sqlite(statements):
+    # other database backends search with LIKE
+    def execute(apps, schema_editor):
+        if schema_editor.connection.vendor != "sqlite":
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+
+    return execute
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("accounting", "0017_transactionarchive"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="transaction",
+            index=models.Index(
+                fields=["-date_issue", "-id"], name="transaction_date_idx"
+            ),
+        ),
+        migrations.RunPython(
+            _execute_on_sqlite(CREATE_SEARCH_INDEX),
+            _execute_on_sqlite(DROP_SEARCH_INDEX),
+        ),
+    ]
@@ -1,10 +1,39 @@
 import datetime
+from decimal import Decimal
 from enum import Enum
 
 from django.contrib.auth.models import User
 from django.core.exceptions import PermissionDenied
 from django.db import models
-from django.db.models import F, Func, Q
+from django.db.models import (
+    Count,
+    F,
+    Func,
+    Max,
+    Min,
+    OuterRef,
+    Q,
+    Subquery,
+    Sum,
+    Window,
+)
+from django.db.models.functions import Trunc
+from django.db.transaction import atomic, on_commit
+from django.urls import reverse
+from django.utils import timezone
+
+from .metrics import BALANCE_SECONDS, RECATEGORISATION_SECONDS, timed
+from .storage import get_contract_file_storage
+
+
+class WindowSum(Func):
+    # SUM(...) OVER (...) of an aggregated expression, django's Sum does not allow wrapping other aggregates
+    function = "SUM"
+    window_compatible = True
+
+
+# category name of transactions without category in aggregates
+UNCATEGORIZED = "ohne Kategorie"
 
 
 class TransactionType(Enum):
@@ -39,8 +68,8 @@ class BankDepot(models.Model):
     def get_assets(self):
         return self.belongs_to.all()
 
-    def get_balance(self):
-        return sum([a.current_balance for a in self.belongs_to.all()])
+    def get_balance(self, date=None):
+        return get_depot_balances([self], date).get(self.pk, 0)
 
     def get_last_update(self):
         assets = self.get_assets().order_by("-last_update")
@@ -63,12 +92,19 @@ class DepotAsset(models.Model):
         decimal_places=2, max_digits=10, verbose_name="Aktueller Wert"
     )
     last_update = models.DateField(
-        verbose_name="Letztes Update", default=datetime.date.today()
+        verbose_name="Letztes Update", default=datetime.date.today
     )
 
     def __str__(self):
         return f"{self.name} ({self.bank_depot.name})"
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # every update of the current balance is kept as valuation snapshot (one per asset and day)
+        DepotAssetValuation.objects.update_or_create(
+            asset=self, date=self.last_update, defaults={"value": self.current_balance}
+        )
+
     def identifier(self):
         return self.name.replace(" ", "")
 
@@ -86,6 +122,14 @@ class DepotAssetTransaction(models.Model):
     )
     amount = models.DecimalField(decimal_places=2, max_digits=10, verbose_name="Betrag")
     date_issue = models.DateField(verbose_name="Buchungstag")
+    # identifies imported transactions, so importing the same export twice does not duplicate them
+    fingerprint = models.CharField(
+        max_length=40,
+        blank=True,
+        default="",
+        db_index=True,
+        verbose_name="Fingerprint",
+    )
 
     def __str__(self):
         if self.amount <= 0:
@@ -96,6 +140,28 @@ class DepotAssetTransaction(models.Model):
         return f"{event}: {self.amount} ({self.date_issue})"
 
 
+class DepotAssetValuation(models.Model):
+    asset = models.ForeignKey(
+        DepotAsset,
+        on_delete=models.CASCADE,
+        verbose_name="Anlage",
+        related_name="valuations",
+    )
+    value = models.DecimalField(decimal_places=2, max_digits=10, verbose_name="Wert")
+    date = models.DateField(verbose_name="Datum")
+
+    class Meta:
+        # the (asset, date) index serves the "latest valuation <= date" lookups
+        constraints = [
+            models.UniqueConstraint(
+                fields=["asset", "date"], name="unique_valuation_per_asset_and_day"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.asset.name}: {self.value} ({self.date})"
+
+
 class BankAccount(models.Model):
     owner = models.ForeignKey(
         User, on_delete=models.CASCADE, verbose_name="Kontobesitzer"
@@ -110,32 +176,38 @@ class BankAccount(models.Model):
         return f"{self.name} ({self.bank})"
 
     def get_oldest_transaction_date(self):
-        transactions = self.belongs_to.all().order_by("date_issue")
-
-        if len(transactions) > 0:
-            return transactions[0].date_issue
-
-        return datetime.date.today()
+        # only the first row is fetched instead of evaluating all transactions of the account
+        date_issue = (
+            self.belongs_to.order_by("date_issue")
+            .values_list("date_issue", flat=True)
+            .first()
+        )
+        oldest_archive = self.archives.order_by("year").first()
+        if oldest_archive is not None:
+            # archived transactions are resolved by month
+            archive_start = min(oldest_archive.get_monthly_totals())
+            date_issue = min(date_issue, archive_start) if date_issue else archive_start
+        return date_issue or datetime.date.today()
 
     def get_newest_transaction_date(self):
-        transactions = self.belongs_to.all().order_by("-date_issue")
-
-        if len(transactions) > 0:
-            return transactions[0].date_issue
-
-        return datetime.date.today()
+        date_issue = (
+            self.belongs_to.order_by("-date_issue")
+            .values_list("date_issue", flat=True)
+            .first()
+        )
+        return date_issue or datetime.date.today()
 
     def get_max_transaction_amount(self):
         transactions = self.belongs_to.all()
         transactions = transactions.annotate(
             absolute_amount=Func(F("amount"), function="ABS")
         )
-        transactions = transactions.order_by("absolute_amount")
-
-        if len(transactions) > 0:
-            return transactions.last().amount
-
-        return 0.0
+        amount = (
+            transactions.order_by("-absolute_amount")
+            .values_list("amount", flat=True)
+            .first()
+        )
+        return amount if amount is not None else 0.0
 
     def get_transactions(
         self,
@@ -204,7 +276,66 @@ class BankAccount(models.Model):
     def get_balance(self):
         transactions = self.belongs_to.all()
         all_transactions = [t.amount for t in transactions]
-        return self.current_amount + sum(all_transactions)
+        return (
+            self.current_amount
+            + sum(all_transactions)
+            + get_archived_amount(self.archives.all())
+        )
+
+    def get_archived_years(self):
+        return set(self.archives.values_list("year", flat=True))
+
+    def get_balance_history(self, kind="month", date_start=None, date_end=None):
+        """
+        Balance at the end of each period (kind: day, week, month, quarter or year) with transactions.
+        The running balance is computed in the database as a window sum over the per-period totals,
+        so the number of returned rows only depends on the number of periods.
+        """
+        transactions = self.belongs_to.all()
+        archives = list(self.archives.all())
+        start_balance = self.current_amount
+
+        if date_start:
+            balance_before = transactions.filter(date_issue__lt=date_start).aggregate(
+                total=Sum("amount")
+            )["total"]
+            start_balance += balance_before or 0
+            start_balance += get_archived_amount(
+                archives, date_start - datetime.timedelta(days=1)
+            )
+            transactions = transactions.filter(date_issue__gte=date_start)
+        else:
+            start_balance += get_archived_amount(archives)
+
+        if date_end:
+            transactions = transactions.filter(date_issue__lte=date_end)
+
+        archived_totals = {}
+        if date_start:
+            archived_totals = get_archived_period_totals(
+                archives, kind, date_start, date_end
+            )
+        if not archived_totals:
+            return get_running_balances(transactions, start_balance, kind)
+
+        # archived years within the range: merge their monthly rollups with the live periods
+        totals = (
+            transactions.annotate(period=Trunc("date_issue", kind))
+            .values("period")
+            .annotate(total=Sum("amount"))
+            .order_by("period")
+        )
+        for t in totals:
+            archived_totals[t["period"]] = archived_totals.get(
+                t["period"], Decimal(0)
+            ) + Decimal(t["total"])
+
+        balances = []
+        balance = start_balance
+        for period in sorted(archived_totals):
+            balance += archived_totals[period]
+            balances.append((period, balance))
+        return balances
 
 
 class Contract(models.Model):
@@ -216,23 +347,57 @@ class Contract(models.Model):
     is_active = models.BooleanField(verbose_name="aktiv", default=True)
     start_date = models.DateField(verbose_name="Startdatum", blank=True, null=True)
     end_date = models.DateField(verbose_name="Enddatum", blank=True, null=True)
+    # rules to link transactions automatically: a recipient or subject pattern has to match and the
+    # amount has to be within the (optional) range
+    recipient_patterns = models.TextField(
+        verbose_name="Empfänger-Patterns (new line separated)", blank=True, default=""
+    )
+    subject_patterns = models.TextField(
+        verbose_name="Betreff-Patterns (new line separated)", blank=True, default=""
+    )
+    amount_min = models.DecimalField(
+        decimal_places=2,
+        max_digits=10,
+        verbose_name="Mindestbetrag",
+        blank=True,
+        null=True,
+    )
+    amount_max = models.DecimalField(
+        decimal_places=2,
+        max_digits=10,
+        verbose_name="Höchstbetrag",
+        blank=True,
+        null=True,
+    )
 
     def __str__(self):
         return self.name
 
+    def get_recipient_patterns(self):
+        return [p.strip() for p in self.recipient_patterns.split("\n") if p.strip()]
+
+    def get_subject_patterns(self):
+        return [p.strip() for p in self.subject_patterns.split("\n") if p.strip()]
+
+    def has_rules(self):
+        return bool(self.get_recipient_patterns() or self.get_subject_patterns())
+
     def get_transactions(self):
         return self.contract.all().order_by("-date_issue")
 
     def get_balance(self):
-        transactions = self.get_transactions()
-        return sum([t.amount for t in transactions])
+        return self.contract.aggregate(balance=Sum("amount"))["balance"] or 0
 
     def get_files(self):
         return self.file_of.all().order_by("filename")
 
 
 class ContractFile(models.Model):
-    file = models.FileField(upload_to="contract_files", verbose_name="Datei")
+    file = models.FileField(
+        upload_to="contract_files",
+        storage=get_contract_file_storage,
+        verbose_name="Datei",
+    )
     filename = models.CharField(max_length=255, verbose_name="Dateiname")
     contract = models.ForeignKey(
         Contract,
@@ -245,7 +410,23 @@ class ContractFile(models.Model):
         return self.filename
 
     def get_url(self):
-        return self.file.url
+        return reverse("contract-file", args=[self.pk])
+
+
+def delete_unreferenced_contract_file(sender, instance, **kwargs):
+    """
+    Delete the stored file of a deleted ContractFile (connected to the post_delete signal) once the deletion is
+    committed, unless another ContractFile with the same content still references it.
+    """
+    name = instance.file.name
+    if not name:
+        return
+
+    def delete():
+        if not ContractFile.objects.filter(file=name).exists():
+            instance.file.storage.delete(name)
+
+    on_commit(delete)
 
 
 class Transaction(models.Model):
@@ -280,6 +461,17 @@ class Transaction(models.Model):
     )
     full_subject_string = models.TextField(verbose_name="gesamte Buchungsreferenz")
 
+    class Meta:
+        indexes = [
+            # transactions of an account by date, used for the cursor pagination of the API
+            models.Index(
+                fields=["bank_account", "-date_issue", "-id"],
+                name="transaction_account_date_idx",
+            ),
+            # transactions of all accounts by date, used for the cursor pagination of the search
+            models.Index(fields=["-date_issue", "-id"], name="transaction_date_idx"),
+        ]
+
     def __str__(self):
         if self.amount <= 0:
             event = "Ausgabe"
@@ -289,6 +481,141 @@ class Transaction(models.Model):
         return f"{event}: {self.amount} ({self.recipient})"
 
 
+class TransactionArchive(models.Model):
+    """
+    Transactions of a closed year of a bank account moved out of the transaction table into a compressed Parquet
+    file (see accounting/archive.py). The totals and monthly rollups keep balances and aggregates computable
+    without reading the file.
+    """
+
+    bank_account = models.ForeignKey(
+        BankAccount,
+        on_delete=models.CASCADE,
+        verbose_name="Bank",
+        related_name="archives",
+    )
+    year = models.PositiveSmallIntegerField(verbose_name="Jahr")
+    file = models.FileField(upload_to="transaction_archives", verbose_name="Datei")
+    checksum = models.CharField(max_length=64, verbose_name="SHA-256")
+    row_count = models.PositiveIntegerField(verbose_name="Anzahl Transaktionen")
+    total_amount = models.DecimalField(
+        decimal_places=2, max_digits=12, verbose_name="Summe"
+    )
+    income = models.DecimalField(
+        decimal_places=2, max_digits=12, verbose_name="Einnahmen"
+    )
+    expenses = models.DecimalField(
+        decimal_places=2, max_digits=12, verbose_name="Ausgaben"
+    )
+    # income, expenses and number of transactions per month and category:
+    # {"2020-01": {"Lebensmittel": {"income": "0.00", "expenses": "-123.45", "count": 12}, ...}, ...}
+    monthly_rollups = models.JSONField(default=dict, verbose_name="Monatssummen")
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["bank_account", "year"], name="unique_archive_per_year"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.bank_account} {self.year} ({self.row_count} Transaktionen)"
+
+    def get_monthly_totals(self):
+        """
+        Sum of the amounts per month as dict month start date -> amount.
+        """
+        return {
+            datetime.date.fromisoformat(f"{month}-01"): sum(
+                (
+                    Decimal(rollup["income"]) + Decimal(rollup["expenses"])
+                    for rollup in categories.values()
+                ),
+                Decimal(0),
+            )
+            for month, categories in self.monthly_rollups.items()
+        }
+
+
+def get_archived_amount(archives, date=None):
+    """
+    Sum of the archived transactions up to the given date (default: all). Archived years are resolved by month,
+    months starting on or before the date count completely.
+    """
+    total = Decimal(0)
+    for archive in archives:
+        if date is None or archive.year < date.year:
+            total += archive.total_amount
+        elif archive.year == date.year:
+            total += sum(
+                (
+                    amount
+                    for month, amount in archive.get_monthly_totals().items()
+                    if month <= date
+                ),
+                Decimal(0),
+            )
+    return total
+
+
+def _truncate_month(month, kind):
+    # period of the given kind an archived month is assigned to, archived days and weeks fall on the month start
+    if kind == "year":
+        return month.replace(month=1)
+    if kind == "quarter":
+        return month.replace(month=3 * ((month.month - 1) // 3) + 1)
+    if kind == "week":
+        return month - datetime.timedelta(days=month.weekday())
+    return month
+
+
+def get_archived_period_totals(archives, kind, date_start=None, date_end=None):
+    """
+    Sum of the archived transactions per period (kind: day, week, month, quarter or year) within the date range,
+    computed from the monthly rollups of the archives.
+    """
+    totals = {}
+    for archive in archives:
+        for month, amount in archive.get_monthly_totals().items():
+            if (date_start and month < date_start) or (date_end and month > date_end):
+                continue
+            period = _truncate_month(month, kind)
+            totals[period] = totals.get(period, Decimal(0)) + amount
+    return totals
+
+
+class DataVersion(models.Model):
+    """
+    Version of the data (bank accounts, depots, contracts and their transactions) owned by a user, increased on
+    every change. Used to answer conditional requests of the pages showing this data without computing them.
+    """
+
+    owner = models.OneToOneField(
+        User, on_delete=models.CASCADE, related_name="data_version"
+    )
+    version = models.PositiveBigIntegerField(default=0)
+    modified = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.owner}: {self.version}"
+
+
+def get_data_version(owner_id):
+    data_version, _ = DataVersion.objects.get_or_create(owner_id=owner_id)
+    return data_version
+
+
+def bump_data_versions(**owner_lookup):
+    """
+    Increase the data versions of the owners matching the lookup (e.g. bankaccount=pk) in a single query.
+    Owners without data version did not request a page yet and do not need one.
+    """
+    DataVersion.objects.filter(**owner_lookup).update(
+        version=F("version") + 1, modified=timezone.now()
+    )
+
+
 def check_user_permissions(user, account):
     # only superusers or the owner of the bank_account are allowed to view and modified anything related
     # to the given bank account
@@ -314,11 +641,75 @@ def get_bank_depots_for_user(user):
         return BankDepot.objects.filter(owner=user)
 
 
-def get_balance_for_user_owned_accounts(user):
+def round_amount(amount):
+    # sums computed by SQLite are floating point numbers
+    return Decimal(amount).quantize(Decimal("0.01"))
+
+
+def get_running_balances(transactions, start_balance, kind="month"):
+    """
+    Balance at the end of each period (kind: day, week, month, quarter or year) with transactions.
+    The running balance is computed in the database as a window sum over the per-period totals,
+    so the number of returned rows only depends on the number of periods.
+    """
+    balances = (
+        transactions.annotate(period=Trunc("date_issue", kind))
+        .values("period")
+        .annotate(total=Sum("amount"))
+        .annotate(balance=Window(WindowSum(Sum("amount")), order_by=F("period").asc()))
+        .order_by("period")
+    )
+
+    return [(b["period"], start_balance + b["balance"]) for b in balances]
+
+
+@timed(BALANCE_SECONDS, kind="depot")
+def get_depot_balances(depots, date=None):
+    """
+    Balance of the given depots as of the given date (default: today) as dict depot pk -> balance.
+    Sums the latest valuation <= date of every asset in a single grouped query.
+    """
+    if date is None:
+        date = datetime.date.today()
+
+    latest_valuation = (
+        DepotAssetValuation.objects.filter(asset=OuterRef("pk"), date__lte=date)
+        .order_by("-date")
+        .values("value")[:1]
+    )
+    balances = (
+        DepotAsset.objects.filter(bank_depot__in=depots)
+        .annotate(value=Subquery(latest_valuation))
+        .values("bank_depot")
+        .annotate(balance=Sum("value"))
+        .order_by()
+    )
+
+    return {b["bank_depot"]: round_amount(b["balance"] or 0) for b in balances}
+
+
+def get_accounts_balance(accounts, date=None):
+    """
+    Total balance of the given bank accounts as of the given date (default: all transactions).
+    """
+    start_balance = accounts.aggregate(total=Sum("current_amount"))["total"] or 0
+    transactions = Transaction.objects.filter(bank_account__in=accounts)
+    if date is not None:
+        transactions = transactions.filter(date_issue__lte=date)
+    archives = TransactionArchive.objects.filter(bank_account__in=accounts)
+
+    return round_amount(
+        start_balance
+        + (transactions.aggregate(total=Sum("amount"))["total"] or 0)
+        + get_archived_amount(archives, date)
+    )
+
+
+def get_balance_for_user_owned_accounts(user, date=None):
     bank_accounts = BankAccount.objects.filter(owner=user)
-    total_accounts = sum([b.get_balance() for b in bank_accounts])
+    total_accounts = get_accounts_balance(bank_accounts, date)
     depots = BankDepot.objects.filter(owner=user)
-    total_depots = sum([d.get_balance() for d in depots])
+    total_depots = sum(get_depot_balances(depots, date).values())
 
     return total_accounts + total_depots
 
@@ -330,6 +721,19 @@ def get_contracts_for_user(user):
         return Contract.objects.filter(owner=user).order_by("name")
 
 
+def annotate_contract_statistics(contracts):
+    """
+    Annotate the sum, the number and the date of the first and last transaction of every contract,
+    so that a list of contracts can be displayed with a single query.
+    """
+    return contracts.select_related("owner").annotate(
+        balance=Sum("contract__amount"),
+        n_transactions=Count("contract"),
+        first_transaction_date=Min("contract__date_issue"),
+        last_transaction_date=Max("contract__date_issue"),
+    )
+
+
 def check_any_pattern_in_string(string, patterns):
     for p in patterns:
         if p.lower() in string.lower():
@@ -380,6 +784,9 @@ def get_category(recipient, subject):
     return category
 
 
+@RECATEGORISATION_SECONDS.time()
+# the data version of the owner is increased once on commit instead of once per transaction
+@atomic
 def update_transaction_categories_for_account(account):
     for transaction in account.get_transactions():
         transaction.category = get_category(transaction.recipient, transaction.subject)
@@ -390,6 +797,6 @@ def get_contracts(user):
     if user.is_superuser:
         contracts = Contract.objects.all()
     else:
-        contracts = Contract.objects.filter(pk=user.pk)
+        contracts = Contract.objects.filter(owner=user)
 
     return contracts.order_by("-is_active", "name")
@@ -0,0 +1,277 @@
+import contextvars
+import datetime
+import functools
+import json
+import logging
+import os
+import sys
+import sysconfig
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.text import slugify
+
+logger = logging.getLogger(__name__)
+
+# profile of the request that is currently handled by this thread (or task)
+_current_profile = contextvars.ContextVar("request_profile", default=None)
+
+SPEEDSCOPE_SCHEMA = "https://www.speedscope.app/file-format-schema.json"
+
+_LIBRARY_PATHS = tuple(
+    {
+        sysconfig.get_path(name)
+        for name in ["stdlib", "platstdlib", "purelib", "platlib"]
+    }
+)
+
+
+@functools.cache
+def _is_library_file(filename):
+    # frozen modules of the standard library have file names like "<frozen importlib._bootstrap>"
+    return filename.startswith("<") or filename.startswith(_LIBRARY_PATHS)
+
+
+class Profile:
+    """
+    Deterministic profile of one request: every function call and return of the profiled threads with its
+    time, stored per thread as a speedscope "evented" profile (https://www.speedscope.app).
+    Calls of functions of the standard library and installed packages are only recorded with
+    include_libraries, otherwise their time counts as self time of the calling function. Once max_events
+    events are recorded the profiling stops and the profile is marked as truncated.
+    """
+
+    def __init__(self, name, include_libraries=False, max_events=None):
+        self.name = name
+        self.include_libraries = include_libraries
+        self.max_events = max_events
+        self.event_count = 0
+        self.truncated = False
+        self.start = time.perf_counter()
+        self.end = None
+        self.frames = []
+        self.frame_index = {}
+        self.threads = []
+        self.lock = threading.Lock()
+
+    def _get_frame(self, key):
+        index = self.frame_index.get(key)
+        if index is None:
+            with self.lock:
+                index = self.frame_index.setdefault(key, len(self.frames))
+                if index == len(self.frames):
+                    name, file, line = key
+                    self.frames.append({"name": name, "file": file, "line": line})
+        return index
+
+    def create_tracer(self, thread_name):
+        """
+        A function for sys.setprofile recording the events of the calling thread. Its method close() ends the
+        frames that are still open once the profiling of the thread is stopped.
+        """
+        events = []
+        # indices of the open frames, None for frames of libraries that are not recorded
+        stack = []
+        self.threads.append((thread_name, events))
+        clock = time.perf_counter
+        include_libraries = self.include_libraries
+
+        def tracer(frame, event, arg):
+            if event == "call":
+                code = frame.f_code
+                if not include_libraries and _is_library_file(code.co_filename):
+                    stack.append(None)
+                    return
+                key = (
+                    getattr(code, "co_qualname", code.co_name),
+                    code.co_filename,
+                    code.co_firstlineno,
+                )
+            elif event == "c_call":
+                # builtins called by libraries belong to the library call
+                if stack and stack[-1] is None:
+                    stack.append(None)
+                    return
+                module = getattr(arg, "__module__", None) or "builtins"
+                key = (f"{module}.{arg.__qualname__}", "", 0)
+            else:
+                # returns of frames entered before the profiling started are ignored
+                if stack:
+                    index = stack.pop()
+                    if index is not None:
+                        events.append(("C", index, clock()))
+                return
+
+            if self.max_events is not None and self.event_count >= self.max_events:
+                # the open frames are closed by close()
+                self.truncated = True
+                sys.setprofile(None)
+                return
+            self.event_count += 2
+            index = self._get_frame(key)
+            stack.append(index)
+            events.append(("O", index, clock()))
+
+        def close():
+            end = clock()
+            while stack:
+                index = stack.pop()
+                if index is not None:
+                    events.append(("C", index, end))
+
+        tracer.close = close
+        return tracer
+
+    def stop(self):
+        self.end = time.perf_counter()
+
+    def _relative_ms(self, t):
+        return round((t - self.start) * 1000, 4)
+
+    def to_speedscope(self):
+        return {
+            "$schema": SPEEDSCOPE_SCHEMA,
+            "name": self.name,
+            "exporter": "finances",
+            "shared": {"frames": self.frames},
+            "profiles": [
+                {
+                    "type": "evented",
+                    "name": thread_name,
+                    "unit": "milliseconds",
+                    "startValue": self._relative_ms(events[0][2]),
+                    "endValue": self._relative_ms(events[-1][2]),
+                    "events": [
+                        {"type": kind, "frame": frame, "at": self._relative_ms(t)}
+                        for kind, frame, t in events
+                    ],
+                }
+                for thread_name, events in self.threads
+                if events
+            ],
+        }
+
+    def summary(self, n=20):
+        """
+        The n functions with the highest self time over all threads with their total time (without counting
+        recursive calls twice) and number of calls, times in milliseconds.
+        """
+        self_time = {}
+        total_time = {}
+        calls = {}
+        for _, events in self.threads:
+            stack = []
+            for kind, frame, t in events:
+                if kind == "O":
+                    stack.append([frame, t, 0.0])
+                    calls[frame] = calls.get(frame, 0) + 1
+                    continue
+                frame, opened, children = stack.pop()
+                duration = t - opened
+                self_time[frame] = self_time.get(frame, 0.0) + duration - children
+                if all(f != frame for f, _, _ in stack):
+                    total_time[frame] = total_time.get(frame, 0.0) + duration
+                if stack:
+                    stack[-1][2] += duration
+
+        return [
+            {
+                "function": self.frames[frame]["name"],
+                "location": f"{self.frames[frame]['file']}:{self.frames[frame]['line']}",
+                "calls": calls[frame],
+                "self_ms": round(self_time[frame] * 1000, 2),
+                "total_ms": round(total_time[frame] * 1000, 2),
+            }
+            for frame in sorted(self_time, key=self_time.get, reverse=True)[:n]
+        ]
+
+
+@contextmanager
+def profile_thread(thread_name=None):
+    """
+    Record the calls of the current thread into the profile of the current request. Threads started by a request
+    have to enter this context manager themselves (within a copy of the request's context).
+    """
+    profile = _current_profile.get()
+    if profile is None:
+        yield
+        return
+
+    tracer = profile.create_tracer(thread_name or threading.current_thread().name)
+    sys.setprofile(tracer)
+    try:
+        yield
+    finally:
+        sys.setprofile(None)
+        tracer.close()
+
+
+def _profile_mode(request):
+    return request.GET.get("_profile") or request.headers.get("X-Profile")
+
+
+class ProfilingMiddleware:
+    """
+    Profile single requests of staff users on demand, enabled by the query parameter `_profile` or the header
+    `X-Profile` (e.g. for the requests of the Dash callbacks). The profile is written as speedscope JSON to
+    PROFILING_DIR, its file name is sent in the X-Profile header of the response and the functions with the
+    highest self time are logged. With the value "download" the profile is returned instead of the response, with
+    "full" the calls of libraries are recorded as well.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        mode = _profile_mode(request)
+        if not mode or not request.user.is_staff or _current_profile.get() is not None:
+            return self.get_response(request)
+
+        timestamp = datetime.datetime.now()
+        profile = Profile(
+            f"{request.method} {request.get_full_path()} {timestamp:%Y-%m-%d %H:%M:%S}",
+            include_libraries=mode == "full"
+            or getattr(settings, "PROFILING_INCLUDE_LIBRARIES", False),
+            max_events=getattr(settings, "PROFILING_MAX_EVENTS", None),
+        )
+        token = _current_profile.set(profile)
+        try:
+            with profile_thread("request"):
+                response = self.get_response(request)
+        finally:
+            _current_profile.reset(token)
+            profile.stop()
+
+        content = json.dumps(profile.to_speedscope())
+        filename = f"{timestamp:%Y%m%d-%H%M%S-%f}-{slugify(request.path) or 'root'}.speedscope.json"
+        profiling_dir = settings.PROFILING_DIR
+        os.makedirs(profiling_dir, exist_ok=True)
+        with open(os.path.join(profiling_dir, filename), "w") as f:
+            f.write(content)
+
+        logger.info(
+            json.dumps(
+                {
+                    "event": "profile",
+                    "method": request.method,
+                    "path": request.get_full_path(),
+                    "status": response.status_code,
+                    "duration_ms": round((profile.end - profile.start) * 1000, 1),
+                    "file": filename,
+                    "events": profile.event_count,
+                    "truncated": profile.truncated,
+                    "top_functions": profile.summary(
+                        getattr(settings, "PROFILING_TOP_FUNCTIONS", 20)
+                    ),
+                }
+            )
+        )
+
+        if mode == "download":
+            response = HttpResponse(content, content_type="application/json")
+            response["Content-Disposition"] = f'attachment; filename="{filename}"'
+        response["X-Profile"] = filename
+        return response
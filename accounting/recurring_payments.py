@@ -0,0 +1,161 @@
+import datetime
+import hashlib
+
+import numpy as np
+import pandas as pd
+from django.db import transaction
+
+from .models import Contract, Transaction, bump_data_versions
+
+# Periods a recurring payment can have: (name, expected interval in days, tolerated deviation in days,
+# minimum number of payments)
+PERIODS = [
+    ("monatlich", 30.44, 5, 3),
+    ("vierteljährlich", 91.31, 10, 3),
+    ("jährlich", 365.25, 20, 3),
+]
+# amounts within the same band (relative width) are treated as the same payment, e.g. 9.99€ and 10.49€
+AMOUNT_BAND_WIDTH = 0.1
+# share of intervals of a series that have to match the period
+MIN_REGULAR_INTERVALS = 0.75
+# a series is still active if its last payment is at most this many periods ago
+ACTIVE_PERIODS = 1.5
+
+
+def _normalise_recipients(recipients):
+    # ignore case, reference numbers and punctuation, e.g. "NETFLIX.COM 1234" and "Netflix.com" are the same
+    return (
+        recipients.str.lower()
+        .str.replace(r"[\d\W_]+", " ", regex=True)
+        .str.split()
+        .str.join(" ")
+    )
+
+
+def _get_transactions_dataframe(account):
+    df = pd.DataFrame.from_records(
+        Transaction.objects.filter(
+            bank_account=account, contract__isnull=True
+        ).values_list("pk", "recipient", "amount", "date_issue"),
+        columns=["pk", "recipient", "amount", "date_issue"],
+    )
+    df.amount = df.amount.astype(float)
+    df.date_issue = pd.to_datetime(df.date_issue)
+    return df
+
+
+def _assign_groups(df):
+    # group by normalised recipient, direction of the payment and logarithmic amount band
+    recipients = _normalise_recipients(df.recipient)
+    amounts = df.amount.abs().clip(lower=0.01)
+    band = np.floor(np.log(amounts) / np.log1p(AMOUNT_BAND_WIDTH)).astype(int)
+    df["group"] = (
+        recipients
+        + "|"
+        + np.sign(df.amount).astype(int).astype(str)
+        + "|"
+        + band.astype(str)
+    )
+    return df.loc[recipients != ""]
+
+
+def _interval_statistics(df):
+    df = df.sort_values(["group", "date_issue"])
+    df["interval"] = df.groupby("group").date_issue.diff().dt.days
+
+    groups = df.groupby("group")
+    stats = groups.agg(
+        recipient=("recipient", "last"),
+        amount=("amount", "median"),
+        n_transactions=("pk", "size"),
+        first_date=("date_issue", "min"),
+        last_date=("date_issue", "max"),
+        median_interval=("interval", "median"),
+    )
+
+    # deviation of every interval from the median interval of its series
+    deviation = (df.interval - df.group.map(stats.median_interval)).abs()
+    return df, stats, deviation
+
+
+def detect_recurring_payments(account, today=None):
+    """
+    Find series of periodic payments (monthly, quarterly, yearly) among the transactions of the account that
+    are not linked to a contract yet.
+    Transactions are grouped by normalised recipient and amount band, the intervals between the payments of
+    every group are evaluated with grouped array operations, so the runtime grows linearly with the number of
+    transactions.
+    Returns a list of proposals ordered by recipient, every proposal contains the primary keys of the
+    transactions of the series.
+    """
+    today = pd.Timestamp(today or datetime.date.today())
+
+    df = _get_transactions_dataframe(account)
+    if df.empty:
+        return []
+
+    df, stats, deviation = _interval_statistics(_assign_groups(df))
+
+    proposals = []
+    for name, days, tolerance, min_occurrences in PERIODS:
+        regular = (deviation <= tolerance).groupby(df.group).sum()
+        n_intervals = stats.n_transactions - 1
+        matches = stats.loc[
+            (stats.n_transactions >= min_occurrences)
+            & ((stats.median_interval - days).abs() <= tolerance)
+            & (regular.reindex(stats.index) >= MIN_REGULAR_INTERVALS * n_intervals)
+        ]
+        for group, row in matches.iterrows():
+            proposals.append(
+                {
+                    "key": hashlib.sha1(group.encode()).hexdigest()[:16],
+                    "group": group,
+                    "recipient": row.recipient,
+                    "period": name,
+                    "amount": round(row.amount, 2),
+                    "n_transactions": int(row.n_transactions),
+                    "first_date": row.first_date.date(),
+                    "last_date": row.last_date.date(),
+                    "is_active": (today - row.last_date).days <= ACTIVE_PERIODS * days,
+                }
+            )
+
+    pks = df.groupby("group").pk.agg(list)
+    for proposal in proposals:
+        proposal["transactions"] = pks[proposal.pop("group")]
+
+    return sorted(proposals, key=lambda p: (p["recipient"].lower(), p["period"]))
+
+
+def create_contracts_from_proposals(proposals, owner):
+    """
+    Create a contract for every proposal and link the transactions of the series to it.
+    Returns the created contracts.
+    """
+    with transaction.atomic():
+        contracts = Contract.objects.bulk_create(
+            [
+                Contract(
+                    owner=owner,
+                    name=f"{p['recipient'][:200]} ({p['period']})",
+                    description=f"Automatisch erkannt: {p['period']} {p['amount']:.2f}€",
+                    is_active=p["is_active"],
+                    start_date=p["first_date"],
+                    end_date=None if p["is_active"] else p["last_date"],
+                )
+                for p in proposals
+            ]
+        )
+
+        Transaction.objects.bulk_update(
+            [
+                Transaction(pk=pk, contract=contract)
+                for contract, p in zip(contracts, proposals)
+                for pk in p["transactions"]
+            ],
+            ["contract"],
+            batch_size=1000,
+        )
+        bump_data_versions(owner=owner)
+
+    return contracts
@@ -0,0 +1,237 @@
+import numpy as np
+import pandas as pd
+from django.core.cache import cache
+from django.db.models import F
+
+from .models import DepotAsset, DepotAssetTransaction, DepotAssetValuation
+
+# the data version of the depot owner is part of the cache key, so cached returns are replaced as soon as an
+# asset, a transaction or a valuation of the owner changes
+RETURNS_CACHE_TIMEOUT = 24 * 60 * 60
+RETURNS_CACHE_PREFIX = "asset-returns"
+
+DAYS_PER_YEAR = 365.0
+NEWTON_ITERATIONS = 50
+BISECTION_ITERATIONS = 100
+TOLERANCE = 1e-10
+# search interval for the bisection fallback: -99% to +1000% p.a.
+RATE_MIN = -0.99
+RATE_MAX = 10.0
+
+
+def _npv(rates, cash_flows, years):
+    return (cash_flows * (1.0 + rates[:, None]) ** -years).sum(axis=1)
+
+
+def _npv_derivative(rates, cash_flows, years):
+    return (-years * cash_flows * (1.0 + rates[:, None]) ** (-years - 1.0)).sum(axis=1)
+
+
+def xirr(cash_flows, years):
+    """
+    Money-weighted annual returns for many cash flow series at once.
+    cash_flows and years are 2D arrays (one row per series, padded with zero cash flows), years is the time of
+    each cash flow in years since the first cash flow of the series.
+    Solves NPV(r) = 0 with vectorised Newton iterations and falls back to a vectorised bisection for rows that
+    did not converge. Rows without a root (e.g. no sign change in the cash flows) are NaN.
+    """
+    n_series = cash_flows.shape[0]
+    rates = np.full(n_series, 0.1)
+
+    with np.errstate(all="ignore"):
+        for _ in range(NEWTON_ITERATIONS):
+            step = _npv(rates, cash_flows, years) / _npv_derivative(
+                rates, cash_flows, years
+            )
+            rates = rates - step
+            if np.all(np.abs(step) < TOLERANCE):
+                break
+
+        converged = (
+            np.isfinite(rates)
+            & (rates > RATE_MIN)
+            & (np.abs(_npv(rates, cash_flows, years)) < 1e-6)
+        )
+
+        # bisection for all remaining series with a sign change in the search interval
+        low = np.full(n_series, RATE_MIN)
+        high = np.full(n_series, RATE_MAX)
+        npv_low = _npv(low, cash_flows, years)
+        bracketed = ~converged & (
+            np.sign(npv_low) != np.sign(_npv(high, cash_flows, years))
+        )
+
+        for _ in range(BISECTION_ITERATIONS):
+            mid = (low + high) / 2.0
+            npv_mid = _npv(mid, cash_flows, years)
+            same_sign = np.sign(npv_mid) == np.sign(npv_low)
+            low = np.where(same_sign, mid, low)
+            npv_low = np.where(same_sign, npv_mid, npv_low)
+            high = np.where(same_sign, high, mid)
+
+    rates = np.where(converged, rates, np.nan)
+    return np.where(bracketed, (low + high) / 2.0, rates)
+
+
+def _pad_by_asset(df, asset_pks, columns):
+    # turn the long format (one row per cash flow) into one zero padded row per asset
+    position = df.groupby("asset").cumcount().to_numpy()
+    row = pd.Index(asset_pks).get_indexer(df.asset)
+    n_columns = position.max() + 1 if len(df) else 1
+
+    arrays = []
+    for column in columns:
+        padded = np.zeros((len(asset_pks), n_columns))
+        padded[row, position] = df[column].to_numpy()
+        arrays.append(padded)
+    return arrays
+
+
+def _money_weighted_returns(assets, transactions):
+    # from the investor's perspective deposits are negative cash flows, the current balance is the final inflow
+    cash_flows = pd.concat(
+        [
+            pd.DataFrame(
+                {
+                    "asset": transactions.asset,
+                    "date": transactions.date,
+                    "cash_flow": -transactions.amount,
+                }
+            ),
+            pd.DataFrame(
+                {
+                    "asset": assets.index,
+                    "date": assets.last_update,
+                    "cash_flow": assets.current_balance,
+                }
+            ),
+        ]
+    ).sort_values(["asset", "date"])
+
+    first_date = cash_flows.groupby("asset").date.transform("min")
+    cash_flows["years"] = (cash_flows.date - first_date).dt.days / DAYS_PER_YEAR
+
+    padded_cash_flows, padded_years = _pad_by_asset(
+        cash_flows, assets.index, ["cash_flow", "years"]
+    )
+    return pd.Series(xirr(padded_cash_flows, padded_years), index=assets.index)
+
+
+def _time_weighted_returns(assets, transactions, valuations):
+    """
+    Annualised time-weighted returns based on the valuation snapshots.
+    The cash flows between two snapshots are assumed to be included in the later snapshot.
+    """
+    valuations = valuations.sort_values(["asset", "date"])
+    transactions = transactions.sort_values("date")
+
+    # assign every transaction to the next valuation of the same asset
+    flows = pd.merge_asof(
+        transactions,
+        valuations[["asset", "date"]]
+        .rename(columns={"date": "valuation_date"})
+        .sort_values("valuation_date"),
+        left_on="date",
+        right_on="valuation_date",
+        by="asset",
+        direction="forward",
+    )
+    flows = flows.groupby(["asset", "valuation_date"]).amount.sum()
+
+    periods = valuations.set_index(["asset", "date"]).value.to_frame()
+    periods["flow"] = flows.reindex(periods.index, fill_value=0.0)
+    periods["previous_value"] = periods.groupby(level="asset").value.shift()
+    periods = periods.loc[periods.previous_value > 0]
+
+    growth = (periods.value - periods.flow) / periods.previous_value
+    growth = growth.loc[growth > 0]
+
+    log_growth = np.log(growth).groupby(level="asset").sum()
+    first_date = valuations.groupby("asset").date.min()
+    last_date = valuations.groupby("asset").date.max()
+    years = ((last_date - first_date).dt.days / DAYS_PER_YEAR).reindex(log_growth.index)
+
+    twr = np.expm1(log_growth / years.where(years > 0))
+    return twr.reindex(assets.index)
+
+
+def _compute_returns(asset_pks):
+    assets = pd.DataFrame.from_records(
+        DepotAsset.objects.filter(pk__in=asset_pks).values_list(
+            "pk", "current_balance", "last_update"
+        ),
+        columns=["asset", "current_balance", "last_update"],
+    ).set_index("asset")
+    assets.current_balance = assets.current_balance.astype(float)
+    assets.last_update = pd.to_datetime(assets.last_update)
+
+    transactions = pd.DataFrame.from_records(
+        DepotAssetTransaction.objects.filter(asset__in=asset_pks).values_list(
+            "asset", "date_issue", "amount"
+        ),
+        columns=["asset", "date", "amount"],
+    )
+    # the columns of empty frames are object-typed, which merge_asof cannot match against the valuations
+    transactions.asset = transactions.asset.astype("int64")
+    transactions.date = pd.to_datetime(transactions.date)
+    transactions.amount = transactions.amount.astype(float)
+
+    valuations = pd.DataFrame.from_records(
+        DepotAssetValuation.objects.filter(asset__in=asset_pks).values_list(
+            "asset", "date", "value"
+        ),
+        columns=["asset", "date", "value"],
+    )
+    valuations.asset = valuations.asset.astype("int64")
+    valuations.date = pd.to_datetime(valuations.date)
+    valuations.value = valuations.value.astype(float)
+
+    xirr_returns = _money_weighted_returns(assets, transactions)
+    twr_returns = _time_weighted_returns(assets, transactions, valuations)
+
+    return {
+        pk: {
+            "xirr": None if np.isnan(xirr_returns[pk]) else float(xirr_returns[pk]),
+            "twr": None if np.isnan(twr_returns[pk]) else float(twr_returns[pk]),
+        }
+        for pk in assets.index
+    }
+
+
+def _get_cache_keys(assets):
+    # assets whose owner has no data version yet are not cached
+    versions = (
+        DepotAsset.objects.filter(pk__in=[asset.pk for asset in assets])
+        .annotate(data_version=F("bank_depot__owner__data_version__version"))
+        .filter(data_version__isnull=False)
+        .values_list("pk", "bank_depot__owner", "data_version")
+    )
+
+    return {
+        f"{RETURNS_CACHE_PREFIX}:{pk}:{owner}-{version}": pk
+        for pk, owner, version in versions
+    }
+
+
+def get_asset_returns(assets):
+    """
+    Money-weighted (XIRR) and annualised time-weighted returns of all given assets.
+    Returns a dict asset pk -> {"xirr": float or None, "twr": float or None} with returns as fractions.
+    Returns are cached per asset until the data of its owner changes, all uncached assets are computed together
+    in one batch.
+    """
+    keys = _get_cache_keys(assets)
+    cached = cache.get_many(keys.keys())
+
+    returns = {keys[key]: value for key, value in cached.items()}
+    missing = [asset.pk for asset in assets if asset.pk not in returns]
+
+    if missing:
+        computed = _compute_returns(missing)
+        returns.update(computed)
+        cache.set_many(
+            {key: computed[pk] for key, pk in keys.items() if pk in computed},
+            RETURNS_CACHE_TIMEOUT,
+        )
+
+    return returns
@@ -0,0 +1,161 @@
+import re
+
+import pandas as pd
+
+from .models import (
+    Category,
+    Contract,
+    Transaction,
+    bump_data_versions,
+    get_bank_accounts_for_user,
+    get_contracts,
+)
+
+
+def _compile_patterns(patterns):
+    # one regular expression per category or contract, patterns match case-insensitive substrings
+    patterns = [p.lower() for p in patterns]
+    if not patterns:
+        return None
+    return "|".join(re.escape(p) for p in patterns)
+
+
+def _contains(strings, regex):
+    if regex is None:
+        return pd.Series(False, index=strings.index)
+    return strings.str.contains(regex, regex=True)
+
+
+def _first_match(masks, values, index):
+    # every row gets the value of the first matching mask (masks are ordered by priority)
+    result = pd.Series(None, index=index, dtype=object)
+    for mask, value in zip(masks, values):
+        result = result.where(result.notna() | ~mask, value)
+    # rows without a match are None (not NaN), so they can be passed to the model forms directly
+    return result.astype(object).where(result.notna(), None)
+
+
+class TransactionMatcher:
+    """
+    Category patterns and contract rules compiled into regular expressions, so that the category and the
+    contract of many transactions are determined with a few vectorised string operations per category and
+    contract instead of one database query per transaction.
+    """
+
+    def __init__(self, contracts=None):
+        self.categories = [
+            (category, _compile_patterns(category.get_patterns()))
+            for category in Category.objects.all()
+        ]
+
+        contracts = Contract.objects.none() if contracts is None else contracts
+        self.contracts = [
+            (
+                contract,
+                _compile_patterns(contract.get_recipient_patterns()),
+                _compile_patterns(contract.get_subject_patterns()),
+            )
+            for contract in contracts
+            if contract.has_rules()
+        ]
+
+    def categorize(self, recipients, subjects):
+        """
+        Same result as get_category for every transaction: the first category with a pattern in the recipient,
+        otherwise the first category with a pattern in the subject.
+        """
+        recipients = recipients.fillna("").astype(str).str.lower()
+        subjects = subjects.fillna("").astype(str).str.lower()
+        categories = [category for category, _ in self.categories]
+
+        by_recipient = _first_match(
+            [_contains(recipients, regex) for _, regex in self.categories],
+            categories,
+            recipients.index,
+        )
+        by_subject = _first_match(
+            [_contains(subjects, regex) for _, regex in self.categories],
+            categories,
+            subjects.index,
+        )
+        return by_recipient.where(by_recipient.notna(), by_subject)
+
+    def match_contracts(self, recipients, subjects, amounts, dates):
+        """
+        The first contract whose rules match the transaction: a recipient or subject pattern has to be
+        contained, the amount has to be in the amount range and the date within the contract period (if set).
+        """
+        recipients = recipients.fillna("").astype(str).str.lower()
+        subjects = subjects.fillna("").astype(str).str.lower()
+        amounts = amounts.astype(float)
+        dates = pd.to_datetime(dates)
+
+        masks = []
+        for contract, recipient_regex, subject_regex in self.contracts:
+            mask = _contains(recipients, recipient_regex) | _contains(
+                subjects, subject_regex
+            )
+            if contract.amount_min is not None:
+                mask &= amounts >= float(contract.amount_min)
+            if contract.amount_max is not None:
+                mask &= amounts <= float(contract.amount_max)
+            if contract.start_date is not None:
+                mask &= dates >= pd.Timestamp(contract.start_date)
+            if contract.end_date is not None:
+                mask &= dates <= pd.Timestamp(contract.end_date)
+            masks.append(mask)
+
+        return _first_match(
+            masks, [contract for contract, _, _ in self.contracts], recipients.index
+        )
+
+    def apply(self, df):
+        """
+        Set the category and contract columns of a DataFrame of transactions
+        (columns recipient, subject, amount and date_issue).
+        """
+        df["category"] = self.categorize(df.recipient, df.subject)
+        df["contract"] = self.match_contracts(
+            df.recipient, df.subject, df.amount, df.date_issue
+        )
+        return df
+
+
+def apply_contract_rules(user):
+    """
+    Link all transactions of the bank accounts the user can view without a contract to the first contract
+    whose rules match. Only contracts of the owner of the bank account are considered. Returns the number of
+    linked transactions.
+    """
+    contracts = get_contracts(user)
+    accounts = get_bank_accounts_for_user(user)
+
+    df = pd.DataFrame.from_records(
+        Transaction.objects.filter(
+            bank_account__in=accounts, contract__isnull=True
+        ).values_list(
+            "pk", "bank_account__owner", "recipient", "subject", "amount", "date_issue"
+        ),
+        columns=["pk", "owner", "recipient", "subject", "amount", "date_issue"],
+    )
+    if df.empty:
+        return 0
+
+    linked = []
+    for owner, owner_df in df.groupby("owner"):
+        matcher = TransactionMatcher(contracts.filter(owner=owner))
+        if not matcher.contracts:
+            continue
+        matched_contracts = matcher.match_contracts(
+            owner_df.recipient, owner_df.subject, owner_df.amount, owner_df.date_issue
+        )
+        matched = matched_contracts.notna()
+        linked += [
+            Transaction(pk=pk, contract=contract)
+            for pk, contract in zip(owner_df.pk[matched], matched_contracts[matched])
+        ]
+
+    Transaction.objects.bulk_update(linked, ["contract"], batch_size=1000)
+    if linked:
+        bump_data_versions(owner__bankaccount__in=accounts)
+    return len(linked)
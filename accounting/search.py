@@ -0,0 +1,138 @@
+"""
+Search for transactions across all bank accounts a user is allowed to view.
+"""
+
+import base64
+import datetime
+import decimal
+
+from django.db import connection
+from django.db.models import Count, Q, Sum, Value
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Abs, Coalesce
+
+from .models import Transaction
+
+# full-text index (SQLite FTS5) of recipient and subject of all transactions, created by migration 0018
+TRANSACTION_SEARCH_TABLE = "accounting_transaction_search"
+# the trigram tokenizer of the index only matches search terms of at least three characters
+SEARCH_MIN_INDEXED_LENGTH = 3
+
+
+def _quote_match_term(search_term):
+    # the search term is matched as a phrase, so operators of the FTS query syntax have no effect
+    return '"' + search_term.replace('"', '""') + '"'
+
+
+def filter_search_term(transactions, search_term):
+    """
+    Transactions whose recipient or subject contains the search term. On SQLite the full-text index is used
+    instead of scanning every recipient and subject with LIKE.
+    """
+    if connection.vendor != "sqlite" or len(search_term) < SEARCH_MIN_INDEXED_LENGTH:
+        return transactions.filter(
+            Q(recipient__contains=search_term) | Q(subject__contains=search_term)
+        )
+    return transactions.filter(
+        pk__in=RawSQL(
+            f"SELECT rowid FROM {TRANSACTION_SEARCH_TABLE} "
+            f"WHERE {TRANSACTION_SEARCH_TABLE} MATCH %s",
+            [_quote_match_term(search_term)],
+        )
+    )
+
+
+def search_transactions(
+    accounts,
+    search_term=None,
+    date_start=None,
+    date_end=None,
+    amount_min=None,
+    amount_max=None,
+    categories=None,
+):
+    """
+    Transactions of the given bank accounts matching the filters of the transactions overview, newest first.
+    Unlike BankAccount.get_transactions, filters that are not given are not applied at all.
+    Archived years are not searched, the search page lists them (see TransactionArchive).
+    """
+    transactions = Transaction.objects.filter(bank_account__in=accounts)
+
+    if search_term:
+        transactions = filter_search_term(transactions, search_term)
+    if date_start:
+        transactions = transactions.filter(date_issue__gte=date_start)
+    if date_end:
+        transactions = transactions.filter(date_issue__lte=date_end)
+    if amount_min or amount_max:
+        transactions = transactions.annotate(absolute_amount=Abs("amount"))
+        if amount_min:
+            transactions = transactions.filter(absolute_amount__gte=amount_min)
+        if amount_max:
+            transactions = transactions.filter(absolute_amount__lte=amount_max)
+    if categories:
+        transactions = transactions.filter(category__in=categories)
+
+    return transactions.order_by("-date_issue", "-pk")
+
+
+def encode_cursor(date_issue, pk):
+    return base64.urlsafe_b64encode(f"{date_issue.isoformat()}|{pk}".encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Date and pk of the last transaction of the previous page. Raises ValueError for an invalid cursor.
+    """
+    date_issue, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+    return datetime.date.fromisoformat(date_issue), int(pk)
+
+
+def filter_after_cursor(transactions, cursor):
+    """
+    Transactions ordered after the (date_issue, pk) of the cursor, newest first. With the (date_issue, id) index
+    the next page is found directly instead of skipping an offset.
+    """
+    date_issue, pk = decode_cursor(cursor)
+    return transactions.filter(
+        Q(date_issue__lt=date_issue) | Q(date_issue=date_issue, pk__lt=pk)
+    )
+
+
+def get_page(transactions, limit, cursor=None):
+    """
+    The first limit transactions (after the cursor) and the cursor of the next page (None on the last page).
+    """
+    if cursor:
+        transactions = filter_after_cursor(transactions, cursor)
+    page = list(transactions[: limit + 1])
+    if len(page) <= limit:
+        return page, None
+    page = page[:limit]
+    return page, encode_cursor(page[-1].date_issue, page[-1].pk)
+
+
+def get_account_subtotals(transactions):
+    """
+    Number of transactions, payed, received and total amount of the transactions per bank account, computed in
+    one grouped query over all matching transactions (not only the current page), as list of dicts.
+    """
+    zero = Value(decimal.Decimal(0))
+    subtotals = list(
+        transactions.order_by()
+        .values("bank_account", "bank_account__name", "bank_account__owner__username")
+        .annotate(
+            count=Count("pk"),
+            payed=Coalesce(Sum("amount", filter=Q(amount__lt=0)), zero),
+            received=Coalesce(Sum("amount", filter=Q(amount__gt=0)), zero),
+            total=Coalesce(Sum("amount"), zero),
+        )
+        .order_by("bank_account__owner__username", "bank_account__name")
+    )
+    # sums computed by SQLite are floating point numbers
+    for subtotal in subtotals:
+        for name in ["payed", "received", "total"]:
+            subtotal[name] = decimal.Decimal(subtotal[name]).quantize(
+                decimal.Decimal("0.01")
+            )
+    return subtotals
@@ -0,0 +1,22 @@
+from django.conf import settings
+
+
+def get_sqlite_pragmas():
+    return getattr(settings, "SQLITE_PRAGMAS", {})
+
+
+def apply_pragmas(cursor, pragmas):
+    for name, value in pragmas.items():
+        cursor.execute(f"PRAGMA {name} = {value}")
+
+
+def configure_sqlite_connection(sender, connection, **kwargs):
+    """
+    Apply the SQLITE_PRAGMAS setting to every new SQLite connection (connected to the connection_created
+    signal). Other database backends are not touched.
+    """
+    if connection.vendor != "sqlite":
+        return
+
+    with connection.cursor() as cursor:
+        apply_pragmas(cursor, get_sqlite_pragmas())
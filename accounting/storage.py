@@ -0,0 +1,72 @@
+import hashlib
+import os
+import string
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+
+HASH_ALGORITHM = "sha256"
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    File system storage that names every file after the hash of its content, e.g.
+    contract_files/3f/3fa2...c1.pdf. Identical uploads are stored only once and share the same name.
+    The hash is computed while the upload is streamed to a temporary file, so the file is read only once
+    and never held in memory completely.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # the final name is only known after hashing the content in _save
+        return name
+
+    def _save(self, name, content):
+        directory, filename = os.path.split(name)
+        _, extension = os.path.splitext(filename)
+
+        tmp_dir = self.path(directory)
+        os.makedirs(tmp_dir, exist_ok=True)
+
+        digest = hashlib.new(HASH_ALGORITHM)
+        with tempfile.NamedTemporaryFile(dir=tmp_dir, delete=False) as tmp_file:
+            if hasattr(content, "seek"):
+                content.seek(0)
+            for chunk in content.chunks():
+                digest.update(chunk)
+                tmp_file.write(chunk)
+
+        content_hash = digest.hexdigest()
+        name = os.path.join(
+            directory, content_hash[:2], f"{content_hash}{extension.lower()}"
+        )
+        full_path = self.path(name)
+
+        if os.path.exists(full_path):
+            # identical content is already stored
+            os.remove(tmp_file.name)
+        else:
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            os.replace(tmp_file.name, full_path)
+            if self.file_permissions_mode is not None:
+                os.chmod(full_path, self.file_permissions_mode)
+
+        return name.replace("\\", "/")
+
+    def get_content_hash(self, name):
+        """
+        The content hash encoded in the file name, None for files that were stored before content addressing.
+        """
+        content_hash, _ = os.path.splitext(os.path.basename(name))
+        digest_length = hashlib.new(HASH_ALGORITHM).digest_size * 2
+        if len(content_hash) == digest_length and all(
+            c in string.hexdigits for c in content_hash
+        ):
+            return content_hash
+        return None
+
+
+contract_file_storage = ContentAddressedStorage()
+
+
+def get_contract_file_storage():
+    return contract_file_storage
@@ -1 +1,280 @@
-# Create your tests here.
+import datetime
+import decimal
+import io
+import shutil
+import tempfile
+import zipfile
+
+import pyarrow.parquet as pq
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import transaction
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from .archive import archive_year
+from .models import (
+    BankAccount,
+    BankDepot,
+    Category,
+    DepotAsset,
+    DepotAssetTransaction,
+    DepotAssetValuation,
+    Transaction,
+    get_data_version,
+)
+from .returns import get_asset_returns
+
+
+class AssetReturnsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("investor", password="secret")
+        cls.depot = BankDepot.objects.create(owner=cls.user, name="Depot")
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def test_asset_without_transactions(self):
+        asset = DepotAsset.objects.create(
+            bank_depot=self.depot,
+            name="ETF",
+            current_balance=decimal.Decimal("1000.00"),
+            last_update=datetime.date(2024, 6, 1),
+        )
+
+        returns = get_asset_returns([asset])
+
+        self.assertEqual(returns[asset.pk], {"xirr": None, "twr": None})
+        response = self.client.get(reverse("depot-detail", args=[self.depot.pk]))
+        self.assertEqual(response.status_code, 200)
+
+    def test_asset_without_valuations(self):
+        asset = DepotAsset.objects.create(
+            bank_depot=self.depot,
+            name="Fonds",
+            current_balance=decimal.Decimal("1100.00"),
+            last_update=datetime.date(2024, 6, 1),
+        )
+        DepotAssetValuation.objects.filter(asset=asset).delete()
+        DepotAssetTransaction.objects.create(
+            asset=asset,
+            amount=decimal.Decimal("1000.00"),
+            date_issue=datetime.date(2023, 6, 1),
+        )
+
+        returns = get_asset_returns([asset])
+
+        self.assertIsNone(returns[asset.pk]["twr"])
+        self.assertAlmostEqual(returns[asset.pk]["xirr"], 0.1, places=2)
+        response = self.client.get(reverse("depot-detail", args=[self.depot.pk]))
+        self.assertEqual(response.status_code, 200)
+
+
+class ExportWithArchiveTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("exporter", password="secret")
+        cls.account = BankAccount.objects.create(
+            owner=cls.user, name="Girokonto", bank="Bank"
+        )
+        cls.category = Category.objects.create(name="Lebensmittel", patterns="")
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings = override_settings(MEDIA_ROOT=self.media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.client.force_login(self.user)
+
+        today = datetime.date.today()
+        for recipient, date_issue, category in [
+            ("Supermarkt", datetime.date(2023, 3, 1), self.category),
+            ("Unbekannt", datetime.date(2023, 4, 1), None),
+            ("Bäckerei", today, None),
+        ]:
+            Transaction.objects.create(
+                bank_account=self.account,
+                recipient=recipient,
+                amount=decimal.Decimal("-12.50"),
+                category=category,
+                subject="Einkauf",
+                date_issue=date_issue,
+                full_subject_string=f"{recipient} Einkauf",
+            )
+        archive_year(self.account, 2023)
+
+    def _export(self, file_format):
+        response = self.client.get(
+            reverse("export-transactions", args=[self.account.pk, file_format])
+        )
+        self.assertEqual(response.status_code, 200)
+        return b"".join(response.streaming_content)
+
+    def test_csv(self):
+        content = self._export("csv").decode("utf-8-sig")
+
+        rows = content.splitlines()
+        self.assertEqual(len(rows), 4)
+        self.assertNotIn("nan", content)
+        self.assertIn("Supermarkt", content)
+        self.assertIn("Lebensmittel", content)
+
+    def test_xlsx(self):
+        content = self._export("xlsx")
+
+        with zipfile.ZipFile(io.BytesIO(content)) as workbook:
+            # in constant memory mode the strings are written inline
+            sheet = workbook.read("xl/worksheets/sheet1.xml").decode()
+        self.assertIn("Unbekannt", sheet)
+        self.assertNotIn("nan", sheet)
+
+    def test_parquet(self):
+        table = pq.read_table(io.BytesIO(self._export("parquet")))
+
+        self.assertEqual(table.num_rows, 3)
+        self.assertCountEqual(
+            table.column("category").to_pylist(), [None, None, "Lebensmittel"]
+        )
+
+
+class DepotUploadTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("uploader", password="secret")
+        cls.depot = BankDepot.objects.create(owner=cls.user, name="Depot")
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def _upload(self, content):
+        return self.client.post(
+            reverse("upload-depot-csv", args=[self.depot.pk]),
+            {"file": SimpleUploadedFile("depot.csv", content)},
+        )
+
+    def test_valid_file(self):
+        response = self._upload(
+            b"Datum;Anlage;Umsatz;Bewertung\n01.02.2024;ETF;1.000,00;1.000,00\n"
+        )
+
+        self.assertRedirects(
+            response,
+            reverse("depot-detail", args=[self.depot.pk]),
+            fetch_redirect_response=False,
+        )
+        self.assertEqual(DepotAssetTransaction.objects.count(), 1)
+
+    def test_invalid_files(self):
+        for content in [
+            b"Datum;Empfaenger;Betrag\n01.02.2024;ETF;100\n",
+            b"Datum;Anlage;Umsatz;Bewertung\n2024-02-01;ETF;100;100\n",
+            "Datum;Anlage;Umsatz;Bewertung\n01.02.2024;Anleihe;100;100\n".encode(
+                "utf-16"
+            ),
+        ]:
+            with self.subTest(content=content):
+                response = self._upload(content)
+
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(response.context["form"].errors["file"])
+        self.assertFalse(DepotAsset.objects.exists())
+
+
+class TransactionsApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("client", password="secret")
+        cls.account = BankAccount.objects.create(
+            owner=cls.user, name="Girokonto", bank="Bank"
+        )
+        cls.category = Category.objects.create(name="Miete", patterns="")
+        Transaction.objects.create(
+            bank_account=cls.account,
+            recipient="Vermieter",
+            amount=decimal.Decimal("-800.00"),
+            category=cls.category,
+            subject="Miete",
+            date_issue=datetime.date(2024, 5, 1),
+            full_subject_string="Vermieter Miete",
+        )
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def _get(self, query):
+        return self.client.get(
+            reverse("api-transactions", args=[self.account.pk]), query
+        )
+
+    def test_valid_filters(self):
+        response = self._get(
+            {
+                "categories": [self.category.pk],
+                "amount_min": "100",
+                "amount_max": "1000",
+            }
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["results"]), 1)
+
+    def test_invalid_filters(self):
+        for query in [
+            {"categories": "abc"},
+            {"amount_min": "NaN"},
+            {"amount_min": "Infinity"},
+            {"amount_max": "-Infinity"},
+            {"amount_max": "zehn"},
+        ]:
+            with self.subTest(query=query):
+                response = self._get(query)
+
+                self.assertEqual(response.status_code, 400)
+                self.assertIn("error", response.json())
+
+
+class DataVersionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("saver", password="secret")
+        cls.account = BankAccount.objects.create(
+            owner=cls.user, name="Girokonto", bank="Bank"
+        )
+
+    def _create_transaction(self):
+        Transaction.objects.create(
+            bank_account=self.account,
+            recipient="Supermarkt",
+            amount=decimal.Decimal("-5.00"),
+            subject="Einkauf",
+            date_issue=datetime.date(2024, 1, 1),
+            full_subject_string="Supermarkt Einkauf",
+        )
+
+    def test_bumped_once_per_transaction(self):
+        version = get_data_version(self.user.pk).version
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with transaction.atomic():
+                for _ in range(3):
+                    self._create_transaction()
+
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(get_data_version(self.user.pk).version, version + 1)
+
+    def test_bumped_after_rolled_back_savepoint(self):
+        version = get_data_version(self.user.pk).version
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertRaises(RuntimeError):
+                with transaction.atomic():
+                    self._create_transaction()
+                    raise RuntimeError
+            self._create_transaction()
+
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(get_data_version(self.user.pk).version, version + 1)
@@ -1,24 +1,37 @@
 from django.urls import include, path
 
+from .api import (
+    account_api_view,
+    accounts_api_view,
+    monthly_category_aggregates_api_view,
+    transactions_api_view,
+)
 from .views import (
     CategoryCreateView,
     accounts_view,
     add_files_to_contract,
+    apply_contract_rules_view,
     categories_view,
     charts_view,
     contract_detail_view,
+    contract_file_download_view,
     contracts_view,
     create_category,
     create_contract,
     depot_asset_update_view,
     depot_overview,
+    depot_upload_csv_view,
+    metrics_view,
     reassign_categories,
+    recurring_payments_view,
     transaction_delete_view,
     transaction_detail_view,
     transaction_update_view,
     transaction_upload_csv_view,
     transactions_add_multiple,
+    transactions_export_view,
     transactions_overview,
+    transactions_search_view,
     update_category,
     update_contract,
 )
@@ -32,6 +45,11 @@ urlpatterns = [
         transaction_upload_csv_view,
         name="upload-transactions-csv",
     ),
+    path(
+        "konto/<int:pk>/export/<str:file_format>",
+        transactions_export_view,
+        name="export-transactions",
+    ),
     path(
         "konto/<int:pk>/addmulti",
         transactions_add_multiple,
@@ -57,9 +75,16 @@ urlpatterns = [
         transaction_delete_view,
         name="transaction-delete",
     ),
+    path(
+        "konto/<int:pk>/vertraege",
+        recurring_payments_view,
+        name="recurring-payments",
+    ),
     path("konto/<int:pk>/charts", charts_view, name="account-charts"),
+    path("suche", transactions_search_view, name="transaction-search"),
     # Depot views
     path("depot/<int:pk>/", depot_overview, name="depot-detail"),
+    path("depot/<int:pk>/upload", depot_upload_csv_view, name="upload-depot-csv"),
     path(
         "depot/<int:dep_pk>/asset/<int:as_pk>/update",
         depot_asset_update_view,
@@ -79,10 +104,35 @@ urlpatterns = [
     path("vertrag/<int:pk>", contract_detail_view, name="contract-detail"),
     path("vertrag/new", create_contract, name="create-contract"),
     path("vertrag/<int:pk>/update", update_contract, name="update-contract"),
+    path(
+        "vertrag/regeln-anwenden",
+        apply_contract_rules_view,
+        name="apply-contract-rules",
+    ),
     path(
         "vertrag/<int:pk>/addfiles", add_files_to_contract, name="add-files-to-contract"
     ),
+    path(
+        "vertrag/datei/<int:pk>",
+        contract_file_download_view,
+        name="contract-file",
+    ),
     # Charts
     path("dash-charts/", include("django_plotly_dash.urls")),
     path("charts/", charts_view, name="charts"),
+    # JSON API
+    path("api/v1/accounts", accounts_api_view, name="api-accounts"),
+    path("api/v1/accounts/<int:pk>", account_api_view, name="api-account"),
+    path(
+        "api/v1/accounts/<int:pk>/transactions",
+        transactions_api_view,
+        name="api-transactions",
+    ),
+    path(
+        "api/v1/accounts/<int:pk>/monthly-categories",
+        monthly_category_aggregates_api_view,
+        name="api-monthly-categories",
+    ),
+    # Monitoring
+    path("metrics", metrics_view, name="metrics"),
 ]
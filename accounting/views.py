@@ -1,13 +1,44 @@
+import datetime
+import hmac
+import mimetypes
+import re
+
+import pandas as pd
+from django.conf import settings
 from django.contrib import messages
+from django.contrib.auth.decorators import login_not_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.models import User
+from django.core.exceptions import PermissionDenied
 from django.core.paginator import Paginator
+from django.db.models import Prefetch, Sum
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from django.utils.text import slugify
+from django.views.decorators.http import require_POST
 from django.views.generic import CreateView
 from django_addanother.views import CreatePopupMixin
 
 from . import charts  # noqa: F401
+from .archive import TransactionsWithArchive, read_archived_transactions
+from .csv_to_depot_transactions import import_depot_csv
 from .csv_to_transactions import csv_to_transactions
+from .data_version import (
+    condition_on_data_version,
+    get_account_owner_ids,
+    get_contract_owner_ids,
+    get_depot_owner_ids,
+    get_viewable_owner_ids,
+)
+from .export import (
+    EXPORT_CONTENT_TYPES,
+    iter_export_rows,
+    stream_csv,
+    stream_parquet,
+    write_xlsx,
+)
 from .forms import (
     AssetForm,
     CategoryForm,
@@ -19,22 +50,39 @@ from .forms import (
     UploadFileForm,
     process_transactions_formset,
 )
+from .import_report import ImportReport
+from .metrics import generate_metrics
 from .models import (
     BankAccount,
     BankDepot,
     Category,
     Contract,
+    ContractFile,
     DepotAsset,
+    DepotAssetTransaction,
     Transaction,
+    TransactionArchive,
+    annotate_contract_statistics,
     check_user_permissions,
     get_balance_for_user_owned_accounts,
     get_bank_accounts_for_user,
     get_bank_depots_for_user,
     get_contracts_for_user,
+    get_data_version,
+    round_amount,
     update_transaction_categories_for_account,
 )
+from .recurring_payments import (
+    create_contracts_from_proposals,
+    detect_recurring_payments,
+)
+from .returns import get_asset_returns
+from .rules import apply_contract_rules
+from .search import get_account_subtotals, get_page, search_transactions
 
 TRANSACTIONS_PAGE_LIMIT = 100
+# contract files are streamed in chunks of this size (bytes)
+CONTRACT_FILE_CHUNK_SIZE = 64 * 1024
 
 
 #################################
@@ -42,6 +90,7 @@ TRANSACTIONS_PAGE_LIMIT = 100
 #################################
 
 
+@condition_on_data_version(get_viewable_owner_ids)
 def accounts_view(request):
     """
     Display all bank accounts the user is allowed to view
@@ -76,16 +125,22 @@ def accounts_view(request):
 #################################
 # Bank Account specific views
 #################################
-def transactions_overview(request, pk):
-    """
-    Overview of all transactions for a bank account
-    """
-    account = get_object_or_404(BankAccount, pk=pk)
-    check_user_permissions(request.user, account)
+def _get_filtered_transactions(request, account):
+    # transactions matching the filter form of the transactions overview
+    return account.get_transactions(
+        search_term=request.GET.get("q"),
+        date_start=request.GET.get("date_start"),
+        date_end=request.GET.get("date_end"),
+        amount_min=request.GET.get("amount_min"),
+        amount_max=request.GET.get("amount_max"),
+        categories=request.GET.getlist("categories"),
+    )
 
-    filter_form = FilterTransactionsForm(request.GET)
 
-    transactions = account.get_transactions(
+def _get_filtered_archived_transactions(request, account):
+    # transactions of archived years matching the filter form of the transactions overview
+    return read_archived_transactions(
+        account,
         search_term=request.GET.get("q"),
         date_start=request.GET.get("date_start"),
         date_end=request.GET.get("date_end"),
@@ -94,6 +149,22 @@ def transactions_overview(request, pk):
         categories=request.GET.getlist("categories"),
     )
 
+
+@condition_on_data_version(get_account_owner_ids)
+def transactions_overview(request, pk):
+    """
+    Overview of all transactions for a bank account
+    """
+    account = get_object_or_404(BankAccount, pk=pk)
+    check_user_permissions(request.user, account)
+
+    filter_form = FilterTransactionsForm(request.GET)
+    transactions = TransactionsWithArchive(
+        account,
+        _get_filtered_transactions(request, account),
+        _get_filtered_archived_transactions(request, account),
+    )
+
     paginator = Paginator(transactions, TRANSACTIONS_PAGE_LIMIT)
     current_page = request.GET.get("page")
     page_obj = paginator.get_page(current_page)
@@ -103,6 +174,9 @@ def transactions_overview(request, pk):
         "transactions": transactions,
         "page_obj": page_obj,
         "form": filter_form,
+        # the rendered transactions table is cached until the data of the owner changes
+        "data_version": get_data_version(account.owner_id).version,
+        "fragment_cache_timeout": settings.FRAGMENT_CACHE_TIMEOUT,
     }
 
     # Only add received/payed summary to the context if any filters were applied
@@ -131,6 +205,100 @@ def transactions_overview(request, pk):
     return render(request, "accounting/bank_account_detail.html", context)
 
 
+def transactions_export_view(request, pk, file_format):
+    """
+    Export the transactions matching the filters of the transactions overview as CSV, XLSX or Parquet file.
+    The transactions are fetched in chunks, so large accounts are never loaded into memory at once.
+    """
+    account = get_object_or_404(BankAccount, pk=pk)
+    check_user_permissions(request.user, account)
+
+    if file_format not in EXPORT_CONTENT_TYPES:
+        raise Http404("Unbekanntes Exportformat.")
+
+    rows = iter_export_rows(
+        _get_filtered_transactions(request, account),
+        _get_filtered_archived_transactions(request, account),
+    )
+    filename = f"{slugify(account.name)}-{datetime.date.today():%Y-%m-%d}.{file_format}"
+    content_type = EXPORT_CONTENT_TYPES[file_format]
+
+    if file_format == "xlsx":
+        return FileResponse(
+            write_xlsx(rows),
+            as_attachment=True,
+            filename=filename,
+            content_type=content_type,
+        )
+
+    if file_format == "csv":
+        content = stream_csv(rows)
+        content_type = f"{content_type}; charset=utf-8"
+    else:
+        content = stream_parquet(rows)
+    response = StreamingHttpResponse(content, content_type=content_type)
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
+
+
+@condition_on_data_version(get_viewable_owner_ids)
+def transactions_search_view(request):
+    """
+    Search the transactions of all bank accounts the user is allowed to view, with the filters of the transactions
+    overview and the payed/received amounts per account. Pages are selected with a cursor.
+    """
+    filter_form = FilterTransactionsForm(request.GET)
+    # invalid filters are shown in the form and not applied
+    filter_form.is_valid()
+    filters = filter_form.cleaned_data
+
+    context = {"form": filter_form}
+    if any(value for key, value in request.GET.items() if key != "cursor"):
+        accounts = get_bank_accounts_for_user(request.user)
+        transactions = search_transactions(
+            accounts,
+            search_term=request.GET.get("q"),
+            date_start=filters.get("date_start"),
+            date_end=filters.get("date_end"),
+            amount_min=filters.get("amount_min"),
+            amount_max=filters.get("amount_max"),
+            categories=filters.get("categories"),
+        )
+        try:
+            page, next_cursor = get_page(
+                transactions.select_related("bank_account", "category", "contract"),
+                TRANSACTIONS_PAGE_LIMIT,
+                cursor=request.GET.get("cursor"),
+            )
+        except ValueError:
+            raise Http404("Ungültige Seite.")
+
+        # the filters without the cursor, for the links to the first page and to the accounts
+        query = request.GET.copy()
+        query.pop("cursor", None)
+        next_query = None
+        if next_cursor:
+            next_query = query.copy()
+            next_query["cursor"] = next_cursor
+
+        context.update(
+            {
+                "transactions": page,
+                "subtotals": get_account_subtotals(transactions),
+                "query": query.urlencode(),
+                "next_query": next_query.urlencode() if next_query else None,
+                # archived years are not searched
+                "archived_years": TransactionArchive.objects.filter(
+                    bank_account__in=accounts
+                )
+                .select_related("bank_account")
+                .order_by("bank_account__name", "year"),
+            }
+        )
+
+    return render(request, "accounting/transaction_search.html", context)
+
+
 #################################
 # Transaction specific views
 #################################
@@ -143,7 +311,12 @@ def transactions_add_multiple(request, pk):
 
     if request.method == "POST":
         transactions_formset = TransactionFormSet(
-            request.POST, request.FILES, form_kwargs={"user": request.user}
+            request.POST,
+            request.FILES,
+            form_kwargs={
+                "user": request.user,
+                "archived_years": account.get_archived_years(),
+            },
         )
         if not transactions_formset.is_valid():
             return render(
@@ -183,8 +356,28 @@ def transaction_upload_csv_view(request, pk):
     if request.method == "POST":
         form = UploadFileForm(request.POST, request.FILES)
         if form.is_valid():
+            # the peak memory of the import stages is only traced for staff, tracing slows the import down
+            import_report = ImportReport(
+                account.bank.lower(), trace_memory=request.user.is_staff
+            )
             # # parse the csv file into a list of dictionaries containing all transactions
-            transactions = csv_to_transactions(request.FILES["file"], account)
+            transactions = csv_to_transactions(
+                request.FILES["file"], account, report=import_report
+            )
+            import_report.log()
+            # transactions of archived years are already stored in the archives
+            archived_years = account.get_archived_years()
+            n_transactions = len(transactions)
+            transactions = [
+                t for t in transactions if t["date_issue"].year not in archived_years
+            ]
+            if len(transactions) < n_transactions:
+                messages.add_message(
+                    request,
+                    messages.WARNING,
+                    f"{n_transactions - len(transactions)} Transaktionen aus archivierten Jahren "
+                    f"({', '.join(str(year) for year in sorted(archived_years))}) wurden übersprungen.",
+                )
             # # display the transactions and allow modifications before saving them to the database
             transactions_formset = TransactionFormSet(
                 initial=transactions, form_kwargs={"user": request.user}
@@ -192,7 +385,11 @@ def transaction_upload_csv_view(request, pk):
             return render(
                 request,
                 "accounting/transaction_formset.html",
-                {"formset": transactions_formset, "account": account},
+                {
+                    "formset": transactions_formset,
+                    "account": account,
+                    "import_report": import_report if request.user.is_staff else None,
+                },
             )
     else:
         form = UploadFileForm()
@@ -287,9 +484,60 @@ def reassign_categories(request, pk):
     return redirect("transactions", pk=pk)
 
 
+def recurring_payments_view(request, pk):
+    """
+    Propose contracts for recurring payments of the bank account and create the selected ones
+    """
+    account = get_object_or_404(BankAccount, pk=pk)
+    check_user_permissions(request.user, account)
+
+    proposals = detect_recurring_payments(account)
+
+    if request.method == "POST":
+        selected = set(request.POST.getlist("proposals"))
+        contracts = create_contracts_from_proposals(
+            [p for p in proposals if p["key"] in selected], owner=account.owner
+        )
+        messages.add_message(
+            request,
+            messages.SUCCESS,
+            f"{len(contracts)} Verträge angelegt.",
+        )
+        return redirect("contracts")
+
+    return render(
+        request,
+        "accounting/recurring_payments.html",
+        {"account": account, "proposals": proposals},
+    )
+
+
+def _has_metrics_token(request):
+    token = settings.METRICS_TOKEN
+    if not token:
+        return False
+    return hmac.compare_digest(
+        request.headers.get("Authorization", ""), f"Bearer {token}"
+    )
+
+
+@login_not_required
+def metrics_view(request):
+    """
+    Metrics of the import and chart hot paths in the Prometheus text format, for staff users and scrapers
+    with the METRICS_TOKEN
+    """
+    if not request.user.is_staff and not _has_metrics_token(request):
+        raise PermissionDenied()
+
+    content, content_type = generate_metrics()
+    return HttpResponse(content, content_type=content_type)
+
+
 #################################
 # Depot views
 #################################
+@condition_on_data_version(get_depot_owner_ids)
 def depot_overview(request, pk):
     """
     Overview of all transactions for a bank account
@@ -297,16 +545,66 @@ def depot_overview(request, pk):
     depot = get_object_or_404(BankDepot, pk=pk)
     check_user_permissions(request.user, depot)
 
-    assets = depot.get_assets()
+    # fetch all assets with their invested amount and transactions in a fixed number of queries
+    assets = (
+        depot.get_assets()
+        .select_related("bank_depot")
+        .annotate(invested_amount=Sum("belongs_to__amount"))
+        .prefetch_related(
+            Prefetch(
+                "belongs_to",
+                queryset=DepotAssetTransaction.objects.order_by("-date_issue"),
+                to_attr="transactions",
+            )
+        )
+        .order_by("name")
+    )
 
-    transactions = {}
+    # money- and time-weighted returns in percent per asset
+    returns = get_asset_returns(assets)
     for asset in assets:
-        transactions[asset] = asset.get_transactions()
+        for key, value in returns.get(asset.pk, {}).items():
+            setattr(asset, key, value * 100 if value is not None else None)
 
-    context = {"depot": depot, "transactions": transactions}
+    context = {"depot": depot, "assets": assets, "balance": depot.get_balance()}
     return render(request, "accounting/bank_depot_detail.html", context)
 
 
+def depot_upload_csv_view(request, pk):
+    """
+    View that allows importing a csv export containing depot transactions and valuations
+    """
+    depot = get_object_or_404(BankDepot, pk=pk)
+    check_user_permissions(request.user, depot)
+
+    if request.method == "POST":
+        form = UploadFileForm(request.POST, request.FILES)
+        if form.is_valid():
+            try:
+                n_transactions, n_valuations = import_depot_csv(
+                    request.FILES["file"], depot
+                )
+            except (ValueError, pd.errors.ParserError, UnicodeDecodeError):
+                # missing columns, unparsable values or another encoding than UTF-8
+                form.add_error(
+                    "file",
+                    "Die Datei konnte nicht gelesen werden. Erwartet wird eine UTF-8 kodierte CSV Datei "
+                    "mit den Spalten Datum;Anlage;Umsatz;Bewertung.",
+                )
+            else:
+                messages.add_message(
+                    request,
+                    messages.INFO,
+                    f"{n_transactions} Transaktionen und {n_valuations} Bewertungen importiert.",
+                )
+                return redirect("depot-detail", pk=pk)
+    else:
+        form = UploadFileForm()
+    return render(
+        request, "accounting/depot_upload_form.html", {"form": form, "depot": depot}
+    )
+
+
 def display_asset_form(request, asset=None):
     asset_form = AssetForm(instance=asset)
     return render(
@@ -413,9 +711,18 @@ def charts_view(request):
 # Contract views
 ##########################
 def contracts_view(request):
-    contracts = get_contracts_for_user(request.user)
-    active_contracts = contracts.filter(is_active=True)
-    inactive_contracts = contracts.filter(is_active=False)
+    contracts = annotate_contract_statistics(get_contracts_for_user(request.user))
+
+    # a single query for all contracts, split into active and finished contracts afterwards
+    active_contracts = []
+    inactive_contracts = []
+    for contract in contracts:
+        if contract.balance is not None:
+            contract.balance = round_amount(contract.balance)
+        if contract.is_active:
+            active_contracts.append(contract)
+        else:
+            inactive_contracts.append(contract)
     return render(
         request,
         "accounting/contracts.html",
@@ -426,6 +733,19 @@ def contracts_view(request):
     )
 
 
+@require_POST
+def apply_contract_rules_view(request):
+    n_linked = apply_contract_rules(request.user)
+
+    messages.add_message(
+        request,
+        level=messages.SUCCESS,
+        message=f"{n_linked} Transaktionen Verträgen zugeordnet.",
+    )
+
+    return redirect("contracts")
+
+
 def display_contract_form(request, contract=None):
     form = ContractForm(
         instance=contract, user=request.user, initial={"owner": request.user.pk}
@@ -462,27 +782,22 @@ def create_contract(request):
         return process_contract_form(request)
 
 
+@condition_on_data_version(get_contract_owner_ids)
 def contract_detail_view(request, pk):
-    contract = get_object_or_404(Contract, pk=pk)
+    contract = get_object_or_404(
+        annotate_contract_statistics(Contract.objects.all()), pk=pk
+    )
     check_user_permissions(request.user, contract)
-
-    transactions = contract.get_transactions()
-
-    if transactions:
-        first_transaction = transactions[len(transactions) - 1]
-        last_transaction = transactions[0]
-    else:
-        first_transaction = None
-        last_transaction = None
+    if contract.balance is not None:
+        contract.balance = round_amount(contract.balance)
 
     return render(
         request,
         "accounting/contract_detail.html",
         {
             "contract": contract,
-            "transactions": transactions,
-            "first_transaction": first_transaction,
-            "last_transaction": last_transaction,
+            "transactions": contract.get_transactions().select_related("bank_account"),
+            "files": contract.get_files(),
         },
     )
 
@@ -508,3 +823,88 @@ def add_files_to_contract(request, pk):
             )
         formset.save()
         return redirect("contract-detail", pk=pk)
+
+
+def _parse_range_header(range_header, size):
+    # only a single byte range is supported, e.g. "bytes=0-1023", "bytes=1024-" or "bytes=-500"
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", range_header.strip())
+    if not match or not any(match.groups()):
+        return None
+
+    start, end = match.groups()
+    if not start:
+        start, end = max(size - int(end), 0), size - 1
+    else:
+        start, end = int(start), min(int(end), size - 1) if end else size - 1
+
+    if start > end or start >= size:
+        return None
+    return start, end
+
+
+def _iter_file_range(file, start, end):
+    file.seek(start)
+    remaining = end - start + 1
+    while remaining > 0:
+        chunk = file.read(min(CONTRACT_FILE_CHUNK_SIZE, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        yield chunk
+    file.close()
+
+
+def contract_file_download_view(request, pk):
+    """
+    Stream a contract file. Supports single byte range requests (e.g. for the pdf viewer) and
+    conditional requests via ETag.
+    """
+    contract_file = get_object_or_404(
+        ContractFile.objects.select_related("contract__owner"), pk=pk
+    )
+    check_user_permissions(request.user, contract_file.contract)
+
+    storage = contract_file.file.storage
+    name = contract_file.file.name
+    if not storage.exists(name):
+        raise Http404("Datei nicht gefunden.")
+
+    size = storage.size(name)
+    content_hash = storage.get_content_hash(name)
+    if content_hash is None:
+        # files stored before content addressing
+        content_hash = f"{size}-{int(storage.get_modified_time(name).timestamp())}"
+    etag = quote_etag(content_hash)
+
+    response = get_conditional_response(request, etag=etag)
+    if response is not None:
+        return response
+
+    file = storage.open(name, "rb")
+    byte_range = None
+    if "HTTP_RANGE" in request.META:
+        if_range = request.META.get("HTTP_IF_RANGE")
+        if if_range is None or if_range == etag:
+            byte_range = _parse_range_header(request.META["HTTP_RANGE"], size)
+            if byte_range is None:
+                file.close()
+                response = HttpResponse(status=416)
+                response["Content-Range"] = f"bytes */{size}"
+                return response
+
+    if byte_range is None:
+        response = FileResponse(file, filename=contract_file.filename)
+    else:
+        start, end = byte_range
+        response = StreamingHttpResponse(
+            _iter_file_range(file, start, end),
+            status=206,
+            content_type=mimetypes.guess_type(name)[0] or "application/octet-stream",
+        )
+        response["Content-Length"] = str(end - start + 1)
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+    response["Accept-Ranges"] = "bytes"
+    response["ETag"] = etag
+    response["Cache-Control"] = "private, max-age=0, must-revalidate"
+    return response
@@ -51,12 +51,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "accounting.instrumentation.RequestInstrumentationMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "accounting.profiling.ProfilingMiddleware",
     "django.contrib.auth.middleware.LoginRequiredMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django_plotly_dash.middleware.BaseMiddleware",
@@ -92,9 +94,31 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        # keep connections open between requests of a worker
+        "CONN_MAX_AGE": 600,
+        "CONN_HEALTH_CHECKS": True,
+        "OPTIONS": {
+            # take the write lock at the start of a transaction instead of failing when a read
+            # transaction is upgraded while another connection writes
+            "transaction_mode": "IMMEDIATE",
+        },
     }
 }
 
+# Applied to every new SQLite connection (see accounting/sqlite.py). With WAL readers are not blocked by a
+# running import and the import is not blocked by readers.
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    # safe with WAL, the last transactions might be lost on power loss but the database stays consistent
+    "synchronous": "NORMAL",
+    # wait up to 5 s for locks instead of failing with "database is locked"
+    "busy_timeout": 5000,
+    # page cache of 64 MiB (negative values are KiB) and up to 256 MiB memory mapped I/O
+    "cache_size": -64000,
+    "mmap_size": 256 * 1024 * 1024,
+    "temp_store": "MEMORY",
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
@@ -175,6 +199,50 @@ PLOTLY_DASH = {
     "serve_locally": False,
 }
 
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        "accounting": {"handlers": ["console"], "level": "INFO"},
+    },
+}
+
+# Number of threads used to build the figures of multi-output chart callbacks concurrently.
+# Set to 1 to build the figures sequentially in the request thread.
+CHARTS_FIGURE_WORKERS = min(4, os.cpu_count() or 1)
+
+# Record SQL queries, template rendering and Dash callback timings of every request, send them as
+# Server-Timing header and log them as JSON lines (logger "accounting.instrumentation").
+REQUEST_INSTRUMENTATION = False
+# number of slowest queries (with the line of code that triggered them) logged per request
+REQUEST_INSTRUMENTATION_SLOWEST_QUERIES = 5
+
+# The Prometheus metrics (/metrics) are only served to staff users and to scrapers sending the header
+# "Authorization: Bearer <METRICS_TOKEN>". Without a token only staff users can read them.
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+
+# Staff users can profile single requests with ?_profile=1 or the header "X-Profile: 1" (see
+# accounting/profiling.py). The profiles are written to this directory as speedscope JSON.
+PROFILING_DIR = BASE_DIR / "profiles"
+# number of functions with the highest self time logged per profile
+PROFILING_TOP_FUNCTIONS = 20
+# Calls of the standard library and installed packages (Django, pandas, ...) are only recorded with ?_profile=full
+# or PROFILING_INCLUDE_LIBRARIES. The profiling of a request stops after PROFILING_MAX_EVENTS call/return events.
+PROFILING_INCLUDE_LIBRARIES = False
+PROFILING_MAX_EVENTS = 200_000
+
+# Rendered fragments of the account pages (e.g. the transactions table) are cached in the cache "fragments"
+# for FRAGMENT_CACHE_TIMEOUT seconds, keyed by the data version of the owner. Disabled with the dummy cache,
+# use e.g. "django.core.cache.backends.locmem.LocMemCache" to enable it.
+CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "fragments": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"},
+}
+FRAGMENT_CACHE_TIMEOUT = 300
+
 # Staticfiles finders for locating dash app assets and related files
 
 STATICFILES_FINDERS = [